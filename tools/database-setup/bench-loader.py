@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Loader benchmark: loads synthetic datasets at several scale factors through
+load-data-real.py's load_data_to_sqlite() and sweeps batch size, journal mode,
+page size, cache size, geometry input form (WKT, WKB or SpatiaLite
+BLOB) and trigger-built vs packed R-trees. Each case runs in its own
+subprocess against a fresh DB so peak RSS and file size are per case.
+
+Results are written as JSON and CSV under bench_results/.
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOADER_PATH = os.path.join(HERE, "load-data-real.py")
+OUT_DIR = "bench_results"
+
+# scale factor 1 = BASE_SITES sites and BASE_SITES * LINKS_PER_SITE links
+SCALES = [1, 5, 20]
+BASE_SITES = 2000
+LINKS_PER_SITE = 5
+
+BASELINE = {
+    "batch_size": 50000,
+    "journal_mode": "WAL",
+    "page_size": 4096,
+    "cache_size": -200000,
+    "geom_format": "wkt",
+    "packed_rtree": False,
+}
+SWEEP = {
+    "batch_size": [1000, 10000, 50000, 200000],
+    "journal_mode": ["WAL", "DELETE", "MEMORY", "OFF"],
+    "page_size": [4096, 8192, 16384, 65536],
+    "cache_size": [-2000, -64000, -200000, -1000000],
+    "geom_format": ["wkt", "wkb", "blob"],
+    "packed_rtree": [False, True],
+}
+
+RESULT_FIELDS = [
+    "scale", "sites", "links", "batch_size", "journal_mode", "page_size", "cache_size",
+    "geom_format", "packed_rtree", "ok", "rows", "insert_s", "rows_per_s", "spatial_index_s", "perf_index_s",
+    "index_build_s", "analyze_s", "total_s", "db_bytes", "peak_rss_bytes",
+]
+
+
+def load_loader():
+    spec = importlib.util.spec_from_file_location("load_data_real", LOADER_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod  # so process-pool workers can unpickle its functions
+    spec.loader.exec_module(mod)
+    return mod
+
+
+# ---------- Synthetic data ----------
+
+def make_dataset(scale, out_dir, seed=42):
+    """Write sites.json / links.json shaped like the generator output; returns (n_sites, n_links)."""
+    rnd = random.Random(seed)
+    n_sites = BASE_SITES * scale
+    n_links = n_sites * LINKS_PER_SITE
+    now = "2025-01-01T00:00:00"
+
+    cities = [(rnd.uniform(-50, 65), rnd.uniform(-170, 170)) for _ in range(max(10, n_sites // 40))]
+    sites = []
+    for i in range(n_sites):
+        clat, clon = rnd.choice(cities)
+        sites.append({
+            "site_id": f"SITE_{i+1:07d}", "site_virtual_name": f"PoP-{i%100}",
+            "site_name": f"Site-{i%100}", "country": "Benchland", "city": f"City-{hash((clat,clon))%1000}",
+            "platform": "Cisco ASR9000", "network": "Metro Network",
+            "latitude": round(clat + rnd.uniform(-0.2, 0.2), 6),
+            "longitude": round(clon + rnd.uniform(-0.2, 0.2), 6),
+            "last_modified_at": now, "is_deleted": 0,
+        })
+
+    with open(os.path.join(out_dir, "sites.json"), "w") as f:
+        json.dump(sites, f, indent=2)
+
+    with open(os.path.join(out_dir, "links.json"), "w") as f:
+        f.write("[\n")
+        for i in range(n_links):
+            a, b = rnd.sample(sites, 2)
+            n_mid = rnd.randint(2, 20)
+            pts = [(a["longitude"], a["latitude"])]
+            for k in range(1, n_mid + 1):
+                t = k / (n_mid + 1)
+                pts.append((a["longitude"] + t * (b["longitude"] - a["longitude"]) + rnd.uniform(-0.01, 0.01),
+                            a["latitude"] + t * (b["latitude"] - a["latitude"]) + rnd.uniform(-0.01, 0.01)))
+            pts.append((b["longitude"], b["latitude"]))
+            link = {
+                "link_id": f"LINK_{i+1:07d}", "site_a_id": a["site_id"], "site_b_id": b["site_id"],
+                "link_type": "Metro Network", "link_distance": round(math.dist(pts[0], pts[-1]) * 111, 1),
+                "link_kmz_no": "0",
+                "link_wkt": "LINESTRING(" + ", ".join(f"{x:.6f} {y:.6f}" for x, y in pts) + ")",
+                "last_modified_at": now, "is_deleted": 0,
+            }
+            f.write(("," if i else "") + json.dumps(link, indent=2) + "\n")
+        f.write("]\n")
+    return n_sites, n_links
+
+
+# ---------- Cases ----------
+
+def build_cases(full_grid=False):
+    """One-factor-at-a-time around BASELINE (default), or the full cartesian product."""
+    if full_grid:
+        cases = [{}]
+        for key, values in SWEEP.items():
+            cases = [{**c, key: v} for c in cases for v in values]
+        return cases
+    cases = []; seen = set()
+    for key, values in SWEEP.items():
+        for v in values:
+            c = {**BASELINE, key: v}
+            sig = tuple(sorted(c.items()))
+            if sig not in seen:
+                seen.add(sig); cases.append(c)
+    return cases
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_case(case):
+    """Child process: load the dataset in case['data_dir'] into a fresh DB and print stats as JSON."""
+    loader = load_loader()
+    db_path = os.path.join(case["work_dir"], "bench.sqlite")
+    loader.remove_db_files(db_path)
+    sqlite_file = open(db_path, "wb"); sqlite_file.close()  # loader requires an existing file
+
+    stats = {}
+    ok = loader.load_data_to_sqlite(
+        batch_size=case["batch_size"], geom_format=case["geom_format"],
+        packed_rtree=case.get("packed_rtree", False),
+        pragmas={"journal_mode": case["journal_mode"], "cache_size": case["cache_size"]},
+        page_size=case["page_size"], db_path=db_path,
+        sites_json=os.path.join(case["data_dir"], "sites.json"),
+        links_json=os.path.join(case["data_dir"], "links.json"),
+        stats=stats,
+    )
+    stats["ok"] = bool(ok)
+    stats["peak_rss_bytes"] = peak_rss_bytes()
+    loader.remove_db_files(db_path)
+    print(json.dumps(stats))
+
+
+def bench(scales, full_grid=False, out_dir=OUT_DIR):
+    os.makedirs(out_dir, exist_ok=True)
+    cases = build_cases(full_grid)
+    logger.info(f"🏁 {len(cases)} cases x {len(scales)} scales")
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix=f"bench_s{scale}_") as tmp:
+            t0 = time.time()
+            n_sites, n_links = make_dataset(scale, tmp)
+            logger.info(f"📦 scale={scale}: {n_sites} sites, {n_links} links generated in {time.time()-t0:.1f}s")
+            for i, case in enumerate(cases, start=1):
+                payload = {**case, "data_dir": tmp, "work_dir": tmp}
+                res = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(payload)],
+                                     capture_output=True, text=True, cwd=tmp)
+                stats = {}
+                if res.returncode == 0 and res.stdout.strip():
+                    stats = json.loads(res.stdout.strip().splitlines()[-1])
+                else:
+                    logger.error(f"❌ case failed: {case}\n{res.stderr[-2000:]}")
+                insert_s = stats.get("insert_s") or 0
+                row = {
+                    "scale": scale, "sites": n_sites, "links": n_links, **case,
+                    "ok": stats.get("ok", False), "rows": stats.get("rows"),
+                    "insert_s": stats.get("insert_s"),
+                    "rows_per_s": round(stats["rows"] / insert_s, 1) if insert_s and stats.get("rows") else None,
+                    "spatial_index_s": stats.get("spatial_index_s"), "perf_index_s": stats.get("perf_index_s"),
+                    "index_build_s": (stats.get("spatial_index_s") or 0) + (stats.get("perf_index_s") or 0),
+                    "analyze_s": stats.get("analyze_s"), "total_s": stats.get("total_s"),
+                    "db_bytes": stats.get("db_bytes"), "peak_rss_bytes": stats.get("peak_rss_bytes"),
+                }
+                results.append(row)
+                logger.info(f"   [{i}/{len(cases)}] {case} -> {row['rows_per_s']} rows/s, "
+                            f"index {row['index_build_s']:.2f}s, {(row['db_bytes'] or 0)/1024/1024:.1f} MB")
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    json_path = os.path.join(out_dir, f"loader-bench-{stamp}.json")
+    csv_path = os.path.join(out_dir, f"loader-bench-{stamp}.csv")
+    with open(json_path, "w") as f:
+        json.dump(results, f, indent=2)
+    with open(csv_path, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        w.writeheader(); w.writerows(results)
+    logger.info(f"💾 Wrote {json_path} and {csv_path}")
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    ap.add_argument("--full-grid", action="store_true", help="cartesian product of all sweep values")
+    ap.add_argument("--out", default=OUT_DIR)
+    ap.add_argument("--case", help=argparse.SUPPRESS)  # internal: run one case in this process
+    args = ap.parse_args()
+    if args.case:
+        run_case(json.loads(args.case))
+    else:
+        bench(args.scales, args.full_grid, os.path.abspath(args.out))
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import json
 import math
 import random
 import logging
@@ -8,6 +7,9 @@ import multiprocessing as mp
 from datetime import datetime
 from typing import List, Tuple, Dict, Any
 
+from geo_kernel import haversine_km, haversine_one_to_many, first_in_range
+from record_stream import RecordFiles
+
 # --------------------
 # Logging
 # --------------------
@@ -25,6 +27,9 @@ random.seed(42)
 
 OUTPUT_DIR = "data"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Output files: "json" arrays or "ndjson" lines, optionally "gzip"/"zstd" compressed (record_stream.py)
+OUTPUT_FORMAT = "json"
+OUTPUT_COMPRESSION = None
 
 # Sites per city
 HOT_CITIES = {"London", "New York", "Tokyo", "Delhi", "São Paulo"}
@@ -182,13 +187,6 @@ def jitter_latlon(lat: float, lon: float, km: float=5.0) -> Tuple[float,float]:
     dlon = (km/(111.0*max(0.2, math.cos(math.radians(lat))))) * (random.random()-0.5) * 2
     return lat + dlat, lon + dlon
 
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
-    R=6371.0088
-    dlat=math.radians(lat2-lat1)
-    dlon=math.radians(lon2-lon1)
-    a=math.sin(dlat/2)**2 + math.cos(math.radians(lat1))*math.cos(math.radians(lat2))*math.sin(dlon/2)**2
-    return 2*R*math.asin(math.sqrt(a))
-
 def geodesic_points(lat1, lon1, lat2, lon2, n=10, jitter=0.0):
     pts=[]
     for i in range(1, n):
@@ -311,31 +309,20 @@ def pick_pairs_within(sites, kdtree, pts, min_km, max_km, num_pairs, forbid_same
             candidates = list(range(n))
         if kdtree is None:
             rnd.shuffle(candidates)
-            found=None
-            for j in candidates[:300]:
-                sj=sites[j]
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km:
-                    found=j; break
-            if found is None:
-                attempts+=1; continue
-            out.append((i,found))
+            cand = candidates[:300]
         else:
             rad=max_km/111.0
             idxs = kdtree.query_radius([[si["latitude"], si["longitude"]]], r=rad)[0].tolist()
             rnd.shuffle(idxs)
-            found=None
-            for j in idxs:
-                if j==i: continue
-                sj=sites[j]
-                if forbid_same_city and sj["city"]==si["city"] and sj["country"]==si["country"]:
-                    continue
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km:
-                    found=j; break
-            if found is None:
-                attempts+=1; continue
-            out.append((i,found))
+            cand = [j for j in idxs if j!=i and not
+                    (forbid_same_city and sites[j]["city"]==si["city"] and sites[j]["country"]==si["country"])]
+        # first candidate in range, distances computed in one vectorized pass
+        k = first_in_range(haversine_one_to_many(si["latitude"], si["longitude"],
+                                                 [sites[j]["latitude"] for j in cand],
+                                                 [sites[j]["longitude"] for j in cand]), min_km, max_km)
+        if k < 0:
+            attempts+=1; continue
+        out.append((i,cand[k]))
         attempts+=1
     return out
 
@@ -452,25 +439,21 @@ def main(
 
     logger.info(f"🧮 Total link targets across tiers: {sum(b for _,b, *_ in work)}")
 
-    links=[]
+    # Sites are written up front and each tier's links as it completes, renumbered in order
+    files = RecordFiles(OUTPUT_DIR, OUTPUT_FORMAT, OUTPUT_COMPRESSION)
+    files("sites", sites)
+    n_links = 0
     if work:
         with mp.Pool(processes=processes) as pool:
-            results = pool.map(gen_links_for_tier, work)
-        lid=1
-        for lst in results:
-            for L in lst:
-                L["link_id"] = f"LINK_{lid:06d}"
-                lid+=1
-                links.append(L)
-
-    logger.info(f"📈 Generated totals: sites={len(sites)} links={len(links)} (target {TOTAL_LINKS})")
-
-    with open(os.path.join(OUTPUT_DIR,'sites.json'),'w') as f:
-        json.dump(sites, f, indent=2)
-    with open(os.path.join(OUTPUT_DIR,'links.json'),'w') as f:
-        json.dump(links, f, indent=2)
-
-    logger.info(f"💾 Wrote {OUTPUT_DIR}/sites.json and {OUTPUT_DIR}/links.json")
+            for lst in pool.imap(gen_links_for_tier, work):
+                for L in lst:
+                    n_links += 1
+                    L["link_id"] = f"LINK_{n_links:06d}"
+                files("links", lst)
+    files.close()
+
+    logger.info(f"📈 Generated totals: sites={len(sites)} links={n_links} (target {TOTAL_LINKS})")
+    logger.info(f"💾 Wrote {files.path('sites')} and {files.path('links')}")
     logger.info("🎉 Generation complete")
 
 if __name__ == "__main__":
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
-import os, json, math, random, logging, multiprocessing as mp
+import os, math, random, logging, multiprocessing as mp
 from datetime import datetime
 from typing import List, Tuple, Dict, Any
 from collections import defaultdict, deque
 
+from geo_kernel import (haversine_km, planar_bearing_deg, haversine_one_to_many,
+                        first_in_range, k_smallest, closest_to_in_range, coord_arrays)
+from record_stream import RecordFiles
+
 # -------------------- Logging --------------------
 logging.basicConfig(
     level=logging.INFO,
@@ -16,6 +20,9 @@ logger = logging.getLogger(__name__)
 random.seed(42)
 OUTPUT_DIR = "data"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Output files: "json" arrays or "ndjson" lines, optionally "gzip"/"zstd" compressed (record_stream.py)
+OUTPUT_FORMAT = "json"
+OUTPUT_COMPRESSION = None
 
 HOT_CITIES = {"London","New York","Tokyo","Delhi","São Paulo"}
 HUB_CITIES = {
@@ -228,13 +235,6 @@ def jitter_latlon(lat: float, lon: float, km: float=5.0) -> Tuple[float,float]:
     dlon = (km/(111.0*max(0.2, math.cos(math.radians(lat))))) * (random.random()-0.5) * 2
     return lat + dlat, lon + dlon
 
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
-    R = 6371.0088
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(a))
-
 def interpolate_points(a_lat, a_lon, b_lat, b_lon, n_mid: int, jitter_km: float) -> List[Tuple[float,float]]:
     pts=[]
     for i in range(1, n_mid+1):
@@ -370,25 +370,16 @@ def pick_pairs_within(sites, kdtree, pts, min_km, max_km, num_pairs, forbid_same
         else:
             candidates = list(range(n))
         if kdtree is None:
-            rnd.shuffle(candidates); found=None
-            for j in candidates[:400]:
-                sj=sites[j]
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km: found=j; break
-            if found is None: attempts+=1; continue
-            out.append((i,found))
+            rnd.shuffle(candidates); cand=candidates[:400]
         else:
             rad=max_km/111.0
             idxs = kdtree.query_radius([[si["latitude"], si["longitude"]]], r=rad)[0].tolist()
-            rnd.shuffle(idxs); found=None
-            for j in idxs:
-                if j==i: continue
-                sj=sites[j]
-                if forbid_same_city and sj["city"]==si["city"] and sj["country"]==si["country"]: continue
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km: found=j; break
-            if found is None: attempts+=1; continue
-            out.append((i,found))
+            rnd.shuffle(idxs)
+            cand = [j for j in idxs if j!=i and not (forbid_same_city and sites[j]["city"]==si["city"] and sites[j]["country"]==si["country"])]
+        k = first_in_range(haversine_one_to_many(si["latitude"], si["longitude"],
+                                                 [sites[j]["latitude"] for j in cand], [sites[j]["longitude"] for j in cand]), min_km, max_km)
+        if k < 0: attempts+=1; continue
+        out.append((i,cand[k]))
         attempts+=1
     return out
 
@@ -428,11 +419,10 @@ def choose_hub_waypoints(tier: str, A: Dict[str,Any], B: Dict[str,Any], sites: L
 
     def nearest_city_site(city: str, lat0: float, lon0: float):
         if city not in by_city: return None
-        best=None; bd=1e9
-        for s in by_city[city]:
-            d=haversine_km(lat0,lon0,s["latitude"],s["longitude"])
-            if d<bd: bd=d; best=s
-        return (best["latitude"], best["longitude"]) if best else None
+        lst = by_city[city]
+        d = haversine_one_to_many(lat0, lon0, [s["latitude"] for s in lst], [s["longitude"] for s in lst])
+        best = lst[k_smallest(d, 1)[0]]
+        return (best["latitude"], best["longitude"])
 
     a_lat,a_lon = A["latitude"],A["longitude"]
     b_lat,b_lon = B["latitude"],B["longitude"]
@@ -526,21 +516,17 @@ def build_metro_links(sites: List[Dict[str,Any]], k_neighbors: int = 4) -> List[
                     j = idxs[nnpos]
                     if i<j: pairs.append((i,j))
         else:
+            lats, lons = coord_arrays(pts)
             for ai,i in enumerate(idxs):
-                dists=[]
-                for bj,j in enumerate(idxs):
-                    if i==j: continue
-                    d=haversine_km(sites[i]["latitude"],sites[i]["longitude"],sites[j]["latitude"],sites[j]["longitude"])
-                    dists.append((d,j))
-                dists.sort(key=lambda x:x[0])
-                for _,j in dists[:k_neighbors]:
+                dists = haversine_one_to_many(pts[ai][0], pts[ai][1], lats, lons)
+                for bj in [b for b in k_smallest(dists, k_neighbors+1) if b != ai][:k_neighbors]:
+                    j = idxs[bj]
                     if i<j: pairs.append((i,j))
     return pairs
 
 # -------------------- Caps bookkeeping --------------------
 def bearing_deg(a: Dict[str,Any], b: Dict[str,Any]) -> float:
-    dy=b["latitude"]-a["latitude"]; dx=b["longitude"]-a["longitude"]
-    return (math.degrees(math.atan2(dy, dx)) + 360.0) % 360.0
+    return planar_bearing_deg(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
 
 def ok_by_caps(tier: str, A: Dict[str,Any], B: Dict[str,Any],
                deg_by_tier: Dict[str,Dict[str,int]],
@@ -632,16 +618,15 @@ def connected_components(adj, site_ids):
     return comps
 
 def pick_best_neighbor(site_id, sites_by_id, candidates, tier_name, avoid_set):
-    A = sites_by_id[site_id]; a= (A["latitude"], A["longitude"])
+    if not candidates: return None
+    A = sites_by_id[site_id]
     dmin,dmax = TIER_RANGES.get(tier_name,(1,2000))
-    scored=[]
-    for bid in candidates:
-        if bid == site_id or bid in avoid_set: continue
-        B = sites_by_id[bid]; d=haversine_km(a[0],a[1],B["latitude"],B["longitude"])
-        if d < dmin or d > dmax: continue
-        scored.append((abs(d-(dmin+dmax)/2), bid, d))
-    scored.sort(key=lambda x:x[0])
-    return scored[0] if scored else None
+    lats, lons = coord_arrays([(sites_by_id[b]["latitude"], sites_by_id[b]["longitude"]) for b in candidates])
+    dists = haversine_one_to_many(A["latitude"], A["longitude"], lats, lons)
+    skip = set(avoid_set) | {site_id}
+    k = closest_to_in_range(dists, dmin, dmax, (dmin+dmax)/2, [k for k, b in enumerate(candidates) if b in skip])
+    if k < 0: return None
+    return (abs(float(dists[k])-(dmin+dmax)/2), candidates[k], float(dists[k]))
 
 def heal_isolated_and_low_degree(sites, links, min_degree=1, important_min_degree=2, super_hubs_by_region=None):
     sites_by_id = {s["site_id"]: s for s in sites}
@@ -756,46 +741,46 @@ def main(
                          sites, seed_base, bool(forbid_same_city), bool(enforce_policy),
                          super_hubs_by_region))
 
-    links=[]
+    # Links are written as each stage produces them, numbered in output order; healing and
+    # bridging only need the endpoints of what came before, so only those are kept
+    files = RecordFiles(OUTPUT_DIR, OUTPUT_FORMAT, OUTPUT_COMPRESSION)
+    files("sites", sites)
+    ends=[]
+    def emit(batch):
+        for L in batch:
+            L["link_id"]=f"LINK_{len(ends)+1:06d}"
+            ends.append({"site_a_id":L["site_a_id"],"site_b_id":L["site_b_id"]})
+        files("links", batch)
+
     if work:
         with mp.Pool(processes=processes) as pool:
-            results = pool.map(gen_links_for_tier, work)
-        for lst in results: links.extend(lst)
+            for lst in pool.imap(gen_links_for_tier, work): emit(lst)
 
     # Add metro ring edges first (as Metro Network) but respect ranges/caps
     deg_by_tier = defaultdict(dict); pair_counts={}; sector_counts={}
-    add_count=0
+    seeds=[]
     for i,j in metro_pairs:
-        if add_count >= int(LINK_BUDGET["Metro Network"] * 0.3): break  # allocate ~30% to clean rings
+        if len(seeds) >= int(LINK_BUDGET["Metro Network"] * 0.3): break  # allocate ~30% to clean rings
         A=sites[i]; B=sites[j]
         if not ok_by_caps("Metro Network", A, B, deg_by_tier, pair_counts, sector_counts): continue
         dist,wkt = make_routed_geometry("Metro Network", A, B, sites, super_hubs_by_region)
         if dist<0: continue
         bump_caps("Metro Network", A, B, deg_by_tier, pair_counts, sector_counts)
-        links.append({"link_id": f"MetroSeed__TMP_{add_count+1:06d}",
+        seeds.append({"link_id": f"MetroSeed__TMP_{len(seeds)+1:06d}",
                       "site_a_id":A["site_id"],"site_b_id":B["site_id"],
                       "link_type":"Metro Network","link_distance":dist,
                       "link_kmz_no":"0","link_wkt":wkt,
                       "last_modified_at":ts(),"is_deleted":0})
-        add_count+=1
-    if add_count: logger.info(f"🏙️ Seeded {add_count} metro ring links")
-
-    # Assign clean sequential IDs
-    for idx,L in enumerate(links, start=1): L["link_id"]=f"LINK_{idx:06d}"
+    emit(seeds)
+    if seeds: logger.info(f"🏙️ Seeded {len(seeds)} metro ring links")
 
     # Healing and component connectivity
-    healed = heal_isolated_and_low_degree(sites, links, min_degree=1, important_min_degree=2, super_hubs_by_region=super_hubs_by_region)
-    links.extend(healed)
-    bridges = connect_components(sites, links, super_hubs_by_region)
-    links.extend(bridges)
-
-    # Re-ID after additions
-    for idx,L in enumerate(links, start=1): L["link_id"]=f"LINK_{idx:06d}"
-
-    logger.info(f"📈 Final totals: sites={len(sites)} links={len(links)} (target {TOTAL_LINKS})")
-    with open(os.path.join(OUTPUT_DIR,'sites.json'),'w') as f: json.dump(sites, f, indent=2)
-    with open(os.path.join(OUTPUT_DIR,'links.json'),'w') as f: json.dump(links, f, indent=2)
-    logger.info(f"💾 Wrote {OUTPUT_DIR}/sites.json and {OUTPUT_DIR}/links.json")
+    emit(heal_isolated_and_low_degree(sites, ends, min_degree=1, important_min_degree=2, super_hubs_by_region=super_hubs_by_region))
+    emit(connect_components(sites, ends, super_hubs_by_region))
+    files.close()
+
+    logger.info(f"📈 Final totals: sites={len(sites)} links={len(ends)} (target {TOTAL_LINKS})")
+    logger.info(f"💾 Wrote {files.path('sites')} and {files.path('links')}")
     logger.info("🎉 Generation complete")
 
 if __name__ == "__main__":
@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
-import os, json, math, random, logging, multiprocessing as mp
+import os, json, math, random, sqlite3, zlib, argparse, logging, multiprocessing as mp
+from itertools import zip_longest
 from datetime import datetime
 from typing import List, Tuple, Dict, Any
-from collections import defaultdict, deque
+from collections import defaultdict
+
+from geo_kernel import (haversine_km, planar_bearing_deg, haversine_one_to_many, closest_to_in_range,
+                        as_array, take, k_smallest, build_sphere_index, annulus_query, nearest_k,
+                        nearest_to_distance, densify_paths, project_on_segment_many)
+from geom_codec import format_linestrings, linestrings_coords
+from net_model import (SITE_CATEGORICALS, site_table, add_column, code_of, name_of, column_list, positions_by,
+                       link_table, link_count, add_link, copy_link, extend_links, link_ends)
+from record_stream import OUTPUT_FORMATS, COMPRESSIONS, RecordFiles, tee_sinks
+from shared_arrays import publish, attach, release
+from spatial_order import hilbert_key
+from tier_cache import cache_key, files_key, load_cached, store_cached
 
 # -------------------- Logging --------------------
 logging.basicConfig(
@@ -16,6 +28,22 @@ logger = logging.getLogger(__name__)
 random.seed(42)
 OUTPUT_DIR = "data"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Link geometry output: "wkt" -> "link_wkt" text, "coords" -> "link_coords" [[lon, lat], ...]
+# (load-data-real.py encodes coords straight to WKB/SpatiaLite BLOBs without parsing text)
+LINK_GEOMETRY = "wkt"
+LINK_GEOM_KEY = "link_coords" if LINK_GEOMETRY == "coords" else "link_wkt"
+# Output files (record_stream.py): "json" arrays or "ndjson" lines, optionally "gzip"/"zstd"
+# compressed; NDJSON may be split into parts of SPLIT_RECORDS records (0 = one file).
+# Either way records are appended as each generation stage finishes.
+OUTPUT_FORMAT = "json"
+OUTPUT_COMPRESSION = None
+SPLIT_RECORDS = 0
+# Per-tier topology cache (tier_cache.py): reruns regenerate only the tiers whose inputs changed
+TIER_CACHE = True
+TIER_CACHE_DIR = os.path.join(OUTPUT_DIR, "tier_cache")
+# Modules whose source is part of every tier's cache key: editing any of them invalidates the cache
+TIER_CACHE_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), f)
+                      for f in ("generate-realV3.py", "geo_kernel.py", "net_model.py", "spatial_order.py")]
 
 # City roles
 HOT_CITIES = {"London","New York","Tokyo","Delhi","São Paulo"}
@@ -39,6 +67,7 @@ REGIONS = {
     "MENA": {"UAE","Saudi Arabia","Qatar","Israel","Turkey","Iran","Oman"},
     "Africa": {"South Africa","Egypt","Kenya","Nigeria","Morocco","Ethiopia","Ghana","Tanzania","Uganda"},
 }
+REGION_NAMES = list(REGIONS) + ["Other"]   # vocabulary of the sites' region column
 
 # Site counts and metro spread
 HOT_CITY_MULTIPLIER = 100
@@ -114,15 +143,12 @@ ALL_LOCATIONS: List[Tuple[str, str, float, float]] = [
     ("United Kingdom","London", 51.5074,-0.1278),("United Kingdom","Manchester", 53.4808,-2.2426),("France","Paris", 48.8566, 2.3522),("France","Lyon", 45.7640, 4.8357),("Germany","Berlin", 52.5200,13.4050),("Germany","Munich", 48.1351,11.5820),("Netherlands","Amsterdam", 52.3676, 4.9041),("Italy","Rome", 41.9028,12.4964),("Italy","Milan", 45.4642, 9.1900),("Spain","Madrid", 40.4168,-3.7038),("Spain","Barcelona", 41.3851, 2.1734),("Sweden","Stockholm", 59.3293,18.0686),("Poland","Warsaw", 52.2297,21.0122),("Switzerland","Zurich", 47.3769, 8.5417),("Belgium","Brussels", 50.8503, 4.3517),("Norway","Oslo", 59.9139,10.7522),("Denmark","Copenhagen", 55.6761,12.5683),("Austria","Vienna", 48.2082,16.3738),("Ireland","Dublin", 53.3498,-6.2603),("Portugal","Lisbon", 38.7223,-9.1393),("Czech Republic","Prague", 50.0755,14.4378),("Finland","Helsinki", 60.1699,24.9384),("Greece","Athens", 37.9838,23.7275),("Hungary","Budapest", 47.4979,19.0402),("United States","New York", 40.7128,-74.0060),("United States","Chicago", 41.8781,-87.6298),("United States","San Francisco", 37.7749,-122.4194),("United States","Dallas", 32.7767,-96.7970),("United States","Los Angeles", 34.0522,-118.2437),("United States","Seattle", 47.6062,-122.3321),("United States","Atlanta", 33.7490,-84.3880),("Canada","Toronto", 43.6532,-79.3832),("Canada","Vancouver", 49.2827,-123.1207),("Canada","Montreal", 45.5017,-73.5673),("Mexico","Mexico City", 19.4326,-99.1332),("Mexico","Guadalajara", 20.6597,-103.3496),("Brazil","São Paulo",-23.5505,-46.6333),("Brazil","Rio de Janeiro",-22.9068,-43.1729),("Argentina","Buenos Aires",-34.6037,-58.3816),("Chile","Santiago",-33.4489,-70.6693),("Colombia","Bogotá", 4.7110,-74.0721),("Peru","Lima",-12.0464,-77.0428),("India","Delhi", 28.7041, 77.1025),("India","Mumbai", 19.0760, 72.8777),("India","Bangalore", 12.9716, 77.5946),("India","Chennai", 13.0827, 80.2707),("Japan","Tokyo", 35.6895,139.6917),("Japan","Osaka", 34.6937,135.5023),("China","Beijing", 39.9042,116.4074),("China","Shanghai",31.2304,121.4737),("South Korea","Seoul", 37.5665,126.9780),("Singapore","Singapore", 1.3521,103.8198),("Malaysia","Kuala Lumpur", 3.1390,101.6869),("Thailand","Bangkok", 13.7563,100.5018),("Philippines","Manila", 14.5995,120.9842),("Indonesia","Jakarta", -6.2088,106.8456),("Australia","Sydney",-33.8688,151.2093),("Australia","Melbourne",-37.8136,144.9631),("New Zealand","Auckland",-36.8485,174.7633),("Vietnam","Ho Chi Minh City",10.8231,106.6297),("Taiwan","Taipei",25.0330,121.5654),("Hong Kong","Hong Kong",22.3193,114.1694),("UAE","Dubai", 25.2048, 55.2708),("UAE","Abu Dhabi", 24.4539, 54.3773),("Saudi Arabia","Riyadh", 24.7136, 46.6753),("Qatar","Doha", 25.2854, 51.5310),("Israel","Tel Aviv", 32.0853, 34.7818),("Turkey","Istanbul", 41.0082, 28.9784),("Iran","Tehran", 35.6892, 51.3890),("Oman","Muscat", 23.5859, 58.4059),("South Africa","Johannesburg",-26.2041,28.0473),("South Africa","Cape Town",-33.9249,18.4241),("Egypt","Cairo", 30.0444,31.2357),("Kenya","Nairobi", -1.2921,36.8219),("Nigeria","Lagos", 6.5244,3.3792),("Morocco","Casablanca", 33.5731,-7.5898),("Ethiopia","Addis Ababa", 9.1450,38.7451),("Ghana","Accra", 5.6037,-0.1870),("Tanzania","Dar es Salaam",-6.7924,39.2083),("Uganda","Kampala", 0.3476,32.5825),
 ]
 
-# Optional KDTree
-try:
-    from sklearn.neighbors import KDTree
-    HAVE_SK = True
-except Exception:
-    HAVE_SK = False
-
 # -------------------- Helpers --------------------
 def ts() -> str:
+    """Run timestamp for last_modified_at; SOURCE_DATE_EPOCH pins it so reruns write identical files."""
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        return datetime.utcfromtimestamp(int(epoch)).isoformat()
     return datetime.utcnow().isoformat()
 
 def weighted_choice(weight_map: Dict[str, float], rnd: random.Random) -> str:
@@ -141,32 +167,6 @@ def jitter_latlon(lat: float, lon: float, km: float=5.0) -> Tuple[float,float]:
     dlon = (km/(111.0*max(0.2, math.cos(math.radians(lat))))) * (random.random()-0.5) * 2
     return lat + dlat, lon + dlon
 
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
-    R = 6371.0088
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(a))
-
-def interpolate_points(a_lat, a_lon, b_lat, b_lon, n_mid: int, jitter_km: float) -> List[Tuple[float,float]]:
-    pts=[]
-    for i in range(1, n_mid+1):
-        t = i / (n_mid + 1)
-        lat = a_lat + t*(b_lat - a_lat)
-        lon = a_lon + t*(b_lon - a_lon)
-        if jitter_km > 0:
-            lat, lon = jitter_latlon(lat, lon, km=jitter_km)
-        pts.append((lat, lon))
-    return pts
-
-def linestring_wkt(coords: List[Tuple[float,float]]) -> str:
-    clean=[]; last=None
-    for lat,lon in coords:
-        if last and abs(lat-last[0])<1e-7 and abs(lon-last[1])<1e-7:
-            continue
-        clean.append((lat,lon)); last=(lat,lon)
-    if len(clean)<2: clean=clean*2
-    return "LINESTRING(" + ", ".join([f"{lon:.6f} {lat:.6f}" for lat,lon in clean]) + ")"
 
 # -------------------- Tiers & ranges --------------------
 TIER_RANGES = {
@@ -179,6 +179,20 @@ TIER_RANGES = {
     "INTERCONNECT": (200, 3000),
     "PATCH": (0.1, 2.0),
 }
+TIER_NAMES = list(TIER_RANGES)   # link tier codes index this list
+TIER_CODE = {t: k for k, t in enumerate(TIER_NAMES)}
+
+# Polyline shape per tier: (points interpolated per route segment, jitter km); long-haul is smoother
+TIER_GEOMETRY = {
+    "Core Backbone": (9, 1.9),
+    "International Gateway": (9, 1.9),
+    "INTERCONNECT": (9, 1.9),
+    "Regional Network": (6, 1.3),
+    "Metro Network": (4, 0.35),
+    "Access Network": (3, 0.25),
+    "Data Center Interconnect": (2, 0.3),
+    "PATCH": (2, 1.0),
+}
 
 # -------------------- Sites --------------------
 def assign_network_for_site(city: str, hot: bool, hub: bool) -> str:
@@ -200,19 +214,20 @@ def assign_network_for_site(city: str, hot: bool, hub: bool) -> str:
         if r <= acc: return name
     return choices[-1][0]
 
-def ensure_platform_network_coverage(sites: List[Dict[str,Any]]):
-    by_city_role = sorted(sites, key=lambda s: (s["city"] in HUB_CITIES, s["city"] in HOT_CITIES), reverse=True)
-    have = set((s["platform"], s["network"]) for s in sites)
+def ensure_platform_network_coverage(cities: List[str], platforms: List[str], networks: List[str]):
+    """Reassign sites (hub/hot cities first) until every PLATFORM×NETWORK pair occurs; edits the lists in place."""
+    by_city_role = sorted(range(len(cities)), key=lambda i: (cities[i] in HUB_CITIES, cities[i] in HOT_CITIES), reverse=True)
+    have = set(zip(platforms, networks))
     missing=[]
     for p in PLATFORMS:
         for n in NETWORKS:
             if (p,n) not in have: missing.append((p,n))
     changed=0; idx=0
     for p,n in missing:
-        while idx < len(by_city_role) and (by_city_role[idx]["platform"], by_city_role[idx]["network"]) in have:
+        while idx < len(by_city_role) and (platforms[by_city_role[idx]], networks[by_city_role[idx]]) in have:
             idx+=1
         cand = by_city_role[idx % len(by_city_role)]
-        cand["platform"] = p; cand["network"] = n
+        platforms[cand] = p; networks[cand] = n
         have.add((p,n)); changed+=1; idx+=1
     if changed: logger.info(f"🧩 Adjusted {changed} sites to ensure full PLATFORM×NETWORK coverage")
 
@@ -223,32 +238,65 @@ def weighted_platform_for(sid: int, hub: bool, hot: bool) -> str:
     if hot: return weighted_choice(PLATFORM_WEIGHTS_HOT, random)
     return weighted_choice(PLATFORM_WEIGHTS_NORMAL, random)
 
-def build_sites(sites_per_city: int, hot_city_multiplier: int) -> List[Dict[str,Any]]:
-    sites=[]; sid=1
+def build_sites(sites_per_city: int, hot_city_multiplier: int) -> Dict[str,Any]:
+    """Site table (net_model.py) with a derived region column; site i is SITE_{i+1}."""
+    lats=[]; lons=[]; countries=[]; cities=[]; networks=[]; platforms=[]; sid=1
     for country, city, lat, lon in ALL_LOCATIONS:
         count = (hot_city_multiplier if city in HOT_CITIES else sites_per_city)
         hot = city in HOT_CITIES; hub = city in HUB_CITIES
         for _ in range(count):
             jlat,jlon = jitter_latlon(lat, lon, km=random.uniform(*SITE_JITTER_KM_MIN_MAX))
-            network = assign_network_for_site(city, hot, hub)
-            platform = weighted_platform_for(sid, hub, hot)
-            sites.append({
-                "site_id": f"SITE_{sid:06d}",
-                "site_virtual_name": f"{city}-PoP-{sid%100}",
-                "site_name": f"{city}-{sid%100}",
-                "country": country, "city": city,
-                "platform": platform, "network": network,
-                "latitude": round(jlat, 6), "longitude": round(jlon, 6),
-                "last_modified_at": ts(), "is_deleted": 0
-            }); sid+=1
-    ensure_platform_network_coverage(sites)
-    logger.info(f"📍 Built {len(sites)} sites (coverage ensured)")
+            networks.append(assign_network_for_site(city, hot, hub))
+            platforms.append(weighted_platform_for(sid, hub, hot))
+            countries.append(country); cities.append(city)
+            lats.append(round(jlat, 6)); lons.append(round(jlon, 6)); sid+=1
+    ensure_platform_network_coverage(cities, platforms, networks)
+    sites = with_regions(site_table(lats, lons, country=countries, city=cities, network=networks, platform=platforms))
+    logger.info(f"📍 Built {sites['n']} sites (coverage ensured)")
+    return sites
+
+def with_regions(sites: Dict[str,Any]) -> Dict[str,Any]:
+    """Add the region column (codes into REGION_NAMES) derived from country."""
+    country_region = [REGION_NAMES.index(region_of(c)) for c in sites["vocab"]["country"]]
+    add_column(sites, "region", [country_region[c] for c in column_list(sites, "country")], REGION_NAMES)
     return sites
 
-def build_kdtree(sites):
-    if not HAVE_SK: return None, None
-    pts = [(s["latitude"], s["longitude"]) for s in sites]
-    return KDTree(pts), pts
+def site_id(i: int) -> str:
+    return f"SITE_{i+1:06d}"
+
+def site_latlon(sites: Dict[str,Any], i: int) -> Tuple[float,float]:
+    cols = sites["cols"]
+    return float(cols["latitude"][i]), float(cols["longitude"][i])
+
+def site_record(i: int, country: str, city: str, network: str, platform: str,
+                lat: float, lon: float, now: str) -> Dict[str,Any]:
+    """Output dict for sites.json of the site at position i."""
+    sid = i+1
+    return {"site_id": site_id(i), "site_virtual_name": f"{city}-PoP-{sid%100}", "site_name": f"{city}-{sid%100}",
+            "country": country, "city": city, "platform": platform, "network": network,
+            "latitude": lat, "longitude": lon, "last_modified_at": now, "is_deleted": 0}
+
+def link_record(k: int, a: int, b: int, tier: int, distance: float, geom: Any, now: str) -> Dict[str,Any]:
+    """Output dict for links.json of the k-th link (LINK_000001 is k=0)."""
+    return {"link_id": f"LINK_{k+1:06d}", "site_a_id": site_id(a), "site_b_id": site_id(b),
+            "link_type": TIER_NAMES[tier], "link_distance": distance,
+            "link_kmz_no": "0", LINK_GEOM_KEY: geom, "last_modified_at": now, "is_deleted": 0}
+
+def site_records(sites: Dict[str,Any]):
+    """Output dicts for sites.json, one per site."""
+    lats, lons = column_list(sites, "latitude"), column_list(sites, "longitude")
+    names = {f: sites["vocab"][f] for f in SITE_CATEGORICALS}
+    codes = {f: column_list(sites, f) for f in SITE_CATEGORICALS}
+    now = ts()
+    for i in range(sites["n"]):
+        yield site_record(i, *(names[f][codes[f][i]] for f in ("country","city","network","platform")),
+                          lats[i], lons[i], now)
+
+def link_records(links: Dict[str,Any], start: int = 0, stop: int = None):
+    """Output dicts for links.json over table positions [start, stop), numbered LINK_000001... in table order."""
+    now = ts()
+    for k in range(start, link_count(links) if stop is None else stop):
+        yield link_record(k, links["a"][k], links["b"][k], links["tier"][k], links["distance"][k], links["geom"][k], now)
 
 # -------------------- Hub hierarchy --------------------
 def region_of(country: str) -> str:
@@ -256,12 +304,11 @@ def region_of(country: str) -> str:
         if country in countries: return name
     return "Other"
 
-def pick_super_hubs(sites: List[Dict[str,Any]], per_region: int = 4) -> Dict[str, List[str]]:
-    by_city = defaultdict(list)
-    for s in sites: by_city[(s["country"], s["city"])].append(s)
+def pick_super_hubs(sites: Dict[str,Any], per_region: int = 4) -> Dict[str, List[str]]:
     city_scores=[]
-    for (country, city), lst in by_city.items():
-        score = len(lst) + (10 if city in HUB_CITIES else 0) + (5 if city in HOT_CITIES else 0)
+    for c, idx in positions_by(sites, "city").items():
+        country, city = name_of(sites, "country", idx[0]), sites["vocab"]["city"][c]
+        score = len(idx) + (10 if city in HUB_CITIES else 0) + (5 if city in HOT_CITIES else 0)
         city_scores.append(((country, city), score))
     city_scores.sort(key=lambda x: -x[1])
     region_hubs=defaultdict(list)
@@ -271,45 +318,54 @@ def pick_super_hubs(sites: List[Dict[str,Any]], per_region: int = 4) -> Dict[str
             region_hubs[reg].append(city)
     return region_hubs
 
-def pick_regional_hubs(sites: List[Dict[str,Any]], per_country: int = 2) -> Dict[str, List[str]]:
-    by_city = defaultdict(list)
-    for s in sites: by_city[(s["country"], s["city"])].append(s)
+def pick_regional_hubs(sites: Dict[str,Any], per_country: int = 2) -> Dict[str, List[str]]:
     country_hubs=defaultdict(list)
-    for (country, city), lst in by_city.items():
+    for c, idx in positions_by(sites, "city").items():
+        country, city = name_of(sites, "country", idx[0]), sites["vocab"]["city"][c]
         if city in HUB_CITIES and len(country_hubs[country]) < per_country:
             country_hubs[country].append(city)
     return country_hubs
 
+def hub_city_codes(sites: Dict[str,Any], hubs: Dict[str, List[str]]) -> frozenset:
+    """City codes of a hub map; a city belongs to one country and region, so membership is the hub test."""
+    return frozenset(code_of(sites, "city", c) for cities in hubs.values() for c in cities)
+
 # -------------------- Pair picking --------------------
-def pick_pairs_within(sites, kdtree, pts, min_km, max_km, num_pairs, forbid_same_city=True, seed=42):
-    rnd = random.Random(seed); n=len(sites); out=[]; attempts=0; max_attempts=num_pairs*80
+SAMPLE_CANDIDATES = 400   # wider annuli check a random sample of this many candidates
+
+def build_pair_index(sites: Dict[str,Any]) -> Dict[str,Any]:
+    """
+    Index for pick_pairs_within(), built once per run and shared by all tiers. Sites are
+    ranked by (country, city), so each site's own city is a contiguous rank span and
+    same-city exclusion is an integer range test; a sphere index answers the
+    min_km..max_km annulus queries. Everything is plain arrays, so it can be published
+    to the tier pool through shared memory.
+    """
+    n = sites["n"]; country, city = column_list(sites, "country"), column_list(sites, "city")
+    order = sorted(range(n), key=lambda i: (country[i], city[i]))
+    rank = [0]*n; span_lo = [0]*n; span_hi = [0]*n
+    start = 0
+    for r in range(1, n+1):
+        if r == n or city[order[r]] != city[order[start]]:
+            for q in range(start, r):
+                rank[order[q]] = q; span_lo[order[q]] = start; span_hi[order[q]] = r
+            start = r
+    return {"span_lo": as_array(span_lo, int), "span_hi": as_array(span_hi, int),
+            "sphere": build_sphere_index(sites["cols"]["latitude"], sites["cols"]["longitude"],
+                                         groups=rank, knn=False)}
+
+def pick_pairs_within(index, min_km, max_km, num_pairs, forbid_same_city=True, seed=42, sources=None):
+    """Up to num_pairs (i, j) in the annulus; i is drawn from `sources` (positions) if given, else from all sites."""
+    sphere = index["sphere"]; lats, lons, rank = sphere["lats"], sphere["lons"], sphere["groups"]
+    rnd = random.Random(seed); n=sphere["n"]; out=[]; attempts=0; max_attempts=num_pairs*80
     while len(out)<num_pairs and attempts<max_attempts:
-        i = rnd.randrange(n); si = sites[i]
-        if forbid_same_city:
-            candidates = [j for j in range(n) if not (sites[j]["city"]==si["city"] and sites[j]["country"]==si["country"])]
-        else:
-            candidates = list(range(n))
-        if kdtree is None:
-            rnd.shuffle(candidates); found=None
-            for j in candidates[:400]:
-                sj=sites[j]
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km: found=j; break
-            if found is None: attempts+=1; continue
-            out.append((i,found))
-        else:
-            rad=max_km/111.0
-            idxs = kdtree.query_radius([[si["latitude"], si["longitude"]]], r=rad)[0].tolist()
-            rnd.shuffle(idxs); found=None
-            for j in idxs:
-                if j==i: continue
-                sj=sites[j]
-                if forbid_same_city and sj["city"]==si["city"] and sj["country"]==si["country"]: continue
-                d=haversine_km(si["latitude"],si["longitude"], sj["latitude"],sj["longitude"])
-                if min_km<=d<=max_km: found=j; break
-            if found is None: attempts+=1; continue
-            out.append((i,found))
         attempts+=1
+        i = rnd.randrange(n) if sources is None else int(sources[rnd.randrange(len(sources))])
+        # own city (or just this site) is a rank span that the query drops
+        skip = (int(index["span_lo"][i]), int(index["span_hi"][i])) if forbid_same_city else (int(rank[i]), int(rank[i])+1)
+        cand, _ = annulus_query(sphere, float(lats[i]), float(lons[i]), min_km, max_km,
+                                limit=SAMPLE_CANDIDATES, rnd=rnd, skip_groups=skip)
+        if len(cand): out.append((i, int(cand[rnd.randrange(len(cand))])))
     return out
 
 # -------------------- Policy & geometry --------------------
@@ -331,9 +387,40 @@ def link_allowed_by_network(tier: str, a_net: str, b_net: str) -> bool:
     if tier == "PATCH": return True
     return True
 
+def network_policy(networks: List[str]) -> Dict[str, List[List[bool]]]:
+    """link_allowed_by_network() as a lookup per tier, indexed [network code A][network code B]."""
+    return {tier: [[link_allowed_by_network(tier, a, b) for b in networks] for a in networks] for tier in TIER_NAMES}
+
+# -------------------- Routing context --------------------
+def build_routing_context(sites: Dict[str,Any], super_hubs_by_region: Dict[str, List[str]]) -> Dict[str,Any]:
+    """
+    Lookup tables for choose_hub_waypoints(), built once per run instead of per link:
+    a nearest-site index over the sites of each anchor city (super-hubs and coastal
+    gateways) and the gateway cities of each region.
+    """
+    by_city = positions_by(sites, "city")
+    lats, lons = sites["cols"]["latitude"], sites["cols"]["longitude"]
+
+    gateways = {}
+    for region in REGION_NAMES:
+        gw = COASTAL_GATEWAYS.intersection(c[1] for c in ALL_LOCATIONS if region_of(c[0]) == region)
+        gateways[region] = sorted(gw) if gw else list(super_hubs_by_region.get(region, []))
+
+    anchors = {c for cs in super_hubs_by_region.values() for c in cs} | {c for cs in gateways.values() for c in cs}
+    city_index = {}
+    for city in anchors:
+        idx = by_city.get(code_of(sites, "city", city))
+        if idx: city_index[city] = build_sphere_index(take(lats, idx), take(lons, idx))
+    return {"city_index": city_index, "gateways": gateways, "super_hubs": super_hubs_by_region}
+
+def nearest_city_site(routing: Dict[str,Any], city: str, lat0: float, lon0: float):
+    index = routing["city_index"].get(city)
+    if index is None: return None
+    k = nearest_k(index, lat0, lon0, 1)[0]
+    return (float(index["lats"][k]), float(index["lons"][k]))
+
 # -------------------- RECTIFIED ROUTING LOGIC --------------------
-def choose_hub_waypoints(tier: str, A: Dict[str,Any], B: Dict[str,Any], sites: List[Dict[str,Any]],
-                         super_hubs_by_region: Dict[str, List[str]],
+def choose_hub_waypoints(tier: str, sites: Dict[str,Any], i: int, j: int, routing: Dict[str,Any],
                          rng: random.Random = random) -> List[Tuple[float,float]]:
     """
     FIXED: This function now generates an ORDERED list of waypoints to create
@@ -347,53 +434,35 @@ def choose_hub_waypoints(tier: str, A: Dict[str,Any], B: Dict[str,Any], sites: L
     min_h, max_h = max_hubs_by_tier.get(tier,(0,2))
     if max_h <= 0: return []
 
-    by_city = defaultdict(list)
-    for s in sites: by_city[s["city"]].append(s)
-    
-    def nearest_city_site(city: str, lat0: float, lon0: float):
-        if city not in by_city: return None
-        return min(
-            ((haversine_km(lat0, lon0, s["latitude"], s["longitude"]), (s["latitude"], s["longitude"]))
-             for s in by_city[city]),
-            key=lambda x: x[0]
-        )[1]
-
-    a_lat, a_lon = A["latitude"], A["longitude"]
-    b_lat, b_lon = B["latitude"], B["longitude"]
-    regA, regB = region_of(A["country"]), region_of(B["country"])
-    
+    a_lat, a_lon = site_latlon(sites, i)
+    b_lat, b_lon = site_latlon(sites, j)
+    region = sites["cols"]["region"]
+    regA, regB = REGION_NAMES[region[i]], REGION_NAMES[region[j]]
+
     ordered_hubs = []
 
     if regA == regB:
         # --- Intra-Region Routing ---
         candidates = []
-        for city in super_hubs_by_region.get(regA, []):
-            p = nearest_city_site(city, (a_lat + b_lat) / 2, (a_lon + b_lon) / 2)
+        for city in routing["super_hubs"].get(regA, []):
+            p = nearest_city_site(routing, city, (a_lat + b_lat) / 2, (a_lon + b_lon) / 2)
             if p: candidates.append(p)
-        
-        def project_on_path(p_lat, p_lon):
-            vec_ab = (b_lon - a_lon, b_lat - a_lat)
-            vec_ap = (p_lon - a_lon, p_lat - a_lat)
-            len_ab_sq = vec_ab[0]**2 + vec_ab[1]**2
-            return (vec_ab[0] * vec_ap[0] + vec_ab[1] * vec_ap[1]) / (len_ab_sq + 1e-9)
 
         # Filter for hubs that are actually intermediate and sort them by progression
-        intermediate_hubs = [p for p in candidates if 0.1 < project_on_path(p[0], p[1]) < 0.9]
-        intermediate_hubs.sort(key=lambda p: project_on_path(p[0], p[1]))
-        
+        t = project_on_segment_many(a_lat, a_lon, b_lat, b_lon,
+                                    [p[0] for p in candidates], [p[1] for p in candidates])
+        intermediate = sorted((k for k in range(len(candidates)) if 0.1 < t[k] < 0.9), key=lambda k: t[k])
+        intermediate_hubs = [candidates[k] for k in intermediate]
+
         k = rng.randint(min_h, max_h)
         ordered_hubs = intermediate_hubs[:k]
 
     else:
         # --- Inter-Region Routing (e.g., via coastal gateways) ---
         def find_best_gateway(lat, lon, region):
-            gateways = COASTAL_GATEWAYS.intersection(c[1] for c in ALL_LOCATIONS if region_of(c[0]) == region)
-            if not gateways: gateways = super_hubs_by_region.get(region, [])
-            if not gateways: return None
-            
             best_p = None; min_dist = float('inf')
-            for city in gateways:
-                p = nearest_city_site(city, lat, lon)
+            for city in routing["gateways"].get(region, []):
+                p = nearest_city_site(routing, city, lat, lon)
                 if p:
                     dist = haversine_km(lat, lon, p[0], p[1])
                     if dist < min_dist:
@@ -413,366 +482,824 @@ def choose_hub_waypoints(tier: str, A: Dict[str,Any], B: Dict[str,Any], sites: L
             ordered_hubs = [exit_point]
         elif entry_point:
             ordered_hubs = [entry_point]
-            
+
     return ordered_hubs
 
 
-def make_routed_geometry(tier_name: str, A: Dict[str,Any], B: Dict[str,Any], sites: List[Dict[str,Any]],
-                         super_hubs_by_region: Dict[str, List[str]]) -> Tuple[float,str]:
+def route_link(tier_name: str, sites: Dict[str,Any], i: int, j: int,
+               routing: Dict[str,Any]) -> Tuple[float,Any]:
+    """(routed km, [(lat, lon), ...] waypoints from i to j), or (-1.0, None) if out of the tier's range."""
     dmin,dmax = TIER_RANGES.get(tier_name,(1,20000))
-    hubs = choose_hub_waypoints(tier_name, A, B, sites, super_hubs_by_region)
-
-    # per-segment density for smoother arcs (long-haul higher)
-    if tier_name in ("Core Backbone","International Gateway","INTERCONNECT"): per_mid, jitter = 9, 1.9
-    elif tier_name=="Regional Network": per_mid, jitter = 6, 1.3
-    elif tier_name=="Metro Network": per_mid, jitter = 4, 0.35
-    elif tier_name=="Access Network": per_mid, jitter = 3, 0.25
-    elif tier_name=="Data Center Interconnect": per_mid, jitter = 2, 0.3
-    else: per_mid, jitter = 2, 1.0
-
-    path=[(A["latitude"],A["longitude"])] + hubs + [(B["latitude"],B["longitude"])]
-    coords=[path[0]]; total=0.0
-    for u,v in zip(path[:-1], path[1:]):
-        a_lat,a_lon=u; b_lat,b_lon=v
-        mids = interpolate_points(a_lat,a_lon,b_lat,b_lon, n_mid=per_mid, jitter_km=jitter)
-        coords += mids + [(b_lat,b_lon)]
-        total += haversine_km(a_lat,a_lon,b_lat,b_lon)
-
-    straight=haversine_km(A["latitude"],A["longitude"],B["latitude"],B["longitude"])
+    hubs = choose_hub_waypoints(tier_name, sites, i, j, routing)
+
+    A = site_latlon(sites, i); B = site_latlon(sites, j)
+    path=[A] + hubs + [B]
+    total = sum(haversine_km(u[0],u[1],v[0],v[1]) for u,v in zip(path[:-1], path[1:]))
+    straight=haversine_km(A[0],A[1],B[0],B[1])
     total=max(total, straight)
     if total < dmin or total > dmax*1.25 or straight < dmin or straight > dmax*1.5:
-        return -1.0, ""
-    return round(total,1), linestring_wkt(coords)
+        return -1.0, None
+    return round(total,1), path
+
+def link_geometries(tiers: List[int], paths: List[List[Tuple[float,float]]], rnd=random) -> List[Any]:
+    """
+    Values for LINK_GEOM_KEY of many links at once, from their tier codes and route_link()
+    waypoints: vertices for the whole batch come from one densify_paths() call and are
+    formatted in one pass.
+    """
+    if not paths: return []
+    lats = [p[0] for path in paths for p in path]; lons = [p[1] for path in paths for p in path]
+    offsets = [0]
+    for path in paths: offsets.append(offsets[-1] + len(path))
+    shape = [TIER_GEOMETRY[TIER_NAMES[t]] for t in tiers]
+    xy, vertex_offsets = densify_paths(lats, lons, offsets, [m for m, _ in shape], [j for _, j in shape], rnd)
+    return linestrings_coords(xy, vertex_offsets) if LINK_GEOMETRY == "coords" else format_linestrings(xy, vertex_offsets)
+
+GEOMETRY_CHUNK = 5000   # links per geometry task
+GEOMETRY_SEED = 42
+
+def gen_geometry_chunk(args) -> List[Any]:
+    tiers, routes, seed = args
+    return link_geometries(tiers, routes, random.Random(seed))
+
+def build_geometries(links: Dict[str,Any], pool=None, seed: int = GEOMETRY_SEED, on_chunk=None):
+    """
+    Geometry phase: the geometry of every link from its route, in chunks of GEOMETRY_CHUNK
+    links on pool (inline if None), routes dropped as they are used. Chunk seeds depend only
+    on the chunk number, so the output does not depend on the process count.
+    on_chunk(links, start, stop), if given, is called as each run of links gets its geometry.
+    """
+    n = link_count(links)
+    bounds = [(lo, min(lo+GEOMETRY_CHUNK, n)) for lo in range(0, n, GEOMETRY_CHUNK)]
+    tasks = ((links["tier"][lo:hi].tolist(), links["route"][lo:hi], (seed ^ (c * 0x9E3779B1)) & 0xFFFFFFFF)
+             for c, (lo, hi) in enumerate(bounds))
+    chunks = pool.imap(gen_geometry_chunk, tasks) if pool is not None and len(bounds) > 1 else map(gen_geometry_chunk, tasks)
+    for (lo, hi), geoms in zip(bounds, chunks):
+        links["geom"][lo:hi] = geoms
+        links["route"][lo:hi] = [None] * (hi - lo)
+        if on_chunk: on_chunk(links, lo, hi)
 
 # -------------------- Metro ring builder --------------------
-def build_metro_links(sites: List[Dict[str,Any]], k_neighbors: int = 4) -> List[Tuple[int,int]]:
-    by_city = defaultdict(list)
-    for idx,s in enumerate(sites): by_city[(s["country"],s["city"])].append(idx)
+def build_metro_links(sites: Dict[str,Any], k_neighbors: int = 4) -> List[Tuple[int,int]]:
+    lats, lons = sites["cols"]["latitude"], sites["cols"]["longitude"]
     pairs=[]
-    for key, idxs in by_city.items():
+    for idxs in positions_by(sites, "city").values():
         if len(idxs) < 3: continue
-        pts=[(sites[i]["latitude"], sites[i]["longitude"]) for i in idxs]
-        if HAVE_SK:
-            tree=KDTree(pts)
-            for pos,i in enumerate(idxs):
-                k = min(k_neighbors+1, len(idxs))
-                neigh = tree.query([pts[pos]], k=k)[1][0].tolist()
-                for nnpos in neigh[1:]:
-                    j = idxs[nnpos]
-                    if i<j: pairs.append((i,j))
-        else:
-            for ai,i in enumerate(idxs):
-                dists=[]
-                for bj,j in enumerate(idxs):
-                    if i==j: continue
-                    d=haversine_km(sites[i]["latitude"],sites[i]["longitude"],sites[j]["latitude"],sites[j]["longitude"])
-                    dists.append((d,j))
-                dists.sort(key=lambda x:x[0])
-                for _,j in dists[:k_neighbors]:
-                    if i<j: pairs.append((i,j))
+        sphere = build_sphere_index(take(lats, idxs), take(lons, idxs))
+        for pos,i in enumerate(idxs):
+            neigh = nearest_k(sphere, float(lats[i]), float(lons[i]), k_neighbors+1)
+            for nnpos in [b for b in neigh if b != pos][:k_neighbors]:
+                j = idxs[nnpos]
+                if i<j: pairs.append((i,j))
     return pairs
 
 # -------------------- Caps bookkeeping --------------------
-def bearing_deg(a: Dict[str,Any], b: Dict[str,Any]) -> float:
-    dy=b["latitude"]-a["latitude"]; dx=b["longitude"]-a["longitude"]
-    return (math.degrees(math.atan2(dy, dx)) + 360.0) % 360.0
-
-def ok_by_caps(tier: str, A: Dict[str,Any], B: Dict[str,Any],
-               deg_by_tier: Dict[str,Dict[str,int]],
-               pair_counts: Dict[Tuple[str,Tuple[str,str]], int],
-               sector_counts: Dict[Tuple[str,str,int], int]) -> bool:
+# Caps state is keyed by site position and city code (sorted vocab, so code order is name order)
+def bearing_deg(sites: Dict[str,Any], i: int, j: int) -> float:
+    return planar_bearing_deg(*site_latlon(sites, i), *site_latlon(sites, j))
+
+def city_pair(sites: Dict[str,Any], i: int, j: int) -> Tuple[int,int]:
+    city = sites["cols"]["city"]; a, b = int(city[i]), int(city[j])
+    return (a, b) if a <= b else (b, a)
+
+def ok_by_caps(tier: str, sites: Dict[str,Any], i: int, j: int,
+               deg_by_tier: Dict[str,Dict[int,int]],
+               pair_counts: Dict[Tuple[str,Tuple[int,int]], int],
+               sector_counts: Dict[Tuple[str,int,int], int]) -> bool:
     # degree caps
-    if deg_by_tier[tier].get(A["site_id"],0) >= DEGREE_CAPS.get(tier, 1e9): return False
-    if deg_by_tier[tier].get(B["site_id"],0) >= DEGREE_CAPS.get(tier, 1e9): return False
-    # city-pair caps (unordered city names)
-    pair_key = (tier, tuple(sorted((A["city"], B["city"]))))
+    if deg_by_tier[tier].get(i,0) >= DEGREE_CAPS.get(tier, 1e9): return False
+    if deg_by_tier[tier].get(j,0) >= DEGREE_CAPS.get(tier, 1e9): return False
+    # city-pair caps (unordered cities)
+    pair_key = (tier, city_pair(sites, i, j))
     cap = PAIR_CAPS.get(tier, 1e9)
     if pair_counts.get(pair_key,0) >= cap: return False
     # sector caps (apply both ends for long-haul; origin only for others)
     if tier in SECTOR_CAPS:
-        secA = int(bearing_deg(A,B) // SECTOR_DEG)
-        if sector_counts.get((tier, A["site_id"], secA),0) >= SECTOR_CAPS[tier]: return False
+        secA = int(bearing_deg(sites,i,j) // SECTOR_DEG)
+        if sector_counts.get((tier, i, secA),0) >= SECTOR_CAPS[tier]: return False
         if tier in ("Core Backbone","International Gateway","INTERCONNECT"):
-            secB = int(bearing_deg(B,A) // SECTOR_DEG)
-            if sector_counts.get((tier, B["site_id"], secB),0) >= SECTOR_CAPS[tier]: return False
+            secB = int(bearing_deg(sites,j,i) // SECTOR_DEG)
+            if sector_counts.get((tier, j, secB),0) >= SECTOR_CAPS[tier]: return False
     return True
 
-def bump_caps(tier: str, A: Dict[str,Any], B: Dict[str,Any],
-              deg_by_tier: Dict[str,Dict[str,int]],
-              pair_counts: Dict[Tuple[str,Tuple[str,str]], int],
-              sector_counts: Dict[Tuple[str,str,int], int]):
-    deg_by_tier[tier][A["site_id"]] = deg_by_tier[tier].get(A["site_id"],0) + 1
-    deg_by_tier[tier][B["site_id"]] = deg_by_tier[tier].get(B["site_id"],0) + 1
-    pair_key = (tier, tuple(sorted((A["city"], B["city"]))))
+def bump_caps(tier: str, sites: Dict[str,Any], i: int, j: int,
+              deg_by_tier: Dict[str,Dict[int,int]],
+              pair_counts: Dict[Tuple[str,Tuple[int,int]], int],
+              sector_counts: Dict[Tuple[str,int,int], int]):
+    deg_by_tier[tier][i] = deg_by_tier[tier].get(i,0) + 1
+    deg_by_tier[tier][j] = deg_by_tier[tier].get(j,0) + 1
+    pair_key = (tier, city_pair(sites, i, j))
     pair_counts[pair_key] = pair_counts.get(pair_key,0) + 1
     if tier in SECTOR_CAPS:
-        secA = int(bearing_deg(A,B) // SECTOR_DEG)
-        sector_counts[(tier, A["site_id"], secA)] = sector_counts.get((tier, A["site_id"], secA),0) + 1
+        secA = int(bearing_deg(sites,i,j) // SECTOR_DEG)
+        sector_counts[(tier, i, secA)] = sector_counts.get((tier, i, secA),0) + 1
         if tier in ("Core Backbone","International Gateway","INTERCONNECT"):
-            secB = int(bearing_deg(B,A) // SECTOR_DEG)
-            sector_counts[(tier, B["site_id"], secB)] = sector_counts.get((tier, B["site_id"], secB),0) + 1
+            secB = int(bearing_deg(sites,j,i) // SECTOR_DEG)
+            sector_counts[(tier, j, secB)] = sector_counts.get((tier, j, secB),0) + 1
 
 # -------------------- Tier generation (MP) --------------------
-def gen_links_for_tier(args) -> List[Dict[str,Any]]:
+# Each tier is split into shards: contiguous ranges of the sites in Hilbert order. A shard
+# draws the first endpoint of its pairs from its own range (the second can be anywhere)
+# and gets a share of the tier budget, so big tiers use all the pool's cores. Caps are
+# enforced inside each shard and then again across shards by reconcile_tier(). The layout
+# depends on the budget only, never on the pool size, so the topology (and the tier cache
+# key) is the same on every machine.
+SHARD_MIN_LINKS = 250     # smallest shard budget worth its own task
+SHARD_MAX = 16            # shards per tier; the pool schedules them over however many cores it has
+SHARD_SLACK = 1.25        # shards overshoot their share so reconciliation can drop cap violations
+
+def hilbert_site_order(sites: Dict[str,Any]) -> List[int]:
+    lats, lons = column_list(sites, "latitude"), column_list(sites, "longitude")
+    return sorted(range(sites["n"]), key=lambda i: hilbert_key(lons[i], lats[i]))
+
+def tier_shards(budget: int, n_sites: int) -> List[Tuple[int,int,int,int,int]]:
+    """(shard, shard_count, lo, hi, shard_budget) covering Hilbert positions [0, n_sites)."""
+    count = max(1, min(SHARD_MAX, budget // SHARD_MIN_LINKS, n_sites))
+    if count == 1: return [(0, 1, 0, n_sites, budget)]
+    bounds = [n_sites * k // count for k in range(count + 1)]
+    return [(k, count, bounds[k], bounds[k+1],
+             int(math.ceil(budget * (bounds[k+1]-bounds[k]) / n_sites * SHARD_SLACK))) for k in range(count)]
+
+def reconcile_tier(tier_name: str, shard_links: List[Dict[str,Any]], budget: int,
+                   sites: Dict[str,Any]) -> Dict[str,Any]:
+    """Merge a tier's shard link tables round-robin, re-applying the caps across shards, up to budget."""
+    kept = link_table()
+    if len(shard_links) == 1:
+        for k in range(min(budget, link_count(shard_links[0]))): copy_link(kept, shard_links[0], k)
+        return kept
+    deg_by_tier = defaultdict(dict); pair_counts = {}; sector_counts = {}
+    dropped=0
+    rounds = zip_longest(*[range(link_count(L)) for L in shard_links])
+    for s, k in ((s, k) for ks in rounds for s, k in enumerate(ks) if k is not None):
+        if link_count(kept) >= budget: break
+        L = shard_links[s]; i, j = L["a"][k], L["b"][k]
+        if not ok_by_caps(tier_name, sites, i, j, deg_by_tier, pair_counts, sector_counts):
+            dropped+=1; continue
+        bump_caps(tier_name, sites, i, j, deg_by_tier, pair_counts, sector_counts)
+        copy_link(kept, L, k)
+    logger.info(f"✅ Tier {tier_name}: target={budget}, built={link_count(kept)} from {len(shard_links)} shards "
+                f"({dropped} dropped by cross-shard caps)")
+    return kept
+
+def gen_links_for_tier(args) -> Tuple[str,int,Dict[str,Any]]:
     (tier_name, budget, min_km, max_km, jitter_km, _pts_per_1000,
-     sites, seed_base, forbid_same_city, enforce_policy,
-     super_hubs_by_region, regional_hubs_by_country) = args
+     shared_handle, seed_base, forbid_same_city, enforce_policy,
+     super_hub_cities, regional_hub_cities, shard) = args
+    shard_no, shard_count, lo, hi = shard
 
-    rnd_seed = (seed_base ^ hash(tier_name)) & 0xFFFFFFFF
+    # site table, pair index and routing context are attached by name, not pickled per task
+    shared = attach(shared_handle)
+
+    rnd_seed = (seed_base ^ zlib.crc32(tier_name.encode()) ^ (shard_no * 0x9E3779B1)) & 0xFFFFFFFF
     random.seed(rnd_seed)
-    kdtree, pts = build_kdtree(sites)
     # produce many candidates; we'll filter by topology and caps
-    pairs = pick_pairs_within(sites, kdtree, pts, min_km, max_km, int(budget*3),
-                              forbid_same_city=forbid_same_city, seed=rnd_seed)
+    sources = shared["hilbert"][lo:hi] if shard_count > 1 else None
+    pairs = pick_pairs_within(shared["pair_index"], min_km, max_km, int(budget*3),
+                              forbid_same_city=forbid_same_city, seed=rnd_seed, sources=sources)
+    links = tier_links(tier_name, budget, shared["sites"], shared["routing"], pairs,
+                       enforce_policy, super_hub_cities, regional_hub_cities)
+
+    where = f" shard {shard_no+1}/{shard_count}" if shard_count > 1 else ""
+    logger.info(f"✅ Tier {tier_name}{where}: target={budget}, built={link_count(links)} (range {min_km}-{max_km} km)")
+    return tier_name, shard_no, links
+
+def tier_links(tier_name: str, budget: int, sites: Dict[str,Any], routing: Dict[str,Any],
+               pairs: List[Tuple[int,int]], enforce_policy: bool,
+               super_hub_cities: frozenset, regional_hub_cities: frozenset) -> Dict[str,Any]:
+    """Links of one tier from candidate pairs, in order, after the policy, topology and caps filters."""
+    cols = sites["cols"]; network, region, city = cols["network"], cols["region"], cols["city"]
+    allowed = network_policy(sites["vocab"]["network"])[tier_name]
+    tier = TIER_CODE[tier_name]
 
     deg_by_tier = defaultdict(dict)
-    pair_counts: Dict[Tuple[str,Tuple[str,str]], int] = {}
-    sector_counts: Dict[Tuple[str,str,int], int] = {}
-    links=[]; lid=1
+    pair_counts: Dict[Tuple[str,Tuple[int,int]], int] = {}
+    sector_counts: Dict[Tuple[str,int,int], int] = {}
+    links = link_table()
 
     for (i,j) in pairs:
-        if len(links) >= budget: break
-        A=sites[i]; B=sites[j]
-        if enforce_policy and not link_allowed_by_network(tier_name, A["network"], B["network"]):
+        if link_count(links) >= budget: break
+        if enforce_policy and not allowed[network[i]][network[j]]:
             continue
 
-        regA, regB = region_of(A["country"]), region_of(B["country"])
         # Region crossing rule: only International/Interconnect may cross regions
-        if regA != regB and tier_name not in ("International Gateway","INTERCONNECT"):
+        if region[i] != region[j] and tier_name not in ("International Gateway","INTERCONNECT"):
             continue
 
         # Topology restrictions
         if tier_name in ("Core Backbone","International Gateway","INTERCONNECT"):
             # require at least one endpoint is a super-hub in its region
-            shA = A["city"] in super_hubs_by_region.get(regA, [])
-            shB = B["city"] in super_hubs_by_region.get(regB, [])
-            if not (shA or shB):
+            if not (int(city[i]) in super_hub_cities or int(city[j]) in super_hub_cities):
                 continue
         elif tier_name == "Regional Network":
             # require at least one endpoint is a regional hub in its country (fan-in)
-            rhA = A["city"] in regional_hubs_by_country.get(A["country"], [])
-            rhB = B["city"] in regional_hubs_by_country.get(B["country"], [])
-            if not (rhA or rhB):
+            if not (int(city[i]) in regional_hub_cities or int(city[j]) in regional_hub_cities):
                 # allow sparse lateral hub-hub edges with small probability
                 if random.random() > 0.2:
                     continue
 
-        if not ok_by_caps(tier_name, A, B, deg_by_tier, pair_counts, sector_counts):
+        if not ok_by_caps(tier_name, sites, i, j, deg_by_tier, pair_counts, sector_counts):
             continue
 
-        dist, wkt = make_routed_geometry(tier_name, A, B, sites, super_hubs_by_region)
+        dist, path = route_link(tier_name, sites, i, j, routing)
         if dist < 0: continue
-        bump_caps(tier_name, A, B, deg_by_tier, pair_counts, sector_counts)
-        links.append({
-            "link_id": f"{tier_name}__TMP_{lid:06d}",
-            "site_a_id": A["site_id"], "site_b_id": B["site_id"],
-            "link_type": tier_name, "link_distance": round(dist,1),
-            "link_kmz_no": "0", "link_wkt": wkt,
-            "last_modified_at": ts(), "is_deleted": 0
-        }); lid+=1
-
-    logger.info(f"✅ Tier {tier_name}: target={budget}, built={len(links)} (range {min_km}-{max_km} km)")
+        bump_caps(tier_name, sites, i, j, deg_by_tier, pair_counts, sector_counts)
+        add_link(links, i, j, tier, round(dist,1), route=path)
     return links
 
+def seed_metro_rings(sites: Dict[str,Any], links: Dict[str,Any], ring_target: int,
+                     routing: Dict[str,Any], uf: "SiteUnionFind") -> int:
+    """Add up to ring_target Metro links from build_metro_links() under the Metro caps; returns the count."""
+    deg_by_tier = defaultdict(dict); pair_counts={}; sector_counts={}
+    add_count=0
+    for i,j in build_metro_links(sites, k_neighbors=4):
+        if add_count >= ring_target: break
+        if not ok_by_caps("Metro Network", sites, i, j, deg_by_tier, pair_counts, sector_counts): continue
+        dist,path = route_link("Metro Network", sites, i, j, routing)
+        if dist<0: continue
+        bump_caps("Metro Network", sites, i, j, deg_by_tier, pair_counts, sector_counts)
+        uf.union(i, j)
+        add_link(links, i, j, TIER_CODE["Metro Network"], dist, route=path)
+        add_count+=1
+    if add_count: logger.info(f"🏙️ Seeded {add_count} metro ring links")
+    return add_count
+
 # -------------------- Graph utils & healing --------------------
-def build_adjacency(links, sites_by_id):
+def build_adjacency(links: Dict[str,Any]):
     adj = defaultdict(set)
-    for L in links:
-        a, b = L["site_a_id"], L["site_b_id"]
-        if a in sites_by_id and b in sites_by_id and a != b:
+    for a, b in link_ends(links):
+        if a != b:
             adj[a].add(b); adj[b].add(a)
     return adj
 
-def connected_components(adj, site_ids):
-    seen=set(); comps=[]
-    for s in site_ids:
-        if s in seen: continue
-        comp=[]; q=deque([s]); seen.add(s)
-        while q:
-            u=q.popleft(); comp.append(u)
-            for v in adj[u]:
-                if v not in seen: seen.add(v); q.append(v)
-        comps.append(comp)
-    return comps
-
-def pick_best_neighbor(site_id, sites_by_id, candidates, tier_name, avoid_set):
-    A = sites_by_id[site_id]; a= (A["latitude"], A["longitude"])
+class SiteUnionFind:
+    """Connected components of the site graph (by site position), updated as each link is accepted."""
+    def __init__(self, n: int):
+        self.parent = list(range(n)); self.size = [1]*n
+        self.components = n
+
+    def find(self, s: int) -> int:
+        parent = self.parent
+        while parent[s] != s:
+            parent[s] = parent[parent[s]]; s = parent[s]
+        return s
+
+    def union(self, a: int, b: int) -> bool:
+        """Join the components of a and b; False if they were already one."""
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb: return False
+        if self.size[ra] < self.size[rb]: ra, rb = rb, ra
+        self.parent[rb] = ra; self.size[ra] += self.size[rb]; self.components -= 1
+        return True
+
+    def add_links(self, links: Dict[str,Any]):
+        for a, b in link_ends(links): self.union(a, b)
+
+    def groups(self) -> List[List[int]]:
+        """Members of each component, components in order of their first site."""
+        members = {}
+        for s in range(len(self.parent)): members.setdefault(self.find(s), []).append(s)
+        return list(members.values())
+
+def pick_best_neighbor(i, sites, candidates, tier_name, avoid_set, sphere=None):
+    """
+    Candidate position whose distance is closest to the middle of the tier range, as
+    (score, position, km). sphere=(index, position_of), a sphere index over candidates
+    (position_of None when index positions are site positions), replaces the scan with
+    a band search around the target distance.
+    """
+    if not candidates: return None
+    lat, lon = site_latlon(sites, i)
     dmin,dmax = TIER_RANGES.get(tier_name,(1,2000))
-    scored=[]
-    for bid in candidates:
-        if bid == site_id or bid in avoid_set: continue
-        B = sites_by_id[bid]; d=haversine_km(a[0],a[1],B["latitude"],B["longitude"])
-        if d < dmin or d > dmax: continue
-        scored.append((abs(d-(dmin+dmax)/2), bid, d))
-    scored.sort(key=lambda x:x[0])
-    return scored[0] if scored else None
-
-def heal_isolated_and_low_degree(sites, links, min_degree=1, important_min_degree=2, super_hubs_by_region=None):
-    sites_by_id = {s["site_id"]: s for s in sites}
-    adj = build_adjacency(links, sites_by_id)
-    site_ids = [s["site_id"] for s in sites]
-
-    by_city = defaultdict(list)
-    for s in sites: by_city[(s["country"], s["city"])] .append(s["site_id"])
-
-    new_links=[]
-    def add_link(aid, bid, tier):
-        A=sites_by_id[aid]; B=sites_by_id[bid]
-        dist, wkt = make_routed_geometry(tier, A, B, sites, super_hubs_by_region)
+    skip = set(avoid_set) | {i}
+    if sphere is not None:
+        index, pos_of = sphere
+        k, d = nearest_to_distance(index, lat, lon, dmin, dmax, (dmin+dmax)/2,
+                                   skip if pos_of is None else {pos_of[b] for b in skip if b in pos_of})
+        return None if k < 0 else (abs(d-(dmin+dmax)/2), candidates[k], d)
+    dists = haversine_one_to_many(lat, lon, take(sites["cols"]["latitude"], candidates),
+                                  take(sites["cols"]["longitude"], candidates))
+    exclude = [k for k, b in enumerate(candidates) if b in skip]
+    k = closest_to_in_range(dists, dmin, dmax, (dmin+dmax)/2, exclude)
+    if k < 0: return None
+    return (abs(float(dists[k])-(dmin+dmax)/2), candidates[k], float(dists[k]))
+
+HEAL_ATTEMPTS = 6
+HEAL_RANDOM_TRIES = 32   # random draws for the last-resort peer before giving up on an attempt
+
+def heal_isolated_and_low_degree(sites, links, routing, min_degree=1, important_min_degree=2, uf=None):
+    """
+    Top up sites below their minimum degree. Peers come from sphere-index band searches
+    in the tier range (same city first, then any site), never from a scan of all sites;
+    degrees are read off the adjacency, which grows as links are added.
+    """
+    n = sites["n"]; lats, lons = sites["cols"]["latitude"], sites["cols"]["longitude"]
+    adj = build_adjacency(links)
+    city, network = column_list(sites, "city"), column_list(sites, "network")
+    important = {code_of(sites, "network", x) for x in ("Core Backbone","Regional Network","Metro Network","Data Center")}
+
+    by_city = positions_by(sites, "city")
+    all_sphere = (build_sphere_index(lats, lons, knn=False), None)
+    city_spheres = {}
+    def city_sphere(c):
+        # built on first use: only cities with an under-connected site pay for an index
+        if c not in city_spheres:
+            idx = by_city[c]
+            city_spheres[c] = (build_sphere_index(take(lats, idx), take(lons, idx), knn=False),
+                               {x: k for k, x in enumerate(idx)})
+        return city_spheres[c]
+
+    def random_peer(i):
+        for _ in range(HEAL_RANDOM_TRIES):
+            j = random.randrange(n)
+            if j != i and j not in adj[i]: return j
+        return None
+
+    new_links = link_table()
+    def add(i, j, tier):
+        dist, path = route_link(tier, sites, i, j, routing)
         if dist < 0: return False
-        L = {"site_a_id": aid, "site_b_id": bid, "link_type": tier,
-             "link_distance": dist, "link_kmz_no": "0",
-             "link_wkt": wkt, "last_modified_at": ts(), "is_deleted": 0}
-        new_links.append(L); adj[aid].add(bid); adj[bid].add(aid); return True
-
-    for sid in site_ids:
-        deg = len(adj[sid]); s = sites_by_id[sid]
-        imp = s["network"] in ("Core Backbone","Regional Network","Metro Network","Data Center")
-        target_deg = important_min_degree if imp else min_degree
+        add_link(new_links, i, j, TIER_CODE[tier], dist, route=path); adj[i].add(j); adj[j].add(i)
+        if uf is not None: uf.union(i, j)
+        return True
+
+    for i in range(n):
+        target_deg = important_min_degree if network[i] in important else min_degree
         attempts=0
-        while deg < target_deg and attempts < 6:
-            same_city = by_city[(s["country"], s["city"])]
+        while len(adj[i]) < target_deg and attempts < HEAL_ATTEMPTS:
+            same_city = by_city[city[i]]
             tier_try = "Metro Network" if len(same_city) > 1 else "Regional Network"
-            cand = [x for x in same_city if x != sid]
             best=None
-            if cand: best = pick_best_neighbor(sid, sites_by_id, cand, tier_try, avoid_set=set())
+            if len(same_city) > 1:
+                best = pick_best_neighbor(i, sites, same_city, tier_try, avoid_set=adj[i],
+                                          sphere=city_sphere(city[i]))
             if not best:
-                others = [x for x in site_ids if x != sid]
                 for tier_try2 in ("Regional Network","Core Backbone"):
-                    best = pick_best_neighbor(sid, sites_by_id, others, tier_try2, avoid_set=set())
+                    best = pick_best_neighbor(i, sites, range(n), tier_try2, avoid_set=adj[i],
+                                              sphere=all_sphere)
                     if best: tier_try = tier_try2; break
             if best:
-                _, bid, _ = best
-                if add_link(sid, bid, tier_try): deg += 1
+                _, j, _ = best
+                add(i, j, tier_try)
             else:
-                others = [x for x in site_ids if x != sid]
-                if others and add_link(sid, random.choice(others), "Regional Network"):
-                    deg += 1
+                j = random_peer(i)
+                if j is not None: add(i, j, "Regional Network")
             attempts += 1
 
-    logger.info(f"🔧 Healing added {len(new_links)} links for degree/connectivity")
+    logger.info(f"🔧 Healing added {link_count(new_links)} links for degree/connectivity "
+                f"({len(city_spheres)} city indexes built)")
     return new_links
 
-def connect_components(sites, links, super_hubs_by_region):
-    sites_by_id = {s["site_id"]: s for s in sites}
-    adj = build_adjacency(links, sites_by_id)
-    site_ids = [s["site_id"] for s in sites]
-    comps = connected_components(adj, site_ids)
-    if len(comps) <= 1: return []
-
-    def pick_rep(comp):
-        pref=("Core Backbone","Regional Network","Metro Network","Data Center")
-        csites=[sites_by_id[x] for x in comp]
-        for p in pref:
-            m=[s for s in csites if s["network"]==p]
-            if m: return m[0]["site_id"]
-        return csites[0]["site_id"]
-
-    reps=[pick_rep(c) for c in comps]; bridges=[]
-    for i in range(len(reps)-1):
-        a=reps[i]; b=reps[i+1]; A=sites_by_id[a]; B=sites_by_id[b]
-        d=haversine_km(A["latitude"],A["longitude"],B["latitude"],B["longitude"])
-        tier="Regional Network" if d<1200 else "Core Backbone"
-        dist,wkt = make_routed_geometry(tier, A, B, sites, super_hubs_by_region)
-        if dist<0: continue
-        bridges.append({"site_a_id":a,"site_b_id":b,"link_type":tier,
-                        "link_distance":dist,"link_kmz_no":"0",
-                        "link_wkt":wkt,"last_modified_at":ts(),"is_deleted":0})
-    logger.info(f"🧵 Component connect added {len(bridges)} bridge links (components={len(comps)})")
+# Bridges take the first of these tiers whose range covers the straight distance and routes
+BRIDGE_TIERS = ("PATCH","Access Network","Metro Network","Regional Network","Core Backbone","International Gateway")
+BRIDGE_KNN = 8      # nearest sites in other components tried per query site in the first round (doubles after)
+BRIDGE_SAMPLE = 32  # query sites per component, spread over its members
+
+def connect_components(sites, links, routing, uf=None):
+    """
+    Bridge the components left after healing along a geographic minimum spanning tree:
+    every component but the largest queries the all-sites sphere index, from up to
+    BRIDGE_SAMPLE of its members, for their nearest sites in other components, and the
+    candidate edges are taken shortest first (Kruskal). Pairs that fail to route are
+    skipped, and the neighbour count doubles until one component remains or none is left
+    to try. uf is the SiteUnionFind kept while links were accepted (built from links if None).
+    """
+    if uf is None:
+        uf = SiteUnionFind(sites["n"]); uf.add_links(links)
+    bridges = link_table()
+    comps = uf.groups()
+    if len(comps) <= 1: return bridges
+
+    n = sites["n"]
+    lats, lons = column_list(sites, "latitude"), column_list(sites, "longitude")
+    comp_of = [0]*n
+    for c, comp in enumerate(comps):
+        for x in comp: comp_of[x] = c
+    index = build_sphere_index(lats, lons, groups=comp_of, knn=False)
+    largest = max(range(len(comps)), key=lambda c: len(comps[c]))
+    queries = [(c, comp[t * len(comp) // min(len(comp), BRIDGE_SAMPLE)])
+               for c, comp in enumerate(comps) if c != largest
+               for t in range(min(len(comp), BRIDGE_SAMPLE))]
+
+    tried=set(); k=BRIDGE_KNN
+    while uf.components > 1:
+        edges=[]
+        for c, i in queries:
+            for j in nearest_k(index, lats[i], lons[i], k, skip_groups=(c, c+1)):
+                if (min(i,j), max(i,j)) in tried or uf.find(i) == uf.find(j): continue
+                tried.add((min(i,j), max(i,j)))
+                edges.append((haversine_km(lats[i], lons[i], lats[j], lons[j]), i, j))
+        for d, i, j in sorted(edges):
+            if uf.find(i) == uf.find(j): continue
+            for tier in BRIDGE_TIERS:
+                dmin, dmax = TIER_RANGES[tier]
+                if not dmin <= d <= dmax: continue
+                dist,path = route_link(tier, sites, i, j, routing)
+                if dist<0: continue
+                add_link(bridges, i, j, TIER_CODE[tier], dist, route=path)
+                uf.union(i, j); break
+        if k >= n - 1: break
+        k *= 2
+    left = uf.components
+    if left > 1:
+        logger.warning(f"⚠️ Component connect added {link_count(bridges)} bridge links but {left} of "
+                       f"{len(comps)} components are still disconnected (no routable pair within BRIDGE_TIERS ranges)")
+    else:
+        logger.info(f"🧵 Component connect added {link_count(bridges)} bridge links (components={len(comps)}, left=1)")
     return bridges
 
 # -------------------- Main --------------------
+# Spec: tier -> (jitter_km, pts_per_1000, forbid_same_city); distance ranges come from TIER_RANGES
+TIER_SPEC: Dict[str, tuple] = {
+    "Core Backbone":            (15, 6, True),
+    "International Gateway":    (20, 6, True),
+    "Regional Network":         (8, 6, True),
+    "Metro Network":            (2, 4, False),
+    "Access Network":           (0.8, 3, False),
+    "Data Center Interconnect": (0.4, 3, False),
+    "INTERCONNECT":             (6, 4, True),
+    "PATCH":                    (0.3, 3, False),
+}
+
+def tier_cache_key(tier: str, budget: int, shards: List[Tuple[int,int,int,int,int]], sites_key: str,
+                   code_key: str, super_hub_cities: frozenset, regional_hub_cities: frozenset, seed_base: int,
+                   enforce_policy: bool) -> str:
+    """Cache key of one tier's reconciled links: every input of its shards and of reconcile_tier()."""
+    return cache_key({"code": code_key, "tier": tier, "budget": budget, "shards": shards,
+                      "range": TIER_RANGES[tier], "spec": TIER_SPEC[tier],
+                      "caps": [DEGREE_CAPS.get(tier), PAIR_CAPS.get(tier), SECTOR_CAPS.get(tier), SECTOR_DEG],
+                      "sample": SAMPLE_CANDIDATES, "sites": sites_key,
+                      "hubs": [super_hub_cities, regional_hub_cities], "seed": seed_base, "policy": enforce_policy})
+
+def generate_links(sites: Dict[str,Any], budgets: Dict[str,int], routing: Dict[str,Any],
+                   super_hubs_by_region: Dict[str, List[str]], regional_hubs_by_country: Dict[str, List[str]],
+                   processes: int, enforce_policy: bool = True, on_links=None, cache_dir: str = None) -> Dict[str,Any]:
+    """
+    Link table over sites, in two phases. Topology: tier budgets in parallel, metro rings,
+    healing and component bridging decide each link's endpoints, tier and routed length,
+    keeping its route_link() waypoints. Geometry: build_geometries() then turns the routes
+    of the links that survived into polylines on the same pool, so candidates dropped by
+    caps or reconciliation never pay for geometry. on_links(links, start, stop), if given,
+    is called as each run of links gets its geometry.
+    With cache_dir, each tier's reconciled links are stored there under tier_cache_key()
+    and reused on later runs; only tiers whose key changed are generated again.
+    """
+    super_hub_cities = hub_city_codes(sites, super_hubs_by_region)
+    regional_hub_cities = hub_city_codes(sites, regional_hubs_by_country)
+    seed_base=42
+    sites_key = cache_key([sites["cols"], sites["vocab"]]) if cache_dir else None
+    code_key = files_key(TIER_CACHE_SOURCES) if cache_dir else None
+    kept_by_tier: Dict[str, Any] = {}; keys = {}; todo = []
+    for tier in TIER_SPEC:
+        budget = int(budgets.get(tier, 0))
+        if budget <= 0: continue
+        shards = tier_shards(budget, sites["n"])
+        kept_by_tier[tier] = None
+        if cache_dir:
+            keys[tier] = tier_cache_key(tier, budget, shards, sites_key, code_key, super_hub_cities, regional_hub_cities,
+                                        seed_base, enforce_policy)
+            kept_by_tier[tier] = load_cached(cache_dir, tier, keys[tier])
+            if kept_by_tier[tier] is not None:
+                logger.info(f"♻️ Tier {tier}: {link_count(kept_by_tier[tier])} links from the tier cache")
+                continue
+        todo.append((tier, shards))
+
+    # Parallel tier generation: the site table, pair index and routing context are published
+    # once through shared memory and every worker attaches to them by name
+    shared_handle, shared_block = (publish({"sites": sites, "pair_index": build_pair_index(sites), "routing": routing,
+                                            "hilbert": as_array(hilbert_site_order(sites), int)})
+                                   if todo else (None, None))
+    if shared_block: logger.info(f"🧠 Shared {shared_block.size/1024/1024:.1f} MB with the tier pool ({shared_block.name})")
+    work=[]; shard_counts={}
+    for tier, shards in todo:
+        jitter_km, pts_per_1000, forbid_same_city = TIER_SPEC[tier]; min_km, max_km = TIER_RANGES[tier]
+        for shard_no, shard_count, lo, hi, shard_budget in shards:
+            work.append((tier,shard_budget,float(min_km),float(max_km),
+                         float(jitter_km),int(pts_per_1000),
+                         shared_handle, seed_base, bool(forbid_same_city), bool(enforce_policy),
+                         super_hub_cities, regional_hub_cities, (shard_no, shard_count, lo, hi)))
+            shard_counts[tier] = shard_count
+    work.sort(key=lambda w: -w[1])  # biggest shards first
+    logger.info(f"🧩 {len(work)} tier shards: {shard_counts}")
+
+    links = link_table(); uf = SiteUnionFind(sites["n"])
+    with mp.Pool(processes=processes) as pool:
+        try:
+            if work:
+                shard_links = {tier: [None]*count for tier, count in shard_counts.items()}
+                for tier, shard_no, part in pool.imap_unordered(gen_links_for_tier, work, chunksize=1):
+                    shard_links[tier][shard_no] = part
+                for tier, parts in shard_links.items():
+                    kept_by_tier[tier] = reconcile_tier(tier, parts, int(budgets[tier]), sites)
+                    if cache_dir: store_cached(cache_dir, tier, keys[tier], kept_by_tier[tier])
+        finally:
+            release(shared_block)
+        for kept in kept_by_tier.values():
+            extend_links(links, kept); uf.add_links(kept)
+
+        # Seed ~50% of Metro budget with structured rings
+        seed_metro_rings(sites, links, int(budgets.get("Metro Network", 0) * 0.5), routing, uf)
+
+        # Healing + component bridging
+        extend_links(links, heal_isolated_and_low_degree(sites, links, routing, min_degree=1, important_min_degree=2, uf=uf))
+        extend_links(links, connect_components(sites, links, routing, uf=uf))
+        logger.info(f"🗺️ Topology: {link_count(links)} links; building geometry")
+
+        build_geometries(links, pool, seed=seed_base, on_chunk=on_links)
+    return links
+
 def main(
     sites_per_city: int = DEFAULT_SITES_PER_CITY,
     hot_city_multiplier: int = HOT_CITY_MULTIPLIER,
     processes: int = max(2, mp.cpu_count()-1),
-    enforce_policy: bool = True
+    enforce_policy: bool = True,
+    sink=None,
+    keep_json: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+    compression: str = OUTPUT_COMPRESSION,
+    split_records: int = SPLIT_RECORDS,
+    tier_cache: bool = TIER_CACHE
 ):
+    """
+    Generate data/sites and data/links in output_format, appending records as they are
+    ready: sites first, then links chunk by chunk as the geometry phase builds them.
+    With sink, records go to sink(kind, records) instead (setup_data-real.py --fused);
+    keep_json writes the files as well. tier_cache reuses unchanged tiers from TIER_CACHE_DIR.
+    """
     logger.info("🚀 Generating realistic sites & links (v5, corridor-first)")
     logger.info(f"⚙️ processes={processes}, sites_per_city={sites_per_city}, hot_multiplier={hot_city_multiplier}, policy={enforce_policy}")
     sites = build_sites(sites_per_city, hot_city_multiplier)
+    files = RecordFiles(OUTPUT_DIR, output_format, compression, split_records) if sink is None or keep_json else None
+    emit = tee_sinks(sink, files)
+    emit("sites", site_records(sites))
 
     # Hub hierarchy
     super_hubs_by_region = pick_super_hubs(sites, per_region=4)
     regional_hubs_by_country = pick_regional_hubs(sites, per_country=2)
     logger.info(f"🏛️ Super-hubs: {dict(super_hubs_by_region)}")
     logger.info(f"🏙️ Regional hubs: {dict(regional_hubs_by_country)}")
+    routing = build_routing_context(sites, super_hubs_by_region)
+    logger.info(f"🧭 Routing context: {len(routing['city_index'])} indexed anchor cities")
+
+    links = generate_links(sites, LINK_BUDGET, routing, super_hubs_by_region, regional_hubs_by_country,
+                           processes, enforce_policy,
+                           on_links=lambda links, start, stop: emit("links", link_records(links, start, stop)),
+                           cache_dir=TIER_CACHE_DIR if tier_cache else None)
+
+    # Dicts only from here on: IDs are assigned by position as the records are written
+    logger.info(f"📈 Final totals: sites={sites['n']} links={link_count(links)} (target {TOTAL_LINKS})")
+    if files:
+        files.close()
+        logger.info(f"💾 Wrote {files.path('sites')} and {files.path('links')}")
+    logger.info("🎉 Generation complete")
 
-    # Seed metro rings (cleaner metro layer)
-    metro_pairs = build_metro_links(sites, k_neighbors=4)
-
-    # Spec: (budget, min_km, max_km, jitter_km, pts_per_1000, forbid_same_city)
-    tier_spec: Dict[str, tuple] = {
-        "Core Backbone":            (LINK_BUDGET["Core Backbone"],            *TIER_RANGES["Core Backbone"],            15, 6, True),
-        "International Gateway":    (LINK_BUDGET["International Gateway"],    *TIER_RANGES["International Gateway"],    20, 6, True),
-        "Regional Network":         (LINK_BUDGET["Regional Network"],         *TIER_RANGES["Regional Network"],          8, 6, True),
-        "Metro Network":            (LINK_BUDGET["Metro Network"],            *TIER_RANGES["Metro Network"],             2, 4, False),
-        "Access Network":           (LINK_BUDGET["Access Network"],           *TIER_RANGES["Access Network"],          0.8, 3, False),
-        "Data Center Interconnect": (LINK_BUDGET["Data Center Interconnect"], *TIER_RANGES["Data Center Interconnect"], 0.4, 3, False),
-        "INTERCONNECT":             (LINK_BUDGET["INTERCONNECT"],             *TIER_RANGES["INTERCONNECT"],              6, 4, True),
-        "PATCH":                    (LINK_BUDGET["PATCH"],                    *TIER_RANGES["PATCH"],                   0.3, 3, False),
-    }
+# -------------------- Scale mode --------------------
+# main_scaled() builds the regular dataset as the metro cores, long-haul network included,
+# then grows every metro with towns: clusters the size of the core, TOWN_RING_KM from it.
+# Towns are generated in chunks of whole towns of one metro, each a pool task with its own
+# local tiers, rings, healing and bridging plus an uplink per town into the core. Chunks
+# spill to a staging SQLite file as they complete and the JSON outputs are streamed from
+# it, so memory depends on the chunk size, not on the requested scale.
+SCALE_CHUNK_SITES = 20000
+SCALE_SEED = 42
+TOWN_RING_KM = (15, 120)
+LOCAL_TIERS = ("Metro Network","Access Network","Data Center Interconnect","PATCH")
+STAGING_DB = os.path.join(OUTPUT_DIR, "scale_staging.db")
+STAGING_SCHEMA = (
+    "CREATE TABLE sites (pos INTEGER PRIMARY KEY, country TEXT, city TEXT, network TEXT, platform TEXT,"
+    " latitude REAL, longitude REAL)",
+    "CREATE TABLE links (k INTEGER PRIMARY KEY, a INTEGER, b INTEGER, tier INTEGER, distance REAL, geom TEXT)",
+)
 
-    # Parallel tier generation
-    work=[]; seed_base=42
-    for tier,(budget,min_km,max_km,jitter_km,pts_per_1000,forbid_same_city) in tier_spec.items():
-        if budget>0:
-            work.append((tier,int(budget),float(min_km),float(max_km),
-                         float(jitter_km),int(pts_per_1000),
-                         sites, seed_base, bool(forbid_same_city), bool(enforce_policy),
-                         super_hubs_by_region, regional_hubs_by_country))
+def staged_site_rows(sites: Dict[str,Any], offset: int = 0):
+    """Staging rows of a site table whose site 0 is global position offset."""
+    lats, lons = column_list(sites, "latitude"), column_list(sites, "longitude")
+    names = {f: sites["vocab"][f] for f in SITE_CATEGORICALS}
+    codes = {f: column_list(sites, f) for f in SITE_CATEGORICALS}
+    return [(offset+i, *(names[f][codes[f][i]] for f in ("country","city","network","platform")), lats[i], lons[i])
+            for i in range(sites["n"])]
+
+def staged_link_rows(links: Dict[str,Any], offset: int = 0):
+    """Staging rows (k is assigned by SQLite) of a link table over sites numbered from offset."""
+    text = json.dumps if LINK_GEOMETRY == "coords" else str
+    return [(offset+a, offset+b, links["tier"][k], links["distance"][k], text(links["geom"][k]))
+            for k, (a, b) in enumerate(link_ends(links))]
+
+def staged_site_records(conn: sqlite3.Connection):
+    now = ts()
+    for row in conn.execute("SELECT * FROM sites ORDER BY pos"):
+        yield site_record(*row, now)
+
+def staged_link_records(conn: sqlite3.Connection):
+    now = ts(); geom_of = json.loads if LINK_GEOMETRY == "coords" else str
+    for k, (a, b, tier, dist, geom) in enumerate(conn.execute("SELECT a, b, tier, distance, geom FROM links ORDER BY k")):
+        yield link_record(k, a, b, tier, dist, geom_of(geom), now)
+
+def open_staging(path: str = STAGING_DB) -> sqlite3.Connection:
+    if os.path.exists(path): os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF;"); conn.execute("PRAGMA synchronous = OFF;")
+    for sql in STAGING_SCHEMA: conn.execute(sql)
+    return conn
+
+def stage(conn: sqlite3.Connection, site_rows, link_rows):
+    conn.executemany("INSERT INTO sites VALUES (?,?,?,?,?,?,?)", site_rows)
+    conn.executemany("INSERT INTO links (a, b, tier, distance, geom) VALUES (?,?,?,?,?)", link_rows)
+    conn.commit()
+
+def metro_cores(base: Dict[str,Any]) -> Dict[int,Dict[str,Any]]:
+    """Per city code of the regular dataset: its centre and its sites (positions, coordinates, names)."""
+    centre = {city: (lat, lon) for _, city, lat, lon in ALL_LOCATIONS}
+    cores = {}
+    for c, idx in positions_by(base, "city").items():
+        city = base["vocab"]["city"][c]
+        cores[c] = {"country": name_of(base, "country", idx[0]), "city": city, "centre": centre[city], "pos": idx,
+                    "lat": [float(base["cols"]["latitude"][i]) for i in idx],
+                    "lon": [float(base["cols"]["longitude"][i]) for i in idx],
+                    "network": [name_of(base, "network", i) for i in idx],
+                    "platform": [name_of(base, "platform", i) for i in idx]}
+    return cores
+
+def scale_plan(base: Dict[str,Any], scale: int, chunk_sites: int) -> List[Tuple[int,int,int,int,int]]:
+    """(city code, first town, town count, town size, first position) per chunk; towns 1..scale-1 of each metro."""
+    plan=[]; pos = base["n"]
+    for c, idx in positions_by(base, "city").items():
+        size = len(idx); per_chunk = max(1, chunk_sites // size)
+        for first in range(1, scale, per_chunk):
+            count = min(per_chunk, scale - first)
+            plan.append((c, first, count, size, pos)); pos += count*size
+    return plan
+
+def build_towns(core: Dict[str,Any], first_town: int, town_count: int, town_size: int, first_pos: int) -> Dict[str,Any]:
+    """Site table of towns first_town.. of a metro, each town_size sites around a point TOWN_RING_KM from the centre."""
+    lat0, lon0 = core["centre"]
+    lats=[]; lons=[]; cities=[]; networks=[]; platforms=[]
+    for t in range(first_town, first_town+town_count):
+        town = f"{core['city']} Town {t}"
+        bearing = random.uniform(0, 2*math.pi); km = random.uniform(*TOWN_RING_KM)
+        tlat = max(-85.0, min(85.0, lat0 + km/111.0*math.cos(bearing)))
+        tlon = lon0 + km/(111.0*max(0.2, math.cos(math.radians(lat0))))*math.sin(bearing)
+        for _ in range(town_size):
+            jlat,jlon = jitter_latlon(tlat, tlon, km=random.uniform(*SITE_JITTER_KM_MIN_MAX))
+            networks.append(assign_network_for_site(town, False, False))
+            platforms.append(weighted_platform_for(first_pos+len(lats)+1, False, False))
+            cities.append(town); lats.append(round(jlat, 6)); lons.append(round(jlon, 6))
+    return with_regions(site_table(lats, lons, country=[core["country"]]*len(lats), city=cities,
+                                   network=networks, platform=platforms))
+
+def town_uplinks(towns: Dict[str,Any], core: Dict[str,Any], routing: Dict[str,Any], uf: SiteUnionFind,
+                 tries: int = 3):
+    """
+    One link per town, and per component within a town if bridging left it split, from
+    its site closest to the metro centre to one of the nearest core sites, as a link
+    table from town positions to global core positions, routes only. The tier is the
+    first of BRIDGE_TIERS that covers the distance and routes, as for bridges.
+    """
+    lats, lons = towns["cols"]["latitude"], towns["cols"]["longitude"]
+    core_lats, core_lons = as_array(core["lat"], float), as_array(core["lon"], float)
+    city = column_list(towns, "city")
+    groups: Dict[Tuple[int,int], List[int]] = {}
+    for i in range(towns["n"]): groups.setdefault((city[i], uf.find(i)), []).append(i)
+    out = link_table()
+    for (c, _), idx in groups.items():
+        i = idx[k_smallest(haversine_one_to_many(*core["centre"], take(lats, idx), take(lons, idx)), 1)[0]]
+        lat, lon = site_latlon(towns, i)
+        d = haversine_one_to_many(lat, lon, core_lats, core_lons)
+        for k in k_smallest(d, tries):
+            pair = with_regions(site_table([lat, core["lat"][k]], [lon, core["lon"][k]],
+                                           country=[core["country"]]*2, city=[towns["vocab"]["city"][c], core["city"]],
+                                           network=[name_of(towns, "network", i), core["network"][k]],
+                                           platform=[name_of(towns, "platform", i), core["platform"][k]]))
+            for tier in BRIDGE_TIERS:
+                dmin, dmax = TIER_RANGES[tier]
+                if not dmin <= float(d[k]) <= dmax: continue
+                dist, path = route_link(tier, pair, 0, 1, routing)
+                if dist < 0: continue
+                add_link(out, i, core["pos"][k], TIER_CODE[tier], dist, route=path); break
+            else:
+                continue
+            break
+    return out
 
-    links=[]
-    if work:
+def gen_town_chunk(args):
+    """Staging rows (sites, links) of one chunk of towns, positions global."""
+    chunk_no, core, first_town, town_count, town_size, first_pos, budgets, shared_handle, enforce_policy = args
+    routing = attach(shared_handle)["routing"]
+    seed = (SCALE_SEED ^ (chunk_no * 0x9E3779B1)) & 0xFFFFFFFF
+    random.seed(seed)
+    towns = build_towns(core, first_town, town_count, town_size, first_pos)
+
+    links = link_table(); uf = SiteUnionFind(towns["n"]); index = build_pair_index(towns)
+    for tier in LOCAL_TIERS:
+        budget = budgets.get(tier, 0); min_km, max_km = TIER_RANGES[tier]
+        if budget <= 0: continue
+        pairs = pick_pairs_within(index, min_km, max_km, budget*3, forbid_same_city=TIER_SPEC[tier][2],
+                                  seed=seed ^ TIER_CODE[tier])
+        kept = tier_links(tier, budget, towns, routing, pairs, enforce_policy, frozenset(), frozenset())
+        extend_links(links, kept); uf.add_links(kept)
+    seed_metro_rings(towns, links, int(budgets.get("Metro Network", 0) * 0.5), routing, uf)
+    extend_links(links, heal_isolated_and_low_degree(towns, links, routing, min_degree=1, important_min_degree=2, uf=uf))
+    extend_links(links, connect_components(towns, links, routing, uf=uf))
+    uplinks = town_uplinks(towns, core, routing, uf)
+
+    # geometry inline: chunks already run one per pool process
+    build_geometries(links, seed=seed); build_geometries(uplinks, seed=seed ^ 1)
+    link_rows = staged_link_rows(links, first_pos)
+    text = json.dumps if LINK_GEOMETRY == "coords" else str
+    link_rows += [(first_pos+i, j, tier, dist, text(geom)) for i, j, tier, dist, geom
+                  in zip(uplinks["a"], uplinks["b"], uplinks["tier"], uplinks["distance"], uplinks["geom"])]
+    logger.info(f"🏘️ Chunk {chunk_no}: {town_count} towns of {core['city']}, {towns['n']} sites, "
+                f"{len(link_rows)} links ({link_count(uplinks)} uplinks)")
+    return staged_site_rows(towns, first_pos), link_rows
+
+def main_scaled(
+    scale: int,
+    chunk_sites: int = SCALE_CHUNK_SITES,
+    link_density: float = 1.0,
+    sites_per_city: int = DEFAULT_SITES_PER_CITY,
+    hot_city_multiplier: int = HOT_CITY_MULTIPLIER,
+    processes: int = max(2, mp.cpu_count()-1),
+    enforce_policy: bool = True,
+    sink=None,
+    keep_json: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+    compression: str = OUTPUT_COMPRESSION,
+    split_records: int = SPLIT_RECORDS,
+    tier_cache: bool = TIER_CACHE
+):
+    """main() at scale; outputs and sink are fed from the staging file once every chunk is staged."""
+    logger.info(f"🚀 Generating a scaled network: scale={scale}, chunk_sites={chunk_sites}, link_density={link_density}")
+    base = build_sites(sites_per_city, hot_city_multiplier)
+    super_hubs_by_region = pick_super_hubs(base, per_region=4)
+    regional_hubs_by_country = pick_regional_hubs(base, per_country=2)
+    routing = build_routing_context(base, super_hubs_by_region)
+    links = generate_links(base, LINK_BUDGET, routing, super_hubs_by_region, regional_hubs_by_country,
+                           processes, enforce_policy, cache_dir=TIER_CACHE_DIR if tier_cache else None)
+
+    conn = open_staging()
+    stage(conn, staged_site_rows(base), staged_link_rows(links))
+    n_sites, n_links = base["n"], link_count(links)
+    del links
+
+    # local tier budgets per town site, at the regular dataset's links per site
+    per_site = {t: LINK_BUDGET[t] * link_density / base["n"] for t in LOCAL_TIERS}
+    cores = metro_cores(base)
+    plan = scale_plan(base, scale, chunk_sites)
+    shared_handle, shared_block = publish({"routing": routing})
+    tasks = [(k, cores[c], first, count, size, pos, {t: int(round(b*count*size)) for t, b in per_site.items()},
+              shared_handle, enforce_policy) for k, (c, first, count, size, pos) in enumerate(plan)]
+    logger.info(f"🧩 {len(tasks)} town chunks for {sum(t[3]*t[4] for t in tasks)} sites")
+    try:
         with mp.Pool(processes=processes) as pool:
-            results = pool.map(gen_links_for_tier, work)
-        for lst in results: links.extend(lst)
-
-    # Seed ~50% of Metro budget with structured rings
-    deg_by_tier = defaultdict(dict); pair_counts={}; sector_counts={}
-    ring_target = int(LINK_BUDGET["Metro Network"] * 0.5)
-    add_count=0
-    for i,j in metro_pairs:
-        if add_count >= ring_target: break
-        A=sites[i]; B=sites[j]
-        if not ok_by_caps("Metro Network", A, B, deg_by_tier, pair_counts, sector_counts): continue
-        dist,wkt = make_routed_geometry("Metro Network", A, B, sites, super_hubs_by_region)
-        if dist<0: continue
-        bump_caps("Metro Network", A, B, deg_by_tier, pair_counts, sector_counts)
-        links.append({"link_id": f"MetroSeed__TMP_{add_count+1:06d}",
-                      "site_a_id":A["site_id"],"site_b_id":B["site_id"],
-                      "link_type":"Metro Network","link_distance":dist,
-                      "link_kmz_no":"0","link_wkt":wkt,
-                      "last_modified_at":ts(),"is_deleted":0})
-        add_count+=1
-    if add_count: logger.info(f"🏙️ Seeded {add_count} metro ring links")
-
-    # Sequential IDs
-    for idx,L in enumerate(links, start=1): L["link_id"]=f"LINK_{idx:06d}"
-
-    # Healing + component bridging
-    healed = heal_isolated_and_low_degree(sites, links, min_degree=1, important_min_degree=2, super_hubs_by_region=super_hubs_by_region)
-    links.extend(healed)
-    bridges = connect_components(sites, links, super_hubs_by_region)
-    links.extend(bridges)
-
-    # Re-ID
-    for idx,L in enumerate(links, start=1): L["link_id"]=f"LINK_{idx:06d}"
-
-    logger.info(f"📈 Final totals: sites={len(sites)} links={len(links)} (target {TOTAL_LINKS})")
-    with open(os.path.join(OUTPUT_DIR,'sites.json'),'w') as f: json.dump(sites, f, indent=2)
-    with open(os.path.join(OUTPUT_DIR,'links.json'),'w') as f: json.dump(links, f, indent=2)
-    logger.info(f"💾 Wrote {OUTPUT_DIR}/sites.json and {OUTPUT_DIR}/links.json")
+            # a window of tasks at a time, so finished chunks never queue up in memory
+            window = processes * 2
+            for start in range(0, len(tasks), window):
+                for site_rows, link_rows in pool.imap(gen_town_chunk, tasks[start:start+window]):
+                    stage(conn, site_rows, link_rows)
+                    n_sites += len(site_rows); n_links += len(link_rows)
+                logger.info(f"📦 Staged {min(start+window, len(tasks))}/{len(tasks)} chunks: "
+                            f"sites={n_sites} links={n_links}")
+    finally:
+        release(shared_block)
+
+    logger.info(f"📈 Final totals: sites={n_sites} links={n_links}")
+    files = RecordFiles(OUTPUT_DIR, output_format, compression, split_records) if sink is None or keep_json else None
+    emit = tee_sinks(sink, files)
+    emit("sites", staged_site_records(conn)); emit("links", staged_link_records(conn))
+    if files:
+        files.close()
+        logger.info(f"💾 Wrote {files.path('sites')} and {files.path('links')}")
+    conn.close(); os.remove(STAGING_DB)
     logger.info("🎉 Generation complete")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=int, default=1,
+                    help="grow every metro to this many times its regular site count, in bounded-memory chunks")
+    ap.add_argument("--chunk-sites", type=int, default=SCALE_CHUNK_SITES, help="town sites per scale-mode task")
+    ap.add_argument("--link-density", type=float, default=1.0,
+                    help="town link budget relative to the regular dataset's links per site")
+    ap.add_argument("--processes", type=int, default=max(2, mp.cpu_count()-1))
+    ap.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default=OUTPUT_FORMAT,
+                    help="JSON arrays or NDJSON (one compact record per line)")
+    ap.add_argument("--compress", choices=[c for c in COMPRESSIONS if c], default=OUTPUT_COMPRESSION)
+    ap.add_argument("--split-records", type=int, default=SPLIT_RECORDS,
+                    help="NDJSON: start a new numbered part every N records (0 = one file)")
+    ap.add_argument("--no-tier-cache", action="store_true", help=f"regenerate every tier, ignoring {TIER_CACHE_DIR}")
+    args = ap.parse_args()
+    output = dict(output_format=args.format, compression=args.compress, split_records=args.split_records,
+                  tier_cache=TIER_CACHE and not args.no_tier_cache)
     try:
-        main(
-            sites_per_city=DEFAULT_SITES_PER_CITY,
-            hot_city_multiplier=HOT_CITY_MULTIPLIER,
-            processes=max(2, mp.cpu_count()-1),
-            enforce_policy=True
-        )
+        if args.scale > 1:
+            main_scaled(args.scale, chunk_sites=args.chunk_sites, link_density=args.link_density,
+                        processes=args.processes, **output)
+        else:
+            main(
+                sites_per_city=DEFAULT_SITES_PER_CITY,
+                hot_city_multiplier=HOT_CITY_MULTIPLIER,
+                processes=args.processes,
+                enforce_policy=True,
+                **output
+            )
     except Exception as e:
         logger.error(f"❌ Fatal error: {e}", exc_info=True)
         raise
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Geodesic kernels shared by the generators and the PeeringDB tools.
+
+The scalar functions use `math`. The *_many functions take a point and
+sequences (or arrays) of lat/lon and are vectorized with NumPy when it is
+installed; without it they fall back to plain loops with identical results.
+They return NumPy arrays, or lists in the fallback, so callers should index
+and iterate rather than rely on array methods.
+
+The sphere index at the end answers great-circle annulus (min_km <= d <= max_km)
+and k-nearest queries; see build_sphere_index().
+"""
+import math
+import bisect
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    HAVE_NP = True
+except Exception:
+    HAVE_NP = False
+
+try:
+    from sklearn.neighbors import KDTree
+    HAVE_SK = True
+except Exception:
+    HAVE_SK = False
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+# ---------- Scalar ----------
+
+def haversine_km(lat1, lon1, lat2, lon2) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def planar_bearing_deg(lat1, lon1, lat2, lon2) -> float:
+    """Bearing of (lat2, lon2) from (lat1, lon1) on the lon/lat plane, 0 = east, counter-clockwise."""
+    return (math.degrees(math.atan2(lat2 - lat1, lon2 - lon1)) + 360.0) % 360.0
+
+
+def unit_xyz(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Point on the unit sphere; chord distance orders neighbours like great-circle distance."""
+    la, lo = math.radians(lat), math.radians(lon)
+    return (math.cos(la)*math.cos(lo), math.cos(la)*math.sin(lo), math.sin(la))
+
+
+# ---------- Vectorized ----------
+
+def haversine_one_to_many(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float]):
+    """Distances (km) from one point to each of (lats[i], lons[i])."""
+    if not HAVE_NP:
+        return [haversine_km(lat, lon, la, lo) for la, lo in zip(lats, lons)]
+    la2 = np.radians(np.asarray(lats, dtype=float)); lo2 = np.radians(np.asarray(lons, dtype=float))
+    la1 = math.radians(lat); lo1 = math.radians(lon)
+    a = np.sin((la2 - la1)/2)**2 + math.cos(la1) * np.cos(la2) * np.sin((lo2 - lo1)/2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_many_to_many(lats1: Sequence[float], lons1: Sequence[float],
+                           lats2: Sequence[float], lons2: Sequence[float]):
+    """len(lats1) x len(lats2) distance matrix (km)."""
+    if not HAVE_NP:
+        return [haversine_one_to_many(la, lo, lats2, lons2) for la, lo in zip(lats1, lons1)]
+    la1 = np.radians(np.asarray(lats1, dtype=float))[:, None]; lo1 = np.radians(np.asarray(lons1, dtype=float))[:, None]
+    la2 = np.radians(np.asarray(lats2, dtype=float))[None, :]; lo2 = np.radians(np.asarray(lons2, dtype=float))[None, :]
+    a = np.sin((la2 - la1)/2)**2 + np.cos(la1) * np.cos(la2) * np.sin((lo2 - lo1)/2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def project_on_segment_many(a_lat: float, a_lon: float, b_lat: float, b_lon: float,
+                            lats: Sequence[float], lons: Sequence[float]):
+    """Position t of each point projected on A->B in the lon/lat plane (0 at A, 1 at B)."""
+    vx, vy = b_lon - a_lon, b_lat - a_lat
+    den = vx*vx + vy*vy + 1e-9
+    if not HAVE_NP:
+        return [(vx*(lo - a_lon) + vy*(la - a_lat)) / den for la, lo in zip(lats, lons)]
+    return (vx*(np.asarray(lons, dtype=float) - a_lon) + vy*(np.asarray(lats, dtype=float) - a_lat)) / den
+
+
+def first_in_range(dists, lo: float, hi: float) -> int:
+    """Index of the first distance with lo <= d <= hi, or -1."""
+    if HAVE_NP and not isinstance(dists, list):
+        hits = np.flatnonzero((dists >= lo) & (dists <= hi))
+        return int(hits[0]) if hits.size else -1
+    for k, d in enumerate(dists):
+        if lo <= d <= hi:
+            return k
+    return -1
+
+
+def k_smallest(values, k: int) -> List[int]:
+    """Indices of the k smallest values, ascending (stable on ties)."""
+    n = len(values)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if HAVE_NP and not isinstance(values, list):
+        part = np.argpartition(values, k - 1)[:k] if k < n else np.arange(n)
+        return [int(i) for i in part[np.lexsort((part, values[part]))]]
+    return sorted(range(n), key=lambda i: values[i])[:k]
+
+
+def closest_to_in_range(dists, lo: float, hi: float, target: float, exclude: Sequence[int] = ()) -> int:
+    """Index of the distance in [lo, hi] nearest to target (first on ties), skipping `exclude`; -1 if none."""
+    if HAVE_NP and not isinstance(dists, list):
+        score = np.where((dists >= lo) & (dists <= hi), np.abs(dists - target), np.inf)
+        if len(exclude):
+            score[np.asarray(exclude, dtype=np.intp)] = np.inf
+        k = int(np.argmin(score)) if len(score) else -1
+        return k if k >= 0 and np.isfinite(score[k]) else -1
+    skip = set(exclude); best = -1; best_score = math.inf
+    for k, d in enumerate(dists):
+        if k in skip or d < lo or d > hi:
+            continue
+        if abs(d - target) < best_score:
+            best, best_score = k, abs(d - target)
+    return best
+
+
+def take(values, idx: Sequence[int]):
+    """values[idx] for an array, or the equivalent list."""
+    if HAVE_NP and not isinstance(values, list):
+        return values[np.asarray(idx, dtype=np.intp)]
+    return [values[i] for i in idx]
+
+
+def coord_arrays(points: Sequence[Tuple[float, float]]):
+    """(lats, lons) from [(lat, lon), ...] as arrays, or lists without NumPy."""
+    lats = [p[0] for p in points]; lons = [p[1] for p in points]
+    if HAVE_NP:
+        return np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    return lats, lons
+
+
+def as_array(values, dtype=float):
+    """NumPy array of values, or a list without NumPy."""
+    return np.asarray(values, dtype=dtype) if HAVE_NP else list(values)
+
+
+ROW_BLOCK = 1024  # rows of the distance matrix k_nearest_other_group() holds at once
+
+
+def k_nearest_other_group(lats: Sequence[float], lons: Sequence[float], groups: Sequence, k: int) -> List[List[int]]:
+    """For each point, indices of its k nearest points in a different group (ascending, stable on ties)."""
+    n = len(lats)
+    codes: dict = {}
+    code = [codes.setdefault(g, len(codes)) for g in groups]
+    out = []
+    if HAVE_NP:
+        lats, lons = as_array(lats), as_array(lons)
+        code_arr = np.asarray(code)
+        for a in range(0, n, ROW_BLOCK):
+            b = min(n, a + ROW_BLOCK)
+            dists = haversine_many_to_many(lats[a:b], lons[a:b], lats, lons)
+            dists[code_arr[a:b, None] == code_arr[None, :]] = np.inf
+            for row in dists:
+                out.append([j for j in k_smallest(row, k) if np.isfinite(row[j])])
+        return out
+    for i in range(n):
+        row = haversine_one_to_many(lats[i], lons[i], lats, lons)
+        row = [math.inf if code[j] == code[i] else d for j, d in enumerate(row)]
+        out.append([j for j in k_smallest(row, k) if row[j] != math.inf])
+    return out
+
+
+# ---------- Polylines ----------
+# Batches of paths are stored flat: path k is lats/lons[offsets[k]:offsets[k+1]].
+
+def _densify_path(lats, lons, n_mid: int, jitter_km: float, rnd) -> List[Tuple[float, float]]:
+    pts = [(lats[0], lons[0])]
+    for a_lat, a_lon, b_lat, b_lon in zip(lats[:-1], lons[:-1], lats[1:], lons[1:]):
+        for i in range(1, n_mid + 1):
+            t = i / (n_mid + 1)
+            lat = a_lat + t*(b_lat - a_lat); lon = a_lon + t*(b_lon - a_lon)
+            if jitter_km > 0:
+                lat, lon = (lat + (jitter_km/111.0) * (rnd.random()-0.5) * 2,
+                            lon + (jitter_km/(111.0*max(0.2, math.cos(math.radians(lat))))) * (rnd.random()-0.5) * 2)
+            pts.append((lat, lon))
+        pts.append((b_lat, b_lon))
+    clean = [pts[0]]
+    for lat, lon in pts[1:]:
+        if abs(lat - clean[-1][0]) >= 1e-7 or abs(lon - clean[-1][1]) >= 1e-7:
+            clean.append((lat, lon))
+    return clean if len(clean) > 1 else clean * 2
+
+
+def densify_paths(lats: Sequence[float], lons: Sequence[float], offsets: Sequence[int],
+                  n_mid: Sequence[int], jitter_km: Sequence[float], rnd) -> Tuple[Any, Any]:
+    """
+    Polylines through many waypoint paths at once. Each segment of path k gets n_mid[k]
+    evenly spaced points, each moved up to jitter_km[k] in lat and lon; vertices closer
+    than 1e-7 degrees to the previous one are dropped and a single-vertex result is doubled.
+    Returns (xy, vertex_offsets) with xy flat as lon, lat, lon, lat, ...; random draws come
+    from rnd (a random.Random), through a NumPy generator seeded from it when available.
+    """
+    paths = len(offsets) - 1
+    if not HAVE_NP:
+        xy, out = [], [0]
+        for k in range(paths):
+            a, b = offsets[k], offsets[k+1]
+            for lat, lon in _densify_path(lats[a:b], lons[a:b], n_mid[k], jitter_km[k], rnd):
+                xy += (lon, lat)
+            out.append(len(xy) // 2)
+        return xy, out
+
+    lats = np.asarray(lats, dtype=float); lons = np.asarray(lons, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    segs = np.diff(offsets) - 1                               # segments per path
+    path_of_seg = np.repeat(np.arange(paths), segs)
+    start = np.delete(np.arange(len(lats)), offsets[1:] - 1)  # first waypoint of every segment
+    step = np.asarray(n_mid, dtype=np.intp)[path_of_seg] + 1  # vertices per segment, its end included
+    seg = np.repeat(np.arange(len(start)), step)
+    i = np.arange(len(seg)) - np.repeat(np.cumsum(step) - step, step) + 1
+    t = i / step[seg]
+    a = start[seg]
+    lat = lats[a] + t*(lats[a+1] - lats[a]); lon = lons[a] + t*(lons[a+1] - lons[a])
+    km = np.where(i < step[seg], np.asarray(jitter_km, dtype=float)[path_of_seg][seg], 0.0)
+    if km.any():
+        u = np.random.default_rng(rnd.getrandbits(64)).random((2, len(seg)))
+        lon = lon + km / (111.0*np.maximum(0.2, np.cos(np.radians(lat)))) * (u[1]-0.5) * 2
+        lat = lat + km / 111.0 * (u[0]-0.5) * 2
+
+    # each path's first waypoint goes in front of its segment vertices
+    per_path = np.bincount(path_of_seg[seg], minlength=paths) + 1
+    first = np.cumsum(per_path) - per_path
+    vlat = np.empty(len(seg) + paths); vlon = np.empty_like(vlat)
+    mask = np.ones(len(vlat), dtype=bool); mask[first] = False
+    vlat[first] = lats[offsets[:-1]]; vlon[first] = lons[offsets[:-1]]
+    vlat[mask] = lat; vlon[mask] = lon
+
+    keep = np.ones(len(vlat), dtype=bool)
+    keep[1:] = (np.abs(np.diff(vlat)) >= 1e-7) | (np.abs(np.diff(vlon)) >= 1e-7)
+    keep[first] = True
+    count = np.add.reduceat(keep, first) if paths else np.zeros(0, dtype=np.intp)
+    reps = keep.astype(np.intp); reps[first[count < 2]] = 2
+    xy = np.column_stack((np.repeat(vlon, reps), np.repeat(vlat, reps))).ravel()
+    return xy, np.concatenate(([0], np.cumsum(np.maximum(count, 2))))
+
+
+# ---------- Sphere index ----------
+# Two-level cell grid over lat/lon. Points are sorted by (coarse cell, fine cell), so every
+# cell is a contiguous run of `order`. Each cell stores its centre and the great-circle
+# radius of its members, which bounds the distance from a query point to anything inside:
+# centre_d - radius <= d <= centre_d + radius. Annulus queries drop coarse cells, then fine
+# cells, whose bounds miss [min_km, max_km], take coarse cells lying wholly inside it without
+# looking at their fine cells, and check exact distances only for what is left; the work
+# follows the number of results rather than the number of points.
+
+SPHERE_FINE_DEG = 0.5
+SPHERE_COARSE_DEG = 8.0
+SPHERE_BRUTE_MAX = 4096    # up to this many points, k-nearest and band searches just scan everything
+KNN_START_KM = 50.0        # first radius tried by nearest_k() without sklearn
+
+
+def _runs(keys, order, lo: int, hi: int) -> List[Tuple[int, int]]:
+    """[a, b) runs of equal keys[order[k]] over lo <= k < hi."""
+    runs = []
+    a = lo
+    while a < hi:
+        b = a + 1
+        while b < hi and keys[order[b]] == keys[order[a]]:
+            b += 1
+        runs.append((a, b)); a = b
+    return runs
+
+
+def _cell_table(runs, keys, order, lats, lons, deg: float) -> Dict[str, list]:
+    cells = {"start": [], "end": [], "lat": [], "lon": [], "rad": []}
+    for a, b in runs:
+        r, c = keys[order[a]]
+        clat, clon = min(90.0, (r + 0.5) * deg), (c + 0.5) * deg
+        members = order[a:b]
+        d = haversine_one_to_many(clat, clon, take(lats, members), take(lons, members))
+        cells["start"].append(a); cells["end"].append(b)
+        cells["lat"].append(clat); cells["lon"].append(clon); cells["rad"].append(float(max(d)))
+    return cells
+
+
+def build_sphere_index(lats: Sequence[float], lons: Sequence[float], groups: Optional[Sequence[int]] = None,
+                       knn: bool = True, fine_deg: float = SPHERE_FINE_DEG,
+                       coarse_deg: float = SPHERE_COARSE_DEG) -> Dict[str, Any]:
+    """
+    Great-circle neighbour index over (lats[i], lons[i]); query results are positions i.
+    groups[i] (ints) lets annulus_query() drop a span of groups, e.g. a site's own city.
+    With sklearn and knn=True a KDTree over unit vectors is added for k-nearest queries;
+    without the tree the index is plain arrays and can be shared between processes.
+    """
+    lats, lons = as_array(lats), as_array(lons)
+    n = len(lats)
+    fine = [(int(math.floor(la / fine_deg)), int(math.floor(lo / fine_deg))) for la, lo in zip(lats, lons)]
+    coarse = [(int(math.floor(la / coarse_deg)), int(math.floor(lo / coarse_deg))) for la, lo in zip(lats, lons)]
+    order = sorted(range(n), key=lambda i: (coarse[i], fine[i]))
+
+    coarse_runs = _runs(coarse, order, 0, n)
+    fine_runs = []; fine_lo = []; fine_hi = []  # each coarse cell owns a run of fine cells
+    for a, b in coarse_runs:
+        fine_lo.append(len(fine_runs))
+        fine_runs.extend(_runs(fine, order, a, b))
+        fine_hi.append(len(fine_runs))
+
+    C = _cell_table(coarse_runs, coarse, order, lats, lons, coarse_deg)
+    C["fine_lo"], C["fine_hi"] = fine_lo, fine_hi
+    F = _cell_table(fine_runs, fine, order, lats, lons, fine_deg)
+    for cells in (C, F):
+        for key in cells:
+            cells[key] = as_array(cells[key], float if key in ("lat", "lon", "rad") else int)
+
+    return {
+        "n": n, "lats": lats, "lons": lons, "order": as_array(order, int),
+        "groups": None if groups is None else as_array(groups, int),
+        "coarse": C, "fine": F,
+        "tree": KDTree([unit_xyz(la, lo) for la, lo in zip(lats, lons)]) if HAVE_SK and knn and n else None,
+    }
+
+
+def _spans(starts, ends):
+    """Concatenation of range(starts[k], ends[k]) over k, as one array."""
+    sizes = ends - starts
+    if not len(sizes):
+        return np.empty(0, dtype=int)
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(int(sizes.sum()))
+
+
+def annulus_ranges(index: Dict[str, Any], lat: float, lon: float, min_km: float, max_km: float):
+    """(starts, ends) of the runs of index['order'] holding every point with min_km <= d <= max_km."""
+    C, F = index["coarse"], index["fine"]
+    d = haversine_one_to_many(lat, lon, C["lat"], C["lon"])
+    if HAVE_NP:
+        near, far = d - C["rad"], d + C["rad"]
+        live = (near <= max_km) & (far >= min_km)
+        inside = live & (near >= min_km) & (far <= max_km)
+        part = np.flatnonzero(live & ~inside)
+        fc = _spans(C["fine_lo"][part], C["fine_hi"][part])
+        df = haversine_one_to_many(lat, lon, F["lat"][fc], F["lon"][fc])
+        fc = fc[(df - F["rad"][fc] <= max_km) & (df + F["rad"][fc] >= min_km)]
+        return (np.concatenate((C["start"][inside], F["start"][fc])),
+                np.concatenate((C["end"][inside], F["end"][fc])))
+    starts, ends = [], []
+    for c, dc in enumerate(d):
+        r = C["rad"][c]
+        if dc - r > max_km or dc + r < min_km:
+            continue
+        if dc - r >= min_km and dc + r <= max_km:
+            starts.append(C["start"][c]); ends.append(C["end"][c]); continue
+        for f in range(C["fine_lo"][c], C["fine_hi"][c]):
+            df = haversine_km(lat, lon, F["lat"][f], F["lon"][f])
+            if df - F["rad"][f] <= max_km and df + F["rad"][f] >= min_km:
+                starts.append(F["start"][f]); ends.append(F["end"][f])
+    return starts, ends
+
+
+def annulus_query(index: Dict[str, Any], lat: float, lon: float, min_km: float, max_km: float,
+                  limit: Optional[int] = None, rnd=None, skip_groups: Optional[Tuple[int, int]] = None):
+    """
+    (positions, distances) of the points with min_km <= d <= max_km.
+    If more than `limit` points are in the candidate cells, only `limit` random draws
+    from them (made with rnd, a random.Random) are checked.
+    skip_groups=(lo, hi) drops points whose group is in [lo, hi).
+    """
+    starts, ends = annulus_ranges(index, lat, lon, min_km, max_km)
+    groups = index["groups"] if skip_groups else None
+    if HAVE_NP:
+        sizes = ends - starts
+        total = int(sizes.sum())
+        if limit is not None and total > limit:
+            cum = np.cumsum(sizes)
+            p = np.random.default_rng(rnd.getrandbits(64)).integers(0, total, limit)
+            r = np.searchsorted(cum, p, side="right")
+            pos = starts[r] + p - (cum[r] - sizes[r])
+        else:
+            pos = _spans(starts, ends)
+        idx = index["order"][pos]
+        if groups is not None:
+            g = groups[idx]
+            idx = idx[(g < skip_groups[0]) | (g >= skip_groups[1])]
+        d = haversine_one_to_many(lat, lon, index["lats"][idx], index["lons"][idx])
+        keep = (d >= min_km) & (d <= max_km)
+        return idx[keep], d[keep]
+
+    order = index["order"]
+    total = sum(b - a for a, b in zip(starts, ends))
+    if limit is not None and total > limit:
+        cum = []; acc = 0
+        for a, b in zip(starts, ends):
+            acc += b - a; cum.append(acc)
+        idx = []
+        for _ in range(limit):
+            p = rnd.randrange(total)
+            r = bisect.bisect_right(cum, p)
+            idx.append(order[ends[r] - (cum[r] - p)])
+    else:
+        idx = [i for a, b in zip(starts, ends) for i in order[a:b]]
+    if groups is not None:
+        idx = [i for i in idx if not skip_groups[0] <= groups[i] < skip_groups[1]]
+    d = haversine_one_to_many(lat, lon, take(index["lats"], idx), take(index["lons"], idx))
+    keep = [k for k, dk in enumerate(d) if min_km <= dk <= max_km]
+    return [idx[k] for k in keep], [d[k] for k in keep]
+
+
+def nearest_k(index: Dict[str, Any], lat: float, lon: float, k: int,
+              skip_groups: Optional[Tuple[int, int]] = None) -> List[int]:
+    """Positions of the k nearest points to (lat, lon), nearest first; skip_groups as for annulus_query()."""
+    n = index["n"]
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if index["tree"] is not None and not skip_groups:
+        return [int(i) for i in index["tree"].query([unit_xyz(lat, lon)], k=k)[1][0]]
+    if n <= SPHERE_BRUTE_MAX and not skip_groups:
+        return k_smallest(haversine_one_to_many(lat, lon, index["lats"], index["lons"]), k)
+    r = KNN_START_KM
+    while True:
+        idx, d = annulus_query(index, lat, lon, 0.0, r, skip_groups=skip_groups)
+        if len(idx) >= k or r >= math.pi * EARTH_RADIUS_KM:
+            return [int(idx[j]) for j in k_smallest(d, k)]
+        r *= 4
+
+
+def nearest_to_distance(index: Dict[str, Any], lat: float, lon: float, lo: float, hi: float,
+                        target: float, exclude=()) -> Tuple[int, Optional[float]]:
+    """
+    (position, km) of the point whose distance from (lat, lon) lies in [lo, hi] and is
+    closest to target, skipping positions in `exclude`; (-1, None) if there is none.
+    Searches a band around target and widens it only while it comes up empty.
+    """
+    if index["n"] <= SPHERE_BRUTE_MAX:
+        d = haversine_one_to_many(lat, lon, index["lats"], index["lons"])
+        k = closest_to_in_range(d, lo, hi, target, list(exclude))
+        return (k, float(d[k])) if k >= 0 else (-1, None)
+    w = max((hi - lo) / 64.0, 1.0)
+    while True:
+        a, b = max(lo, target - w), min(hi, target + w)
+        idx, d = annulus_query(index, lat, lon, a, b)
+        skip = [p for p, i in enumerate(idx) if int(i) in exclude] if exclude else []
+        k = closest_to_in_range(d, a, b, target, skip)
+        if k >= 0:
+            return int(idx[k]), float(d[k])
+        if a <= lo and b >= hi:
+            return -1, None
+        w *= 4
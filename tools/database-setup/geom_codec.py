@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Geometry encoders for the loaders: WKT parsing, binary (WKB) encoding for
+GeomFromWKB(), and SpatiaLite's own internal BLOB format, which can be bound
+straight into the geometry column with no SQL constructor at all.
+
+The batch encoders take many linestrings stored flat, as one x, y, x, y, ...
+sequence plus vertex offsets (geo_kernel.densify_paths() output), and encode
+them all with one float conversion instead of one per vertex.
+"""
+import array
+import struct
+import sys
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence, Tuple
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+SRID = 4326
+
+# SpatiaLite BLOB markers
+SPL_START = 0x00
+SPL_LITTLE_ENDIAN = 0x01
+SPL_MBR_END = 0x7C
+SPL_END = 0xFE
+
+
+def parse_linestring(wkt: str) -> List[Tuple[float, float]]:
+    """[(x, y), ...] from 'LINESTRING(x y, ...)'; ValueError if malformed."""
+    w = wkt.strip()
+    lp, rp = w.find("("), w.rfind(")")
+    if lp < 0 or rp < lp or w[:lp].strip().upper() != "LINESTRING" or w[rp+1:].strip():
+        raise ValueError("not a LINESTRING")
+    pts = []
+    for pair in w[lp+1:rp].split(","):
+        xy = pair.split()
+        if len(xy) != 2:
+            raise ValueError(f"bad vertex '{pair.strip()}'")
+        pts.append((float(xy[0]), float(xy[1])))
+    return pts
+
+
+def format_linestring(pts: Sequence[Tuple[float, float]]) -> str:
+    return "LINESTRING(" + ", ".join(f"{x:.6f} {y:.6f}" for x, y in pts) + ")"
+
+
+def link_points(link: Dict[str, Any]) -> List[Tuple[float, float]]:
+    """Vertices of a link record: from 'link_coords' ([[lon, lat], ...]) if present, else parsed 'link_wkt'."""
+    coords = link.get("link_coords")
+    if coords is not None:
+        return [(float(x), float(y)) for x, y in coords]
+    return parse_linestring(link["link_wkt"])
+
+
+def point_wkb(x: float, y: float) -> bytes:
+    """Little-endian WKB POINT."""
+    return struct.pack("<BIdd", 1, WKB_POINT, x, y)
+
+
+def linestring_wkb(pts: Sequence[Tuple[float, float]]) -> bytes:
+    """Little-endian WKB LINESTRING from [(x, y), ...]."""
+    flat = [c for xy in pts for c in xy]
+    return struct.pack(f"<BII{len(flat)}d", 1, WKB_LINESTRING, len(pts), *flat)
+
+
+# ---------- Batches ----------
+
+@lru_cache(maxsize=None)
+def _wkt_template(n: int) -> str:
+    return "LINESTRING(" + ", ".join(["%.6f %.6f"] * n) + ")"
+
+
+def _flat_list(xy) -> List[float]:
+    return xy.tolist() if hasattr(xy, "tolist") else list(xy)
+
+
+def format_linestrings(xy: Sequence[float], offsets: Sequence[int]) -> List[str]:
+    """WKT of linestring k = vertices offsets[k]:offsets[k+1] of the flat xy; same text as format_linestring()."""
+    flat = _flat_list(xy); offsets = [int(o) for o in offsets]
+    return [_wkt_template(b - a) % tuple(flat[2*a:2*b]) for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def linestrings_coords(xy: Sequence[float], offsets: Sequence[int], digits: int = 6) -> List[List[List[float]]]:
+    """[[x, y], ...] per linestring of the flat xy, rounded to digits."""
+    flat = [round(c, digits) for c in _flat_list(xy)]
+    pairs = [list(p) for p in zip(flat[0::2], flat[1::2])]
+    offsets = [int(o) for o in offsets]
+    return [pairs[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def linestrings_wkb(xy: Sequence[float], offsets: Sequence[int]) -> List[bytes]:
+    """Little-endian WKB per linestring of the flat xy; same bytes as linestring_wkb()."""
+    if hasattr(xy, "astype"):
+        buf = xy.astype("<f8").tobytes()
+    else:
+        doubles = array.array("d", xy)
+        if sys.byteorder == "big":
+            doubles.byteswap()
+        buf = doubles.tobytes()
+    offsets = [int(o) for o in offsets]
+    return [struct.pack("<BII", 1, WKB_LINESTRING, b - a) + buf[16*a:16*b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+# ---------- SpatiaLite internal BLOB ----------
+# 0x00 | 0x01 (LE) | srid:i32 | minx miny maxx maxy:f64 | 0x7C | class:i32 | payload | 0xFE
+
+def spatialite_point(x: float, y: float, srid: int = SRID) -> bytes:
+    return struct.pack("<BBi4dBiddB", SPL_START, SPL_LITTLE_ENDIAN, srid,
+                       x, y, x, y, SPL_MBR_END, WKB_POINT, x, y, SPL_END)
+
+
+def spatialite_linestring(pts: Sequence[Tuple[float, float]], srid: int = SRID) -> bytes:
+    xs = [p[0] for p in pts]; ys = [p[1] for p in pts]
+    flat = [c for xy in pts for c in xy]
+    n = len(pts)
+    return struct.pack(f"<BBi4dBii{2*n}dB", SPL_START, SPL_LITTLE_ENDIAN, srid,
+                       min(xs), min(ys), max(xs), max(ys), SPL_MBR_END,
+                       WKB_LINESTRING, n, *flat, SPL_END)
+
+
+def spatialite_mbr(blob: bytes) -> Tuple[float, float, float, float]:
+    """(minx, miny, maxx, maxy) read from the header of a SpatiaLite geometry BLOB."""
+    if len(blob) < 39 or blob[0] != SPL_START or blob[38] != SPL_MBR_END:
+        raise ValueError("not a SpatiaLite geometry BLOB")
+    endian = "<" if blob[1] == SPL_LITTLE_ENDIAN else ">"
+    return struct.unpack_from(f"{endian}4d", blob, 6)
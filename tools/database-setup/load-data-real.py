@@ -4,6 +4,21 @@ import json
 import os
 import time
 import logging
+import argparse
+import shutil
+import multiprocessing as mp
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from record_stream import (iter_records, read_records, raw_records, record_paths, records_size,
+                           find_output)
+from load_state import input_hashes, db_changed_tables, record_load, forget_tables
+from spatial_order import (hilbert_key, points_centre_key, sample_tiles, tile_page_reads,
+                           write_packed_rtree, PACKINGS)
+from geom_codec import (link_points, format_linestring, point_wkb, linestring_wkb, linestrings_wkb,
+                        spatialite_point, spatialite_linestring, spatialite_mbr)
 
 # Logging
 logging.basicConfig(
@@ -17,8 +32,49 @@ DB_REL_PATH = "../../db/network.sqlite"
 # SITES_JSON = "dataV2PeeringDB/sites.json"
 # LINKS_JSON = "dataV2PeeringDB/links.json"
 
-SITES_JSON = "data/sites.json"
-LINKS_JSON = "data/links.json"
+# Inputs: None picks the newest data/sites.* / data/links.* a generator wrote, JSON array
+# or NDJSON, optionally .gz/.zst and split into numbered parts (see record_stream.py)
+DATA_DIR = "data"
+SITES_JSON = None
+LINKS_JSON = None
+
+# Bulk load: rows are fed to executemany() in batches of this size
+BULK_LOAD = True
+BATCH_SIZE = 50000
+# Stream JSON arrays item by item instead of json.load() (flat memory)
+STREAM_JSON = True
+# Diff against the existing rows instead of DELETE + full reinsert
+INCREMENTAL = False
+# Load into <db>.shadow, verify, then atomically rename over the live DB (<db>.prev kept).
+# Suffixes deliberately don't end in .sqlite so the API's DB picker ignores them.
+SHADOW_BUILD = False
+SHADOW_SUFFIX = ".shadow"
+PREV_SUFFIX = ".prev"
+# Insert sites by Hilbert key of their point and links by that of their bbox centre.
+# Sorting needs the rows in memory, so this gives up the flat-memory streaming path.
+HILBERT_ORDER = False
+# Parse/validate/encode records in a process pool (0 = inline, same steps in this process);
+# the main process stays the single SQLite writer
+PARSE_WORKERS = 0
+PARSE_CHUNK = 5000
+# How geometry is bound: "wkt" (MakePoint/GeomFromText), "wkb" (Python-encoded, GeomFromWKB)
+# or "blob" (Python-encoded SpatiaLite geometry BLOB bound as-is, no SQL constructor)
+GEOM_FORMAT = "wkt"
+# Connection PRAGMAs for the bulk load; page_size only takes effect on a new/empty file
+LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "WAL",
+    "temp_store": "MEMORY",
+    "cache_size": -200000,  # ~200MB (tune as needed)
+}
+PAGE_SIZE = None
+# Full reloads: drop the R-tree triggers during the inserts, then write the R-trees as
+# packed nodes (MBRs read from the stored BLOBs, ordered by RTREE_PACKING) in one pass
+PACKED_RTREE = False
+RTREE_PACKING = "str"
+SPATIAL_TABLES = ("sites", "links")
+# Skip tables whose input file hash and row count match what the last load recorded
+SKIP_UNCHANGED = True
 
 # ---------- Schema helpers ----------
 
@@ -80,11 +136,479 @@ def create_performance_indexes(cur):
     except sqlite3.OperationalError as e:
         logger.info(f"ℹ️ Index creation note: {e}")
 
+# ---------- Bulk insert helpers ----------
+
+# (site geometry SQL, link geometry SQL) per GEOM_FORMAT
+GEOM_SQL = {
+    "wkt": ("MakePoint(?, ?, 4326)", "GeomFromText(?, 4326)"),
+    "wkb": ("GeomFromWKB(?, 4326)", "GeomFromWKB(?, 4326)"),
+    "blob": ("?", "?"),
+}
+
+SITES_SQL_T = """
+INSERT OR REPLACE INTO sites (
+    site_id, site_virtual_name, site_name, country, city,
+    platform, network, last_modified_at, is_deleted, geometry
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, {geom})
+"""
+
+LINKS_SQL_T = """
+INSERT OR REPLACE INTO links (
+    link_id, site_a_id, site_b_id, link_type, link_distance,
+    link_kmz_no, last_modified_at, is_deleted, geometry
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, {geom})
+"""
+
+def site_geom_params(s, fmt):
+    if fmt == "blob":
+        return (spatialite_point(s["longitude"], s["latitude"]),)
+    if fmt == "wkb":
+        return (point_wkb(s["longitude"], s["latitude"]),)
+    return (s["longitude"], s["latitude"])
+
+def link_geom_param(l, fmt):
+    """Links carry either 'link_wkt' or 'link_coords'; any input works with any format."""
+    if fmt == "wkt":
+        return l["link_wkt"] if "link_wkt" in l else format_linestring(link_points(l))
+    pts = link_points(l)
+    return spatialite_linestring(pts) if fmt == "blob" else linestring_wkb(pts)
+
+def site_row(s, fmt="wkt"):
+    geom = site_geom_params(s, fmt)
+    return (
+        s["site_id"], s["site_virtual_name"], s["site_name"],
+        s["country"], s["city"], s["platform"], s["network"],
+        s["last_modified_at"], s["is_deleted"],
+        *geom
+    )
+
+def link_row(l, fmt="wkt", geom=None):
+    if geom is None:
+        geom = link_geom_param(l, fmt)
+    return (
+        l["link_id"], l["site_a_id"], l["site_b_id"],
+        l["link_type"], l["link_distance"], l["link_kmz_no"],
+        l["last_modified_at"], l["is_deleted"],
+        geom
+    )
+
+# ---------- Parallel parse / validate ----------
+
+def in_range(lon, lat):
+    return -180.0 <= lon <= 180.0 and -90.0 <= lat <= 90.0
+
+def validate_site(s):
+    """Reason the site can't be loaded, or None."""
+    if not s.get("site_id"):
+        return "missing site_id"
+    try:
+        lon, lat = float(s["longitude"]), float(s["latitude"])
+    except (KeyError, TypeError, ValueError):
+        return "missing/non-numeric coordinates"
+    if not in_range(lon, lat):
+        return f"coordinates out of range ({lon}, {lat})"
+    return None
+
+def validate_link(l):
+    """Reason the link can't be loaded, or None."""
+    if not l.get("link_id") or not l.get("site_a_id") or not l.get("site_b_id"):
+        return "missing link_id/site ids"
+    try:
+        pts = link_points(l)
+    except (KeyError, AttributeError, TypeError, ValueError) as e:
+        return f"malformed link geometry: {e}"
+    if len(set(pts)) < 2:
+        return "fewer than 2 distinct points"
+    if not all(in_range(x, y) for x, y in pts):
+        return "coordinates out of range"
+    return None
+
+def prepare_chunk(args):
+    """Worker: decode (text records) + validate + encode one chunk. Returns (rows, rejects, type_counts)."""
+    kind, records, fmt = args
+    validate, encode = (validate_site, site_row) if kind == "site" else (validate_link, link_row)
+    valid = []; rejects = []; type_counts = {}
+    for r in records:
+        if isinstance(r, str):
+            r = json.loads(r)
+        err = validate(r)
+        if err:
+            rejects.append((r.get(f"{kind}_id"), err))
+            continue
+        valid.append(r)
+        if kind == "link":
+            type_counts[r["link_type"]] = type_counts.get(r["link_type"], 0) + 1
+    if kind == "link" and fmt == "wkb":
+        return link_rows_wkb(valid), rejects, type_counts
+    return [encode(r, fmt) for r in valid], rejects, type_counts
+
+def link_rows_wkb(links):
+    """link_row(l, "wkb") for a chunk of links, with every geometry encoded by one linestrings_wkb() call."""
+    xy = []; offsets = [0]
+    for l in links:
+        for pt in link_points(l):
+            xy.extend(pt)
+        offsets.append(len(xy) // 2)
+    return [link_row(l, geom=geom) for l, geom in zip(links, linestrings_wkb(xy, offsets))]
+
+def collect_chunk(kind, result, rejects, type_counts=None):
+    """Rows of a prepare_chunk() result; its rejects and link type counts go to the caller's totals."""
+    rows, bad, counts = result
+    for rid, err in bad:
+        if len(rejects) < 20:
+            logger.warning(f"⚠️ Rejected {kind} {rid}: {err}")
+        rejects.append((rid, err))
+    if type_counts is not None:
+        for k, v in counts.items():
+            type_counts[k] = type_counts.get(k, 0) + v
+    return rows
+
+def validated_rows(records, kind, rejects, type_counts=None, chunk_size=PARSE_CHUNK, fmt="wkt"):
+    """parallel_rows() without the pool: the same decode/validate/encode, in this process."""
+    for chunk in batched(records, chunk_size):
+        yield from collect_chunk(kind, prepare_chunk((kind, chunk, fmt)), rejects, type_counts)
+
+def parallel_rows(records, kind, workers, rejects, type_counts=None, chunk_size=PARSE_CHUNK, fmt="wkt"):
+    """
+    Fan chunks out to a process pool and yield their rows back in input order.
+    At most 2*workers chunks are in flight, so reading the input stays bounded.
+    """
+    with mp.Pool(processes=workers) as pool:
+        pending = deque()
+        for chunk in batched(records, chunk_size):
+            pending.append(pool.apply_async(prepare_chunk, ((kind, chunk, fmt),)))
+            if len(pending) >= 2 * workers:
+                yield from collect_chunk(kind, pending.popleft().get(), rejects, type_counts)
+        while pending:
+            yield from collect_chunk(kind, pending.popleft().get(), rejects, type_counts)
+
+def batched(rows, size):
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def bulk_insert(conn, sql, rows, label, batch_size=BATCH_SIZE):
+    """executemany() the rows in batches inside the caller's transaction; returns rows inserted."""
+    total = 0
+    for n, batch in enumerate(batched(rows, batch_size), start=1):
+        t0 = time.time()
+        conn.executemany(sql, batch)
+        dt = time.time() - t0
+        total += len(batch)
+        logger.info(f"   {label} batch {n}: {len(batch)} rows in {dt:.2f}s "
+                    f"({len(batch)/max(dt,1e-6):.0f} rows/s), total {total}")
+    return total
+
+def skip_links_to(rows, site_rejects, link_rejects):
+    """Drop link rows whose endpoint site was rejected (they would fail the FK), as link rejects."""
+    bad = {rid for rid, _ in site_rejects}  # evaluated on first next(), after all sites are written
+    for r in rows:
+        if r[1] in bad or r[2] in bad:
+            link_rejects.append((r[0], "endpoint site rejected"))
+            continue
+        yield r
+
+# ---------- Incremental sync ----------
+
+def ts() -> str:
+    return datetime.utcnow().isoformat()
+
+SITES_UPDATE_SQL_T = """
+UPDATE sites SET
+    site_virtual_name = ?, site_name = ?, country = ?, city = ?,
+    platform = ?, network = ?, last_modified_at = ?, is_deleted = ?,
+    geometry = {geom}
+WHERE site_id = ?
+"""
+
+LINKS_UPDATE_SQL_T = """
+UPDATE links SET
+    site_a_id = ?, site_b_id = ?, link_type = ?, link_distance = ?,
+    link_kmz_no = ?, last_modified_at = ?, is_deleted = ?,
+    geometry = {geom}
+WHERE link_id = ?
+"""
+
+def load_statements(fmt=GEOM_FORMAT):
+    """Insert/update SQL for sites and links with the geometry constructor for `fmt`."""
+    site_geom, link_geom = GEOM_SQL[fmt]
+    return {
+        "sites": SITES_SQL_T.format(geom=site_geom),
+        "links": LINKS_SQL_T.format(geom=link_geom),
+        "sites_update": SITES_UPDATE_SQL_T.format(geom=site_geom),
+        "links_update": LINKS_UPDATE_SQL_T.format(geom=link_geom),
+    }
+
+# Row tuples from site_row()/link_row(): index of last_modified_at and is_deleted
+SITE_ROW_STATE = (7, 8)
+LINK_ROW_STATE = (6, 7)
+
+def incremental_sync(conn, table, id_col, rows, state_idx, insert_sql, update_sql,
+                     label, batch_size=BATCH_SIZE, rejects=()):
+    """
+    Diff incoming rows against (id, last_modified_at, is_deleted) already in `table`:
+    new ids are inserted, ids whose state differs are updated, ids missing from the
+    input are soft-deleted (is_deleted=1). Unchanged rows are never written. Ids in
+    `rejects` ((id, reason) pairs, complete once rows is exhausted) were in the input
+    but failed validation, so their existing rows are left alone rather than deleted.
+    """
+    existing = {
+        rid: (lmt, deleted) for rid, lmt, deleted in
+        conn.execute(f"SELECT {id_col}, last_modified_at, is_deleted FROM {table};")
+    }
+    logger.info(f"   {label}: {len(existing)} rows already in DB")
+    lmt_i, del_i = state_idx
+    seen = set()
+    inserts = []; updates = []
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "soft_deleted": 0}
+
+    def flush():
+        if inserts:
+            conn.executemany(insert_sql, inserts); stats["inserted"] += len(inserts); inserts.clear()
+        if updates:
+            conn.executemany(update_sql, updates); stats["updated"] += len(updates); updates.clear()
+
+    for row in rows:
+        rid = row[0]
+        seen.add(rid)
+        old = existing.get(rid)
+        if old is None:
+            inserts.append(row)
+        elif old != (row[lmt_i], row[del_i]):
+            updates.append(row[1:] + row[:1])  # id moves to the WHERE clause
+        else:
+            stats["unchanged"] += 1
+        if len(inserts) + len(updates) >= batch_size:
+            flush()
+    flush()
+
+    seen.update(rid for rid, _ in rejects)
+    gone = [(ts(), rid) for rid, (_, deleted) in existing.items() if rid not in seen and not deleted]
+    if gone:
+        conn.executemany(
+            f"UPDATE {table} SET is_deleted = 1, last_modified_at = ? WHERE {id_col} = ?;", gone)
+        stats["soft_deleted"] = len(gone)
+
+    logger.info(f"   {label}: +{stats['inserted']} inserted, ~{stats['updated']} updated, "
+                f"-{stats['soft_deleted']} soft-deleted, {stats['unchanged']} unchanged")
+    return stats
+
+def insert_all(conn, s_rows, l_rows, bulk=BULK_LOAD, batch_size=BATCH_SIZE, sql=None):
+    """Full reload: clear both tables and insert every site row, then every link row.
+    s_rows=None keeps the existing sites and reloads links only.
+    Returns (sites inserted, links inserted, sites seconds, links seconds)."""
+    sql = sql or load_statements()
+    cur = conn.cursor()
+
+    # Clear existing data (in single transaction)
+    logger.info("🗑️ Clearing existing data (" + ("links" if s_rows is None else "sites, links") + ")...")
+    conn.execute("BEGIN;")
+    cur.execute("DELETE FROM links;")
+    if s_rows is not None:
+        cur.execute("DELETE FROM sites;")
+    conn.commit()
+    if s_rows is None:
+        logger.info("⏭️ Sites unchanged, keeping existing rows")
+        s_rows = ()
+
+    # Insert sites
+    logger.info("📍 Inserting sites...")
+    t0 = time.time()
+    conn.execute("BEGIN;")
+    n_sites = 0
+    if bulk:
+        n_sites = bulk_insert(conn, sql["sites"], s_rows, "📍 sites", batch_size)
+    else:
+        for n_sites, row in enumerate(s_rows, start=1):
+            cur.execute(sql["sites"], row)
+            if n_sites % 5000 == 0:
+                logger.info(f"   📍 {n_sites}")
+    conn.commit()
+    dt_sites = dt = time.time() - t0
+    logger.info(f"✅ Sites inserted: {n_sites} in {dt:.2f}s ({n_sites/max(dt,1):.1f}/s)")
+
+    # Insert links
+    logger.info("🔗 Inserting links...")
+    t0 = time.time()
+    conn.execute("BEGIN;")
+    n_links = 0
+    if bulk:
+        n_links = bulk_insert(conn, sql["links"], l_rows, "🔗 links", batch_size)
+    else:
+        for n_links, row in enumerate(l_rows, start=1):
+            cur.execute(sql["links"], row)
+            if n_links % 5000 == 0:
+                logger.info(f"   🔗 {n_links}")
+    conn.commit()
+    dt = time.time() - t0
+    logger.info(f"✅ Links inserted: {n_links} in {dt:.2f}s ({n_links/max(dt,1):.1f}/s)")
+    return n_sites, n_links, dt_sites, dt
+
+# ---------- Spatial clustering ----------
+
+def hilbert_sorted(sites, links):
+    t0 = time.time()
+    sites = sorted(sites, key=lambda s: hilbert_key(s["longitude"], s["latitude"]))
+    links = sorted(links, key=lambda l: points_centre_key(link_points(l)))
+    logger.info(f"🌀 Hilbert-ordered {len(sites)} sites, {len(links)} links in {time.time()-t0:.2f}s")
+    return sites, links
+
+def indexed_sample_tiles(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_sites_geometry';").fetchone():
+        return []
+    pts = conn.execute("SELECT xmin, ymin FROM idx_sites_geometry;").fetchall()
+    return sample_tiles(pts) if pts else []
+
+def report_tile_pages(conn, tiles, when):
+    """Log distinct table pages an R-tree driven tile query touches, per table; {} when no index yet."""
+    out = {}
+    for table in ("sites", "links"):
+        rtree = f"idx_{table}_geometry"
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?;", (rtree,)).fetchone():
+            continue
+        out[table] = tile_page_reads(conn, table, rtree, tiles)
+        if out[table] is None:
+            logger.info(f"📐 Tile page reads ({when}) {table}: unavailable (SQLite built without dbstat)")
+        else:
+            logger.info(f"📐 Tile page reads ({when}) {table}: {out[table]} over {len(tiles)} tiles")
+    return out
+
+# ---------- Packed R-trees ----------
+
+def suspend_spatial_index(conn, table):
+    """Empty idx_<table>_geometry and drop the triggers that maintain it; returns their SQL."""
+    rtree = f"idx_{table}_geometry"
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?;", (rtree,)).fetchone():
+        conn.execute(f"SELECT CreateSpatialIndex('{table}', 'geometry');")
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND sql LIKE ?;",
+        (table, f"%{rtree}%"),
+    ).fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER "{name}";')
+    conn.execute(f'DROP TABLE "{rtree}";')
+    conn.execute(f'CREATE VIRTUAL TABLE "{rtree}" USING rtree(pkid, xmin, xmax, ymin, ymax);')
+    return [sql for _, sql in triggers]
+
+def build_packed_rtree(conn, table, packing=RTREE_PACKING):
+    rtree = f"idx_{table}_geometry"
+    t0 = time.time()
+    entries = [(rowid, *spatialite_mbr(geom)) for rowid, geom in
+               conn.execute(f"SELECT rowid, geometry FROM {table} WHERE geometry IS NOT NULL;")]
+    depth, nodes = write_packed_rtree(conn, rtree, entries, packing)
+    logger.info(f"🌲 {rtree}: {len(entries)} entries packed ({packing}) into {nodes} nodes, "
+                f"depth {depth}, in {time.time()-t0:.2f}s")
+
+def restore_spatial_indexes(conn, saved_triggers, packing=RTREE_PACKING):
+    """Pack the R-trees over whatever the tables now hold and put the triggers back."""
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("BEGIN;")
+    for table, triggers in saved_triggers.items():
+        build_packed_rtree(conn, table, packing)
+        for sql in triggers:
+            conn.execute(sql)
+    conn.commit()
+
+# ---------- Shadow build ----------
+
+def remove_db_files(path):
+    for p in (path, path + "-wal", path + "-shm", path + "-journal"):
+        if os.path.exists(p):
+            os.remove(p)
+
+def prepare_shadow(db_path):
+    """Snapshot the live DB into <db>.shadow with the online backup API (safe while readers are active)."""
+    shadow_path = db_path + SHADOW_SUFFIX
+    remove_db_files(shadow_path)
+    src = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    dst = sqlite3.connect(shadow_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    logger.info(f"🪞 Shadow copy: {shadow_path} ({os.path.getsize(shadow_path)/1024/1024:.2f} MB)")
+    return shadow_path
+
+def verify_loaded_db(cur, final_sites, orphans, non_lines):
+    """Checks a shadow build must pass before it may replace the live DB."""
+    problems = []
+    if final_sites == 0:
+        problems.append("no sites")
+    if orphans:
+        problems.append(f"{orphans} orphaned links")
+    if non_lines:
+        problems.append(f"{non_lines} non-LINESTRING links")
+    cur.execute("PRAGMA quick_check;")
+    qc = cur.fetchone()[0]
+    if qc != "ok":
+        problems.append(f"quick_check: {qc}")
+    return problems
+
+def swap_in_shadow(shadow_path, db_path):
+    """
+    Atomically rename the shadow over the live path, keeping the old file as <db>.prev.
+    The shadow must already be out of WAL mode (no -wal of its own). Returns False, live
+    DB untouched, if the live WAL cannot be emptied because readers are still active.
+    """
+    prev_path = db_path + PREV_SUFFIX
+
+    # Fold the live WAL into the main file and truncate it first, so the new file never
+    # inherits frames that belong to the old one via the shared <db>-wal name. The
+    # checkpoint reports busy while readers still hold snapshots; swapping then is unsafe.
+    live = sqlite3.connect(db_path)
+    try:
+        busy, _, _ = live.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+    finally:
+        live.close()
+    if busy:
+        logger.error(f"❌ Live DB has active readers (WAL checkpoint busy); not swapping, shadow left at {shadow_path}")
+        return False
+
+    remove_db_files(prev_path)
+    try:
+        os.link(db_path, prev_path)   # hard link: no copy, no window without a live file
+    except OSError:
+        shutil.copy2(db_path, prev_path)
+    os.replace(shadow_path, db_path)
+    logger.info(f"🔀 Swapped shadow into {db_path} (previous kept at {prev_path})")
+    return True
+
+def rollback_swap():
+    """Restore <db>.prev over the live DB."""
+    db_path = os.path.abspath(DB_REL_PATH)
+    prev_path = db_path + PREV_SUFFIX
+    if not os.path.exists(prev_path):
+        logger.error(f"❌ No previous database at: {prev_path}")
+        return False
+    os.replace(prev_path, db_path)
+    logger.info(f"⏪ Restored {prev_path} -> {db_path}")
+    return True
+
 # ---------- Loader ----------
 
-def load_data_to_sqlite():
+def load_data_to_sqlite(bulk=BULK_LOAD, batch_size=BATCH_SIZE, stream=STREAM_JSON,
+                        incremental=INCREMENTAL, shadow=SHADOW_BUILD, hilbert=HILBERT_ORDER,
+                        tile_report=False, workers=PARSE_WORKERS, geom_format=GEOM_FORMAT,
+                        packed_rtree=PACKED_RTREE, rtree_packing=RTREE_PACKING,
+                        skip_unchanged=SKIP_UNCHANGED, pragmas=None, page_size=PAGE_SIZE,
+                        db_path=DB_REL_PATH, sites_json=SITES_JSON, links_json=LINKS_JSON, stats=None,
+                        records=None):
+    """
+    Load sites_json/links_json into db_path. If `stats` is a dict it is filled with
+    row counts, per-phase timings (seconds) and the final DB size for benchmarking.
+    With skip_unchanged, tables whose input hash matches the last recorded load are kept.
+    records=(sites, links) loads those record iterables instead of the files (fused
+    pipeline); there is nothing to hash, so both tables are reloaded and no hashes are
+    recorded.
+    """
     start_ts = time.time()
-    db_path = os.path.abspath(DB_REL_PATH)
+    db_path = os.path.abspath(db_path)
+    stats = stats if stats is not None else {}
 
     if not os.path.exists(db_path):
         logger.error(f"❌ Database not found at: {db_path}")
@@ -92,27 +616,58 @@ def load_data_to_sqlite():
 
     logger.info(f"✅ Database: {db_path} ({os.path.getsize(db_path)/1024/1024:.2f} MB)")
 
-    if not os.path.exists(SITES_JSON) or not os.path.exists(LINKS_JSON):
-        logger.error("❌ Missing data JSON files (data/sites.json, data/links.json)")
-        return False
+    if records is not None:
+        hashes = None
+        reload = set(SPATIAL_TABLES)
+    else:
+        sites_json = sites_json or find_output(DATA_DIR, "sites")
+        links_json = links_json or find_output(DATA_DIR, "links")
+        if not sites_json or not links_json or not record_paths(sites_json) or not record_paths(links_json):
+            logger.error(f"❌ Missing data files ({sites_json}, {links_json})")
+            return False
+
+        logger.info(f"📂 Sites: {sites_json} ({records_size(sites_json)/1024/1024:.2f} MB)")
+        logger.info(f"📂 Links: {links_json} ({records_size(links_json)/1024/1024:.2f} MB)")
+
+        t0 = time.time()
+        hashes = input_hashes(sites_json, links_json)
+        reload = db_changed_tables(db_path, hashes) if skip_unchanged else set(SPATIAL_TABLES)
+        logger.info(f"#️⃣ Input hashes in {time.time()-t0:.2f}s: "
+                    + ", ".join(f"{t} {h[:12]}" for t, h in hashes.items()))
+        if not reload:
+            logger.info("⏭️ Inputs unchanged since the last load; nothing to do")
+            stats.update(skipped=True, total_s=time.time() - start_ts, db_bytes=os.path.getsize(db_path))
+            return True
+    load_sites = "sites" in reload
+
+    if records is not None:
+        sites, links = records
+        logger.info("🔀 Loading sites/links straight from the generator")
+    elif stream:
+        # NDJSON lines and indented JSON array items go to the parse pool undecoded,
+        # so decoding runs in the workers too
+        source = raw_records if workers > 0 and not hilbert else iter_records
+        sites = source(sites_json) if load_sites else []
+        links = source(links_json)
+        logger.info("🌊 Streaming " + ("sites/links" if load_sites else "links") + " from the input files")
+    else:
+        sites = read_records(sites_json) if load_sites else []
+        links = read_records(links_json)
+        logger.info(f"✅ Loaded {len(sites)} sites; {len(links)} links from the input files")
 
-    logger.info(f"📂 Sites JSON: {SITES_JSON} ({os.path.getsize(SITES_JSON)/1024/1024:.2f} MB)")
-    logger.info(f"📂 Links JSON: {LINKS_JSON} ({os.path.getsize(LINKS_JSON)/1024/1024:.2f} MB)")
+    if hilbert:
+        sites, links = hilbert_sorted(sites, links)
 
-    with open(SITES_JSON, "r") as f:
-        sites = json.load(f)
-    with open(LINKS_JSON, "r") as f:
-        links = json.load(f)
-    logger.info(f"✅ Loaded {len(sites)} sites; {len(links)} links from JSON")
+    target_path = prepare_shadow(db_path) if shadow else db_path
 
     # Connect and tune PRAGMAs for bulk load
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(target_path)
     conn.enable_load_extension(True)
+    if page_size:
+        conn.execute(f"PRAGMA page_size = {int(page_size)};")  # before anything creates pages
     conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA synchronous = OFF;")
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.execute("PRAGMA temp_store = MEMORY;")
-    conn.execute("PRAGMA cache_size = -200000;")  # ~200MB (tune as needed)
+    for name, value in {**LOAD_PRAGMAS, **(pragmas or {})}.items():
+        conn.execute(f"PRAGMA {name} = {value};")
 
     cur = conn.cursor()
 
@@ -161,78 +716,89 @@ def load_data_to_sqlite():
         cur.execute("SELECT COUNT(*) FROM links;")
         logger.info(f"📊 Current links: {cur.fetchone()[0]}")
 
-    # Clear existing data (in single transaction)
-    logger.info("🗑️ Clearing existing data (sites, links)...")
-    conn.execute("BEGIN;")
-    cur.execute("DELETE FROM links;")
-    cur.execute("DELETE FROM sites;")
-    conn.commit()
-
-    # Insert sites
-    logger.info("📍 Inserting sites...")
-    t0 = time.time()
+    # Sample tiles from the sites already indexed so before/after use the same set
+    tiles = []; pages_before = {}
+    if tile_report:
+        tiles = indexed_sample_tiles(conn)
+        pages_before = report_tile_pages(conn, tiles, "before") if tiles else {}
+
+    # Row sources: validated/encoded inline, or by a process pool with this process as the writer
+    type_counts = {}; site_rejects = []; link_rejects = []
+    if workers > 0:
+        logger.info(f"🧮 Parsing/validating with {workers} worker processes")
+        s_rows = parallel_rows(sites, "site", workers, site_rejects, fmt=geom_format)
+        l_rows = parallel_rows(links, "link", workers, link_rejects, type_counts, fmt=geom_format)
+    else:
+        s_rows = validated_rows(sites, "site", site_rejects, fmt=geom_format)
+        l_rows = validated_rows(links, "link", link_rejects, type_counts, fmt=geom_format)
+    l_rows = skip_links_to(l_rows, site_rejects, link_rejects)
+    if not load_sites:
+        s_rows = None
     conn.execute("BEGIN;")
-    sites_sql = """
-    INSERT OR REPLACE INTO sites (
-        site_id, site_virtual_name, site_name, country, city,
-        platform, network, last_modified_at, is_deleted, geometry
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, MakePoint(?, ?, 4326))
-    """
-    for i, s in enumerate(sites):
-        cur.execute(sites_sql, (
-            s["site_id"], s["site_virtual_name"], s["site_name"],
-            s["country"], s["city"], s["platform"], s["network"],
-            s["last_modified_at"], s["is_deleted"],
-            s["longitude"], s["latitude"]
-        ))
-        if (i+1) % 5000 == 0:
-            logger.info(f"   📍 {i+1}/{len(sites)}")
+    forget_tables(conn, reload)
     conn.commit()
-    dt = time.time() - t0
-    logger.info(f"✅ Sites inserted: {len(sites)} in {dt:.2f}s ({len(sites)/max(dt,1):.1f}/s)")
 
-    # Insert links
-    logger.info("🔗 Inserting links...")
+    # Incremental syncs touch few rows, so they keep the trigger-maintained R-trees
+    saved_triggers = {}
+    if packed_rtree and incremental:
+        logger.info("ℹ️ Packed R-trees apply to full reloads only; keeping trigger-maintained indexes")
+    elif packed_rtree:
+        conn.execute("BEGIN;")
+        saved_triggers = {t: suspend_spatial_index(conn, t) for t in SPATIAL_TABLES if t in reload}
+        conn.commit()
+        logger.info("🌲 R-tree triggers suspended for the load")
+
+    sql = load_statements(geom_format)
     t0 = time.time()
-    conn.execute("BEGIN;")
-    links_sql = """
-    INSERT OR REPLACE INTO links (
-        link_id, site_a_id, site_b_id, link_type, link_distance,
-        link_kmz_no, last_modified_at, is_deleted, geometry
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, GeomFromText(?, 4326))
-    """
-    type_counts = {}
-    for i, l in enumerate(links):
-        cur.execute(links_sql, (
-            l["link_id"], l["site_a_id"], l["site_b_id"],
-            l["link_type"], l["link_distance"], l["link_kmz_no"],
-            l["last_modified_at"], l["is_deleted"],
-            l["link_wkt"]
-        ))
-        type_counts[l["link_type"]] = type_counts.get(l["link_type"], 0) + 1
-        if (i+1) % 5000 == 0:
-            logger.info(f"   🔗 {i+1}/{len(links)}")
-    conn.commit()
-    dt = time.time() - t0
-    logger.info(f"✅ Links inserted: {len(links)} in {dt:.2f}s ({len(links)/max(dt,1):.1f}/s)")
+    try:
+        if incremental:
+            logger.info("🔁 Incremental sync (last_modified_at diff)...")
+            conn.execute("BEGIN;")
+            if s_rows is not None:
+                incremental_sync(conn, "sites", "site_id", s_rows, SITE_ROW_STATE,
+                                 sql["sites"], sql["sites_update"], "📍 sites", batch_size, site_rejects)
+            incremental_sync(conn, "links", "link_id", l_rows, LINK_ROW_STATE,
+                             sql["links"], sql["links_update"], "🔗 links", batch_size, link_rejects)
+            conn.commit()
+            logger.info(f"✅ Incremental sync done in {time.time()-t0:.2f}s")
+        else:
+            n_sites, n_links, stats["sites_s"], stats["links_s"] = insert_all(
+                conn, s_rows, l_rows, bulk, batch_size, sql)
+            stats["rows"] = n_sites + n_links
+    except Exception:
+        if saved_triggers:  # never leave the tables without their index triggers
+            restore_spatial_indexes(conn, saved_triggers, rtree_packing)
+        raise
+    stats["insert_s"] = time.time() - t0
+    if site_rejects or link_rejects:
+        logger.warning(f"⚠️ Rejected {len(site_rejects)} sites, {len(link_rejects)} links during parsing")
 
     # Spatial indexes (after bulk load)
+    t0 = time.time()
     logger.info("🗂️ Creating spatial indexes...")
-    try:
-        cur.execute("SELECT CreateSpatialIndex('sites', 'geometry');")
-        logger.info("✅ Sites spatial index created")
-    except sqlite3.OperationalError as e:
-        logger.info(f"ℹ️ Sites spatial index: {e}")
+    if saved_triggers:
+        restore_spatial_indexes(conn, saved_triggers, rtree_packing)
+        logger.info("✅ Packed spatial indexes built")
+    else:
+        try:
+            cur.execute("SELECT CreateSpatialIndex('sites', 'geometry');")
+            logger.info("✅ Sites spatial index created")
+        except sqlite3.OperationalError as e:
+            logger.info(f"ℹ️ Sites spatial index: {e}")
 
-    try:
-        cur.execute("SELECT CreateSpatialIndex('links', 'geometry');")
-        logger.info("✅ Links spatial index created")
-    except sqlite3.OperationalError as e:
-        logger.info(f"ℹ️ Links spatial index: {e}")
+        try:
+            cur.execute("SELECT CreateSpatialIndex('links', 'geometry');")
+            logger.info("✅ Links spatial index created")
+        except sqlite3.OperationalError as e:
+            logger.info(f"ℹ️ Links spatial index: {e}")
+
+    stats["spatial_index_s"] = time.time() - t0
 
     # Perf indexes
+    t0 = time.time()
     create_performance_indexes(cur)
     conn.commit()
+    stats["perf_index_s"] = time.time() - t0
 
     # Verify counts
     cur.execute("SELECT COUNT(*) FROM sites;")
@@ -252,15 +818,45 @@ def load_data_to_sqlite():
     cur.execute("SELECT COUNT(*) FROM links WHERE GeometryType(geometry) <> 'LINESTRING';")
     non_lines = cur.fetchone()[0]
 
+    # Remember what was loaded so an identical rerun can be skipped
+    if hashes is not None:
+        conn.execute("BEGIN;")
+        record_load(conn, hashes, {t: n for t, n in (("sites", final_sites), ("links", final_links)) if t in reload})
+        conn.commit()
+
+    if tile_report:
+        tiles = tiles or indexed_sample_tiles(conn)
+        pages_after = report_tile_pages(conn, tiles, "after") if tiles else {}
+        for table, before in pages_before.items():
+            after = pages_after.get(table)
+            if before is not None and after is not None:
+                logger.info(f"📐 {table}: {before} -> {after} pages ({(after-before)/max(before,1)*100:+.1f}%)")
+
     # Optional: ANALYZE (skip VACUUM unless you want compact file)
+    t0 = time.time()
     try:
         conn.execute("ANALYZE;")
     except Exception:
         pass
-
-    conn.close()
+    stats["analyze_s"] = time.time() - t0
+
+    if shadow:
+        problems = verify_loaded_db(cur, final_sites, orphans, non_lines)
+        if problems:
+            conn.close()
+            logger.error(f"❌ Shadow build failed verification ({'; '.join(problems)}); "
+                         f"live DB untouched, shadow left at {target_path}")
+            return False
+        # leave WAL mode: the shadow becomes a self-contained file that never reads <db>-wal
+        conn.execute("PRAGMA journal_mode=DELETE;")
+        conn.close()
+        if not swap_in_shadow(target_path, db_path):
+            return False
+    else:
+        conn.close()
 
     dur = time.time() - start_ts
+    stats.update(sites=final_sites, links=final_links, total_s=dur, db_bytes=os.path.getsize(db_path))
     logger.info("🎉 Data loading completed successfully!")
     logger.info("📊 Final stats:")
     logger.info(f"   Sites: {final_sites}")
@@ -278,8 +874,41 @@ def load_data_to_sqlite():
     return True
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sites", default=SITES_JSON,
+                    help="sites input: .json or .ndjson, optionally .gz/.zst, a split-part stem or a glob")
+    ap.add_argument("--links", default=LINKS_JSON, help="links input, as --sites")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--row-by-row", action="store_true", help="disable executemany() bulk load")
+    ap.add_argument("--no-stream", action="store_true", help="json.load() the inputs instead of streaming")
+    ap.add_argument("--incremental", action="store_true",
+                    help="insert/update/soft-delete only rows whose last_modified_at changed")
+    ap.add_argument("--shadow", action="store_true",
+                    help="build into a shadow file and atomically swap it in after verification")
+    ap.add_argument("--rollback", action="store_true", help="restore the DB kept by the last shadow swap")
+    ap.add_argument("--hilbert", action="store_true", help="insert rows in Hilbert-curve order")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS,
+                    help="processes for parsing/validating records (0 = inline)")
+    ap.add_argument("--geom-format", choices=sorted(GEOM_SQL), default=GEOM_FORMAT,
+                    help="bind geometry as WKT text, Python-encoded WKB or SpatiaLite BLOBs")
+    ap.add_argument("--packed-rtree", action="store_true",
+                    help="bulk-write packed R-trees after a full reload instead of per-row trigger inserts")
+    ap.add_argument("--rtree-packing", choices=sorted(PACKINGS), default=RTREE_PACKING)
+    ap.add_argument("--force", action="store_true", help="reload even if the input files are unchanged")
+    ap.add_argument("--tile-report", action="store_true",
+                    help="log table pages touched by a sample tile set before and after the load")
+    args = ap.parse_args()
     try:
-        ok = load_data_to_sqlite()
+        if args.rollback:
+            ok = rollback_swap()
+        else:
+            ok = load_data_to_sqlite(bulk=not args.row_by_row, batch_size=args.batch_size,
+                                     stream=not args.no_stream, incremental=args.incremental,
+                                     shadow=args.shadow, hilbert=args.hilbert,
+                                     tile_report=args.tile_report, workers=args.workers,
+                                     geom_format=args.geom_format, packed_rtree=args.packed_rtree,
+                                     rtree_packing=args.rtree_packing, skip_unchanged=not args.force,
+                                     sites_json=args.sites, links_json=args.links)
         if not ok:
             raise SystemExit(1)
     except Exception as e:
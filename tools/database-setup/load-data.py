@@ -1,9 +1,11 @@
 import sqlite3
-import json
 import os
 import time
 import logging
 
+from geom_codec import format_linestring, link_points
+from record_stream import iter_records, read_records, record_paths, records_size, find_output
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -46,7 +48,14 @@ def create_performance_indexes(cursor):
     except sqlite3.OperationalError as e:
         logger.warning(f"⚠️  Index creation: {e}")
 
-def load_data_to_sqlite():
+def progress(done, total):
+    """Progress text; total is unknown (None) when streaming"""
+    if total is None:
+        return f"{done}"
+    return f"{done}/{total} ({done/total*100:.1f}%)"
+
+def load_data_to_sqlite(stream=True):
+    """Load the newest data/sites.* and data/links.* (JSON array or NDJSON); stream=True parses them item by item"""
     load_start_time = time.time()
     logger.info("🚀 Starting database loading process")
     
@@ -127,31 +136,38 @@ def load_data_to_sqlite():
     # Load and validate JSON files
     logger.info("📂 Loading JSON data files...")
     
-    sites_file = 'data/sites.json'
-    links_file = 'data/links.json'
+    sites_file = find_output('data', 'sites') or 'data/sites.json'
+    links_file = find_output('data', 'links') or 'data/links.json'
     
-    if not os.path.exists(sites_file):
+    if not record_paths(sites_file):
         logger.error(f"❌ Sites file not found: {sites_file}")
         return False
     
-    if not os.path.exists(links_file):
+    if not record_paths(links_file):
         logger.error(f"❌ Links file not found: {links_file}")
         return False
     
-    logger.info(f"📊 Sites file size: {os.path.getsize(sites_file)/1024/1024:.2f} MB")
-    logger.info(f"📊 Links file size: {os.path.getsize(links_file)/1024/1024:.2f} MB")
-    
-    # Load sites data
-    logger.info("📖 Reading sites JSON...")
-    with open(sites_file, 'r') as f:
-        sites_data = json.load(f)
-    logger.info(f"✅ Loaded {len(sites_data)} sites from JSON")
+    logger.info(f"📊 Sites file size: {records_size(sites_file)/1024/1024:.2f} MB ({sites_file})")
+    logger.info(f"📊 Links file size: {records_size(links_file)/1024/1024:.2f} MB ({links_file})")
     
-    # Load links data
-    logger.info("📖 Reading links JSON...")
-    with open(links_file, 'r') as f:
-        links_data = json.load(f)
-    logger.info(f"✅ Loaded {len(links_data)} links from JSON")
+    if stream:
+        # Records are parsed lazily and inserted as they are read
+        logger.info("🌊 Streaming sites and links JSON...")
+        sites_data = iter_records(sites_file)
+        links_data = iter_records(links_file)
+        sites_total = links_total = None
+    else:
+        # Load sites data
+        logger.info("📖 Reading sites JSON...")
+        sites_data = read_records(sites_file)
+        sites_total = len(sites_data)
+        logger.info(f"✅ Loaded {sites_total} sites from JSON")
+        
+        # Load links data
+        logger.info("📖 Reading links JSON...")
+        links_data = read_records(links_file)
+        links_total = len(links_data)
+        logger.info(f"✅ Loaded {links_total} links from JSON")
     
     # Clear existing data
     logger.info("🗑️  Clearing existing data...")
@@ -173,9 +189,11 @@ def load_data_to_sqlite():
     '''
     
     sites_inserted = 0
+    sites_seen = 0
     sites_batch_size = 100
     
     for i, site in enumerate(sites_data):
+        sites_seen += 1
         try:
             cursor.execute(sites_insert_sql, (
                 site['site_id'], site['site_virtual_name'], site['site_name'],
@@ -186,13 +204,13 @@ def load_data_to_sqlite():
             sites_inserted += 1
             
             if (i + 1) % sites_batch_size == 0:
-                logger.info(f"   📍 Inserted {i + 1}/{len(sites_data)} sites ({(i+1)/len(sites_data)*100:.1f}%)")
+                logger.info(f"   📍 Inserted {progress(i + 1, sites_total)} sites")
                 
         except Exception as e:
             logger.error(f"❌ Error inserting site {site.get('site_id', 'unknown')}: {e}")
     
     sites_duration = time.time() - sites_start
-    logger.info(f"✅ Sites insertion completed: {sites_inserted}/{len(sites_data)} in {sites_duration:.2f}s ({sites_inserted/sites_duration:.1f}/sec)")
+    logger.info(f"✅ Sites insertion completed: {sites_inserted}/{sites_seen} in {sites_duration:.2f}s ({sites_inserted/sites_duration:.1f}/sec)")
     
     # Insert links data
     links_start = time.time()
@@ -206,16 +224,18 @@ def load_data_to_sqlite():
     '''
     
     links_inserted = 0
+    links_seen = 0
     links_batch_size = 50
     link_type_counts = {}
     
     for i, link in enumerate(links_data):
+        links_seen += 1
         try:
             cursor.execute(links_insert_sql, (
                 link['link_id'], link['site_a_id'], link['site_b_id'],
                 link['link_type'], link['link_distance'], link['link_kmz_no'],
                 link['last_modified_at'], link['is_deleted'],
-                link['link_wkt']
+                link['link_wkt'] if 'link_wkt' in link else format_linestring(link_points(link))
             ))
             links_inserted += 1
             
@@ -224,13 +244,13 @@ def load_data_to_sqlite():
             link_type_counts[link_type] = link_type_counts.get(link_type, 0) + 1
             
             if (i + 1) % links_batch_size == 0:
-                logger.info(f"   🔗 Inserted {i + 1}/{len(links_data)} links ({(i+1)/len(links_data)*100:.1f}%)")
+                logger.info(f"   🔗 Inserted {progress(i + 1, links_total)} links")
                 
         except Exception as e:
             logger.error(f"❌ Error inserting link {link.get('link_id', 'unknown')}: {e}")
     
     links_duration = time.time() - links_start
-    logger.info(f"✅ Links insertion completed: {links_inserted}/{len(links_data)} in {links_duration:.2f}s ({links_inserted/links_duration:.1f}/sec)")
+    logger.info(f"✅ Links insertion completed: {links_inserted}/{links_seen} in {links_duration:.2f}s ({links_inserted/links_duration:.1f}/sec)")
     
     # Log link type distribution
     logger.info("📊 Link type distribution:")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Content hashes of the loader inputs, recorded in the DB itself.
+
+After a successful load, load-data-real.py stores the SHA-256 and the resulting
+row count of each table's input file in the load_metadata table. A later run (or
+setup_data-real.py before starting one) compares them with the files on disk and
+skips tables whose input is unchanged and whose row count still matches.
+
+The hash covers the decompressed text with every last_modified_at value blanked:
+the generator stamps each record with the time of the run, so a regenerated but
+otherwise identical file must still hash the same.
+"""
+import hashlib
+import re
+import sqlite3
+from datetime import datetime
+from typing import Dict, Set
+
+from record_stream import record_paths, open_records
+
+META_TABLE = "load_metadata"
+
+_RUN_STAMP = re.compile(r'"last_modified_at":\s*"[^"]*"')
+
+# Links reference sites, so reloading sites always reloads links too
+TABLE_ORDER = ("sites", "links")
+
+
+def records_sha256(path: str) -> str:
+    """Hash of the records' text without their last_modified_at values; parts are hashed in order."""
+    h = hashlib.sha256()
+    for p in record_paths(path):
+        with open_records(p) as f:
+            for line in f:
+                if '"last_modified_at"' in line:
+                    line = _RUN_STAMP.sub('"last_modified_at":""', line)
+                h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+
+def input_hashes(sites_json: str, links_json: str) -> Dict[str, str]:
+    return {"sites": records_sha256(sites_json), "links": records_sha256(links_json)}
+
+
+def changed_tables(conn: sqlite3.Connection, hashes: Dict[str, str]) -> Set[str]:
+    """Tables that need reloading for these input hashes (all of them if nothing is recorded)."""
+    try:
+        recorded = {name: (h, n) for name, h, n in
+                    conn.execute(f"SELECT name, content_hash, row_count FROM {META_TABLE};")}
+    except sqlite3.OperationalError:  # no metadata table yet
+        return set(TABLE_ORDER)
+    changed = set()
+    for table in TABLE_ORDER:
+        h, n = recorded.get(table, (None, None))
+        try:
+            count = conn.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]
+        except sqlite3.OperationalError:
+            count = None
+        if h != hashes.get(table) or n != count:
+            changed.add(table)
+    if "sites" in changed:
+        changed.add("links")
+    return changed
+
+
+def db_changed_tables(db_path: str, hashes: Dict[str, str]) -> Set[str]:
+    """changed_tables() on a plain (no SpatiaLite) connection to db_path."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return changed_tables(conn, hashes)
+    finally:
+        conn.close()
+
+
+def record_load(conn: sqlite3.Connection, hashes: Dict[str, str], counts: Dict[str, int]):
+    """Store hash + row count for each loaded table (caller commits)."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {META_TABLE} (
+            name          TEXT PRIMARY KEY,
+            content_hash  TEXT NOT NULL,
+            row_count     INTEGER NOT NULL,
+            loaded_at     TEXT NOT NULL
+        );
+    """)
+    now = datetime.now().isoformat()
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {META_TABLE} (name, content_hash, row_count, loaded_at) VALUES (?, ?, ?, ?);",
+        [(table, hashes[table], counts[table], now) for table in counts],
+    )
+
+
+def forget_tables(conn: sqlite3.Connection, tables):
+    """Drop the records of tables about to be reloaded, so an interrupted load is never skipped."""
+    try:
+        conn.executemany(f"DELETE FROM {META_TABLE} WHERE name = ?;", [(t,) for t in tables])
+    except sqlite3.OperationalError:  # no metadata table yet
+        pass
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Column-wise site and link tables, the generator's data model.
+
+A site is its position in the site table. Coordinates are float64 arrays and
+country/city/network/platform are int32 codes into sorted vocabularies, so
+code order is name order and a site costs a few dozen bytes instead of a dict
+of strings. Links are parallel columns of site positions, tier codes and
+lengths (compact stdlib arrays that grow by append), plus each link's route
+(its waypoints, kept from topology generation until the geometry is built) and
+geometry.
+
+Neither table becomes dicts until the output is written. The site table is a
+plain dict of arrays, so shared_arrays.publish() shares it with the process
+pool as it is.
+"""
+import array
+from typing import Any, Dict, Iterable, List, Sequence
+
+from geo_kernel import as_array
+
+SITE_CATEGORICALS = ("country", "city", "network", "platform")
+
+# link column -> array typecode: endpoint positions, tier code, length in km
+LINK_COLUMNS = {"a": "l", "b": "l", "tier": "b", "distance": "d"}
+
+
+# ---------- Sites ----------
+
+def site_table(latitude: Sequence[float], longitude: Sequence[float], **categoricals: Sequence[str]) -> Dict[str, Any]:
+    """Table from per-site coordinates and category names, one keyword per categorical column."""
+    vocab = {f: sorted(set(values)) for f, values in categoricals.items()}
+    cols = {"latitude": as_array(latitude, float), "longitude": as_array(longitude, float)}
+    for f, values in categoricals.items():
+        code = {v: k for k, v in enumerate(vocab[f])}
+        cols[f] = as_array([code[v] for v in values], "int32")
+    return {"n": len(cols["latitude"]), "cols": cols, "vocab": vocab}
+
+
+def add_column(table: Dict[str, Any], field: str, codes: Sequence[int], vocab: Sequence[str]):
+    """Attach a derived categorical column (codes into vocab, which need not be sorted)."""
+    table["cols"][field] = as_array(codes, "int32")
+    table["vocab"][field] = list(vocab)
+
+
+def code_of(table: Dict[str, Any], field: str, name: str) -> int:
+    """Code of name in the column's vocabulary, or -1."""
+    try:
+        return table["vocab"][field].index(name)
+    except ValueError:
+        return -1
+
+
+def name_of(table: Dict[str, Any], field: str, i: int) -> str:
+    return table["vocab"][field][int(table["cols"][field][i])]
+
+
+def column_list(table: Dict[str, Any], field: str) -> List:
+    """A column as a plain list, for loops that index it element by element."""
+    col = table["cols"][field]
+    return col.tolist() if hasattr(col, "tolist") else list(col)
+
+
+def positions_by(table: Dict[str, Any], field: str) -> Dict[int, List[int]]:
+    """Site positions grouped by code, groups in order of first appearance, positions ascending."""
+    groups: Dict[int, List[int]] = {}
+    for i, c in enumerate(column_list(table, field)):
+        groups.setdefault(c, []).append(i)
+    return groups
+
+
+# ---------- Links ----------
+
+def link_table() -> Dict[str, Any]:
+    """Empty link table; "route" holds each link's waypoints and "geom" its geometry, once built."""
+    links: Dict[str, Any] = {c: array.array(t) for c, t in LINK_COLUMNS.items()}
+    links["route"] = []
+    links["geom"] = []
+    return links
+
+
+def link_count(links: Dict[str, Any]) -> int:
+    return len(links["a"])
+
+
+def add_link(links: Dict[str, Any], a: int, b: int, tier: int, distance: float, geom: Any = None, route: Any = None):
+    links["a"].append(a); links["b"].append(b)
+    links["tier"].append(tier); links["distance"].append(distance)
+    links["route"].append(route); links["geom"].append(geom)
+
+
+def copy_link(dst: Dict[str, Any], src: Dict[str, Any], k: int):
+    add_link(dst, src["a"][k], src["b"][k], src["tier"][k], src["distance"][k], src["geom"][k], src["route"][k])
+
+
+def extend_links(dst: Dict[str, Any], src: Dict[str, Any]):
+    for c in LINK_COLUMNS:
+        dst[c].extend(src[c])
+    dst["route"].extend(src["route"]); dst["geom"].extend(src["geom"])
+
+
+def link_ends(links: Dict[str, Any]) -> Iterable:
+    """(a, b) site positions of every link."""
+    return zip(links["a"], links["b"])
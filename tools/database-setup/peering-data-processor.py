@@ -5,6 +5,8 @@ import random
 import math
 from collections import defaultdict
 
+from geo_kernel import haversine_km
+
 # --- Configuration ---
 INPUT_DIR = "peeringdb_data"
 OUTPUT_DIR = "processed_data"
@@ -23,14 +25,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- Helper Functions for Geometry ---
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
-    """Calculates the distance between two points on Earth."""
-    R = 6371.0088
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(a))
-
 def linestring_wkt(coords: list) -> str:
     """Creates a WKT linestring from a list of (lat, lon) tuples."""
     if not coords:
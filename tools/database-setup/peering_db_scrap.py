@@ -5,6 +5,8 @@ from collections import defaultdict
 
 import requests
 
+from geo_kernel import haversine_km, planar_bearing_deg, haversine_one_to_many, k_nearest_other_group
+
 try:
     from shapely.geometry import LineString, Point, shape
     from fastkml import kml as fastkml
@@ -76,13 +78,6 @@ def ts() -> str:
     import datetime
     return datetime.datetime.utcnow().isoformat()
 
-def haversine_km(a_lat, a_lon, b_lat, b_lon) -> float:
-    R = 6371.0088
-    dlat = math.radians(b_lat - a_lat)
-    dlon = math.radians(b_lon - a_lon)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(a_lat)) * math.cos(math.radians(b_lat)) * math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(a))
-
 def jitter_latlon(lat: float, lon: float, km: float=1.0) -> Tuple[float,float]:
     dlat = (km/111.0) * (random.random()-0.5) * 2
     dlon = (km/(111.0*max(0.2, math.cos(math.radians(lat))))) * (random.random()-0.5) * 2
@@ -133,8 +128,13 @@ def make_geometry(tier: str, A: Dict[str,Any], B: Dict[str,Any]) -> Tuple[float,
     return round(d,1), linestring_wkt(coords)
 
 def bearing_deg(a: Dict[str,Any], b: Dict[str,Any]) -> float:
-    dy=b["latitude"]-a["latitude"]; dx=b["longitude"]-a["longitude"]
-    return (math.degrees(math.atan2(dy, dx)) + 360.0) % 360.0
+    return planar_bearing_deg(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
+
+def nearest_other(reps: List[Dict[str,Any]], k: int, group) -> List[List[Dict[str,Any]]]:
+    """For each rep, its k nearest reps with a different group(rep), nearest first."""
+    near = k_nearest_other_group([s["latitude"] for s in reps], [s["longitude"] for s in reps],
+                                 [group(s) for s in reps], k)
+    return [[reps[j] for j in idx] for idx in near]
 
 def ok_by_caps(tier: str, A: Dict[str,Any], B: Dict[str,Any],
                deg: Dict[str,int], pair_counts: Dict[Tuple[str,str,str], int],
@@ -280,15 +280,8 @@ def build_links(sites: List[Dict[str,Any]], telegeo_cables: Optional[List[LineSt
         if rep:
             city_reps.append(rep)
     # connect nearest neighbors up to cap
-    for a in city_reps:
-        # find ~8 nearest different-city reps
-        dists=[]
-        for b in city_reps:
-            if b["city"]==a["city"] and b["country"]==a["country"]: continue
-            d=haversine_km(a["latitude"],a["longitude"],b["latitude"],b["longitude"])
-            dists.append((d,b))
-        dists.sort(key=lambda x:x[0])
-        for _, b in dists[:6]:
+    for a, near in zip(city_reps, nearest_other(city_reps, 6, lambda s: (s["country"], s["city"]))):
+        for b in near:
             try_add(a,b,"Regional Network")
 
     # 4) Core: sparse connections among top-IXP metros
@@ -302,14 +295,8 @@ def build_links(sites: List[Dict[str,Any]], telegeo_cables: Optional[List[LineSt
         if rep:
             core_nodes.append(rep)
     # connect each core node to 3 nearest other core nodes
-    for a in core_nodes:
-        dists=[]
-        for b in core_nodes:
-            if b is a: continue
-            d=haversine_km(a["latitude"],a["longitude"],b["latitude"],b["longitude"])
-            dists.append((d,b))
-        dists.sort(key=lambda x:x[0])
-        for _, b in dists[:3]:
+    for a, near in zip(core_nodes, nearest_other(core_nodes, 3, id)):
+        for b in near:
             try_add(a,b,"Core Backbone")
 
     # 5) International: use TeleGeography cable landings if provided (approximate)
@@ -325,22 +312,16 @@ def build_links(sites: List[Dict[str,Any]], telegeo_cables: Optional[List[LineSt
             if close:
                 coast.append(s)
         # connect coastal reps across continents (nearest 2)
-        for a in coast:
-            dists=[]
-            for b in coast:
-                if b is a: continue
-                if a["country"] == b["country"]: continue
-                d = haversine_km(a["latitude"],a["longitude"],b["latitude"],b["longitude"])
-                dists.append((d,b))
-            dists.sort(key=lambda x:x[0])
-            for _, b in dists[:2]:
+        for a, near in zip(coast, nearest_other(coast, 2, lambda s: s["country"])):
+            for b in near:
                 try_add(a,b,"International Gateway")
     else:
         # fallback: connect top core nodes across >1500km
         for a in core_nodes:
-            for b in core_nodes:
+            dists = haversine_one_to_many(a["latitude"], a["longitude"],
+                                          [b["latitude"] for b in core_nodes], [b["longitude"] for b in core_nodes])
+            for b, d in zip(core_nodes, dists):
                 if b is a: continue
-                d=haversine_km(a["latitude"],a["longitude"],b["latitude"],b["longitude"])
                 if d > 2000 and d < 9000:
                     try_add(a,b,"International Gateway")
 
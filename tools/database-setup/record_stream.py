@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Incremental readers and writers for the generator output files (data/sites.json,
+data/links.json).
+
+json.load() materialises the whole top-level array before the first insert; these
+readers yield one record at a time so loader memory stays flat regardless of file size.
+The writer is the mirror image: records are serialised as they are produced.
+
+Two formats: a top-level JSON array (the default .json layout of json.dump) and NDJSON,
+one compact record per line (.ndjson). Either may be gzip (.gz) or zstd (.zst)
+compressed, chosen by the file suffix; zstd needs the optional zstandard package.
+NDJSON can be split into numbered parts (sites-00000.ndjson.gz, ...); record_paths()
+finds the parts again in order, so readers treat them as one file.
+
+The fused pipeline (setup_data-real.py --fused) skips the files: the generator
+process puts records on a bounded multiprocessing queue in batches and the loader
+reads them back through a QueueFeed, so a full queue blocks the generator until
+the loader catches up.
+"""
+import glob
+import gzip
+import io
+import json
+import os
+import queue
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import zstandard
+    HAVE_ZSTD = True
+except Exception:
+    HAVE_ZSTD = False
+
+CHUNK_SIZE = 1 << 20  # 1 MiB reads
+QUEUE_BATCH = 2000    # records per queue message
+GZIP_LEVEL = 6
+
+OUTPUT_FORMATS = {"json": ".json", "ndjson": ".ndjson"}
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+_compact = json.JSONEncoder(separators=(",", ":"))
+
+
+# ---------- Files ----------
+
+def open_records(path: str, mode: str = "r"):
+    """
+    Text handle on path ("r" or "w"), (de)compressing by suffix. gzip headers are written
+    with mtime 0, so the same records always compress to the same bytes.
+    """
+    if path.endswith(".gz"):
+        if mode == "w":
+            return io.TextIOWrapper(gzip.GzipFile(path, "wb", compresslevel=GZIP_LEVEL, mtime=0), encoding="utf-8")
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if not HAVE_ZSTD:
+            raise RuntimeError(f"{path}: zstd needs the zstandard package (pip install zstandard)")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _split_suffix(path: str):
+    """(stem, suffix) with the format and compression suffixes together: data/sites, .ndjson.gz"""
+    comp = next((c for c in (".gz", ".zst") if path.endswith(c)), "")
+    stem, ext = os.path.splitext(path[:len(path)-len(comp)])
+    return stem, ext + comp
+
+
+def is_ndjson(path: str) -> bool:
+    return _split_suffix(path)[1].startswith(NDJSON_SUFFIXES)
+
+
+def part_path(path: str, part: int) -> str:
+    stem, suffix = _split_suffix(path)
+    return f"{stem}-{part:05d}{suffix}"
+
+
+def record_paths(path: str) -> List[str]:
+    """The files behind path: itself, its numbered parts, or the matches of a glob pattern; sorted."""
+    if any(c in path for c in "*?["):
+        return sorted(glob.glob(path))
+    if os.path.exists(path):
+        return [path]
+    stem, suffix = _split_suffix(path)
+    return sorted(glob.glob(f"{glob.escape(stem)}-[0-9][0-9][0-9][0-9][0-9]{suffix}"))
+
+
+def records_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in record_paths(path))
+
+
+def output_path(directory: str, name: str, fmt: str = "json", compression: Optional[str] = None) -> str:
+    """Where a generator writes `name` (sites/links) in this format, e.g. data/links.ndjson.zst"""
+    return os.path.join(directory, name + OUTPUT_FORMATS[fmt] + COMPRESSIONS[compression])
+
+
+def find_output(directory: str, name: str) -> Optional[str]:
+    """The most recently written generator output for `name` in any format, or None."""
+    found = [(max(os.path.getmtime(p) for p in paths), path)
+             for path in (output_path(directory, name, f, c) for f in OUTPUT_FORMATS for c in COMPRESSIONS)
+             for paths in [record_paths(path)] if paths]
+    return max(found)[1] if found else None
+
+
+# ---------- JSON arrays ----------
+
+_decoder = json.JSONDecoder()
+_WS = " \t\r\n"
+
+
+def iter_json_array(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yield the items of a top-level JSON array without parsing the whole file."""
+    with open_records(path) as f:
+        buf = ""; pos = 0; eof = False
+
+        def fill() -> bool:
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buf = buf[pos:] + chunk; pos = 0
+            return True
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or not fill():
+                    return
+
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path}: expected a top-level JSON array")
+        pos += 1
+
+        first = True
+        while True:
+            skip_ws()
+            if pos >= len(buf):
+                raise ValueError(f"{path}: unexpected end of file inside array")
+            if buf[pos] == "]":
+                return
+            if not first:
+                if buf[pos] != ",":
+                    raise ValueError(f"{path}: expected ',' at offset {pos}")
+                pos += 1
+                skip_ws()
+            first = False
+
+            # Decode one item; an item that reaches the end of the buffer may be
+            # truncated (e.g. a number), so read more before trusting it.
+            while True:
+                try:
+                    item, end = _decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+            pos = end
+            yield item
+
+
+def json_array_texts(path: str) -> Iterator[Any]:
+    """
+    Undecoded text of each item of a json.dump(indent=2) array of objects, found line by
+    line (JSON strings never hold a raw newline, so an item is the run from a "  {" line
+    to its "  }" line). Any other layout falls back to iter_json_array() dicts.
+    """
+    with open_records(path) as f:
+        if f.readline().rstrip("\n") != "[" or f.readline().rstrip("\n") != "  {":
+            yield from iter_json_array(path)
+            return
+        lines = ["{"]
+        for line in f:
+            if line.startswith("  }"):
+                lines.append("}")
+                yield "".join(lines)
+                lines = []
+            elif line.startswith("  {"):
+                lines = ["{"]
+            else:
+                lines.append(line)
+
+
+class JsonArrayWriter:
+    """Records appended to a top-level JSON array as they are produced (same layout as json.dump)."""
+
+    def __init__(self, path: str, indent: int = 2):
+        self.f = open_records(path, "w"); self.f.write("[")
+        self.indent = indent; self.pad = " " * indent; self.count = 0
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> int:
+        n = 0
+        for r in records:
+            self.f.write(",\n" if self.count + n else "\n")
+            self.f.write(self.pad + json.dumps(r, indent=self.indent).replace("\n", "\n" + self.pad))
+            n += 1
+        self.count += n
+        return n
+
+    def close(self) -> int:
+        self.f.write("\n]" if self.count else "]")
+        self.f.close()
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_json_array(path: str, records: Iterable[Dict[str, Any]], indent: int = 2) -> int:
+    """Write records as a top-level JSON array (same layout as json.dump); returns the count."""
+    with JsonArrayWriter(path, indent) as w:
+        w.write(records)
+    return w.count
+
+
+# ---------- NDJSON ----------
+
+def ndjson_lines(path: str) -> Iterator[str]:
+    """Raw record lines of path and its parts, undecoded (so a pool can decode them)."""
+    for p in record_paths(path):
+        with open_records(p) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def iter_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    for line in ndjson_lines(path):
+        yield json.loads(line)
+
+
+class NdjsonWriter:
+    """
+    Records appended to path as compact NDJSON as they are produced. With split_records,
+    the output rotates to numbered parts of that many records each. Whatever an earlier
+    run left at path or in its parts is removed first, so record_paths() sees this run only.
+    """
+
+    def __init__(self, path: str, split_records: int = 0):
+        self.path = path; self.split_records = split_records
+        for stale in record_paths(path):
+            os.remove(stale)
+        self.f = None; self.part = 0; self.in_part = 0; self.count = 0
+
+    def _next_file(self):
+        if self.f is not None:
+            self.f.close(); self.part += 1
+        self.f = open_records(part_path(self.path, self.part) if self.split_records else self.path, "w")
+        self.in_part = 0
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> int:
+        n = 0
+        for r in records:
+            if self.f is None or (self.split_records and self.in_part >= self.split_records):
+                self._next_file()
+            self.f.write(_compact.encode(r)); self.f.write("\n")
+            self.in_part += 1; n += 1
+        self.count += n
+        return n
+
+    def close(self) -> int:
+        if self.f is None:
+            self._next_file()  # no records still leaves an (empty) file behind
+        self.f.close()
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- Any format ----------
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Records of a JSON array or NDJSON file (compressed, split or globbed), one at a time."""
+    paths = record_paths(path)
+    if not paths:
+        raise FileNotFoundError(path)
+    for p in paths:
+        yield from (iter_ndjson(p) if is_ndjson(p) else iter_json_array(p))
+
+
+def raw_records(path: str) -> Iterator[Any]:
+    """
+    iter_records() for a parse pool: NDJSON lines and indented JSON array items come as
+    undecoded text (json.loads() them), anything else as dicts.
+    """
+    paths = record_paths(path)
+    if not paths:
+        raise FileNotFoundError(path)
+    for p in paths:
+        yield from (ndjson_lines(p) if is_ndjson(p) else json_array_texts(p))
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """All records at once (json.load for JSON arrays)."""
+    out = []
+    for p in record_paths(path):
+        if is_ndjson(p):
+            out.extend(iter_ndjson(p))
+        else:
+            with open_records(p) as f:
+                out.extend(json.load(f))
+    return out
+
+
+def write_records(path: str, records: Iterable[Dict[str, Any]], split_records: int = 0) -> int:
+    """Write records in the format path's suffix names; returns the count."""
+    if not is_ndjson(path):
+        return write_json_array(path, records)
+    with NdjsonWriter(path, split_records) as w:
+        w.write(records)
+    return w.count
+
+
+class RecordFiles:
+    """
+    sink(kind, records) that appends each kind ("sites", "links") to its output file in
+    directory as records arrive (split_records applies to NDJSON). close() when done.
+    """
+
+    def __init__(self, directory: str, fmt: str = "json", compression: Optional[str] = None,
+                 split_records: int = 0):
+        self.directory = directory; self.fmt = fmt; self.compression = compression
+        self.split_records = split_records
+        self.writers: Dict[str, Any] = {}
+
+    def path(self, kind: str) -> str:
+        return output_path(self.directory, kind, self.fmt, self.compression)
+
+    def __call__(self, kind: str, records: Iterable[Dict[str, Any]]) -> int:
+        if kind not in self.writers:
+            self.writers[kind] = (NdjsonWriter(self.path(kind), self.split_records) if self.fmt == "ndjson"
+                                  else JsonArrayWriter(self.path(kind)))
+        return self.writers[kind].write(records)
+
+    def close(self) -> Dict[str, int]:
+        return {kind: w.close() for kind, w in self.writers.items()}
+
+
+def tee_sinks(*sinks):
+    """
+    One sink feeding every given sink (None entries skipped). With several, records are
+    passed on in QUEUE_BATCH batches, so each sink must accept a kind in several calls
+    (RecordFiles and put_records() do) and at most one batch is held in memory.
+    """
+    sinks = [s for s in sinks if s is not None]
+    if len(sinks) == 1:
+        return sinks[0]
+
+    def tee(kind, records):
+        it = iter(records); n = 0
+        while True:
+            batch = list(islice(it, QUEUE_BATCH))
+            if not batch:
+                return n
+            for s in sinks:
+                s(kind, batch)
+            n += len(batch)
+    return tee if sinks else None
+
+
+# ---------- Queue transport ----------
+
+def put_records(q, kind: str, records: Iterable[Dict[str, Any]], batch_size: int = QUEUE_BATCH) -> int:
+    """Put records on q as (kind, [records...]) batches; blocks while q is full. Returns the count."""
+    batch = []; n = 0
+    for r in records:
+        batch.append(r); n += 1
+        if len(batch) >= batch_size:
+            q.put((kind, batch)); batch = []
+    if batch:
+        q.put((kind, batch))
+    return n
+
+
+def end_records(q):
+    """Tell the reader the producer finished successfully."""
+    q.put(None)
+
+
+class QueueFeed:
+    """
+    Reader side of put_records(). records(kind) yields records until a batch of another
+    kind arrives, so a producer that sends all sites and then all links can feed a loader
+    that consumes them in that order. If the producer process dies before end_records(),
+    the reader raises instead of waiting forever.
+    """
+
+    def __init__(self, q, producer=None, poll_s: float = 1.0):
+        self.q = q; self.producer = producer; self.poll_s = poll_s
+        self.pending: Optional[tuple] = None
+        self.finished = False
+
+    def _get(self):
+        while True:
+            try:
+                return self.q.get(timeout=self.poll_s)
+            except queue.Empty:
+                if self.producer is not None and not self.producer.is_alive():
+                    try:
+                        return self.q.get_nowait()
+                    except queue.Empty:
+                        raise RuntimeError(f"producer exited (code {self.producer.exitcode}) before finishing")
+
+    def records(self, kind: str) -> Iterator[Dict[str, Any]]:
+        while not self.finished:
+            msg = self.pending if self.pending is not None else self._get()
+            self.pending = None
+            if msg is None:
+                self.finished = True
+                return
+            if msg[0] != kind:
+                self.pending = msg
+                return
+            yield from msg[1]
@@ -5,6 +5,13 @@ import os
 import time
 import logging
 import sqlite3
+import argparse
+import importlib.util
+import multiprocessing as mp
+
+from load_state import input_hashes, db_changed_tables
+from record_stream import (put_records, end_records, QueueFeed, OUTPUT_FORMATS, COMPRESSIONS, output_path,
+                           record_paths, records_size)
 
 # Logging
 logging.basicConfig(
@@ -17,8 +24,18 @@ logger = logging.getLogger(__name__)
 DB_REL_PATH = "../../db/network.sqlite"
 GEN_SCRIPT = "generate-realV3.py"  # rename to your generator_realistic.py if needed "generate-realV2.py"
 LOAD_SCRIPT = "load-data-real.py"
-SITES_JSON = "data/sites.json"
-LINKS_JSON = "data/links.json"
+DATA_DIR = "data"
+# Generator output format handed to both scripts (see record_stream.py)
+OUTPUT_FORMAT = "json"
+OUTPUT_COMPRESSION = None
+# Reload even when the generated files match the hashes recorded by the last load
+FORCE_LOAD = False
+# Fused pipeline: the generator runs in a child process and its records are loaded as
+# they arrive over a bounded queue (QUEUE_BATCHES batches of record_stream.QUEUE_BATCH
+# records), so loading overlaps generation and no JSON is written unless KEEP_JSON
+FUSED_PIPELINE = False
+KEEP_JSON = False
+QUEUE_BATCHES = 8
 
 
 def run_subprocess(cmd):
@@ -32,6 +49,44 @@ def run_subprocess(cmd):
     return res
 
 
+def load_script(path, name):
+    """Import one of the hyphenated scripts as a module."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_into(q, scale, keep_json, output):
+    """Generator process of the fused pipeline: records onto q, then the end marker."""
+    gen = load_script(GEN_SCRIPT, "generate_real")
+    sink = lambda kind, records: put_records(q, kind, records)
+    if scale > 1:
+        gen.main_scaled(scale, sink=sink, keep_json=keep_json, **output)
+    else:
+        gen.main(sink=sink, keep_json=keep_json, **output)
+    end_records(q)
+
+
+def run_fused(db_path, scale=1, keep_json=KEEP_JSON, output=None):
+    """Generate and load in one pass over a bounded queue; True on success."""
+    loader = load_script(LOAD_SCRIPT, "load_data_real")
+    q = mp.Queue(maxsize=QUEUE_BATCHES)
+    producer = mp.Process(target=generate_into, args=(q, scale, keep_json, output or {}), name="generator")
+    producer.start()
+    feed = QueueFeed(q, producer)
+    try:
+        ok = loader.load_data_to_sqlite(db_path=db_path, records=(feed.records("sites"), feed.records("links")))
+    finally:
+        if not feed.finished and producer.is_alive():
+            producer.terminate()  # the loader gave up; don't leave it blocked on a full queue
+        producer.join()
+    if ok and producer.exitcode != 0:
+        raise RuntimeError(f"Generator process failed (exit code {producer.exitcode})")
+    return ok
+
+
 def verify_db(db_path):
     try:
         conn = sqlite3.connect(db_path)
@@ -88,8 +143,10 @@ def verify_db(db_path):
         logger.warning(f"⚠️ Verification skipped/failed: {e}")
 
 
-def main():
+def main(fused=FUSED_PIPELINE, scale=1, keep_json=KEEP_JSON,
+         output_format=OUTPUT_FORMAT, compression=OUTPUT_COMPRESSION):
     start_ts = time.time()
+    output = {"output_format": output_format, "compression": compression}
     logger.info("🚀 Starting ISP Network Database Setup")
     logger.info("=" * 60)
     logger.info(f"🐍 Python: {sys.version.splitlines()[0]}")
@@ -104,39 +161,53 @@ def main():
         logger.error("Ensure the database exists at ../../db/network.sqlite")
         return 1
 
+    if fused:
+        return main_fused(db_path, start_ts, scale, keep_json, output)
+
     # 1) Generate data
     logger.info("=" * 60)
     logger.info("1️⃣ GENERATING DATA")
     logger.info("=" * 60)
     gen_start = time.time()
     try:
-        run_subprocess([sys.executable, GEN_SCRIPT])
+        run_subprocess([sys.executable, GEN_SCRIPT, "--format", output_format]
+                       + (["--compress", compression] if compression else [])
+                       + (["--scale", str(scale)] if scale > 1 else []))
     except Exception as e:
         logger.error(f"❌ Data generation failed: {e}")
         return 1
     gen_dur = time.time() - gen_start
     logger.info(f"✅ Data generation completed in {gen_dur:.2f}s")
 
-    if not os.path.exists(SITES_JSON) or not os.path.exists(LINKS_JSON):
-        logger.error("❌ Generated JSON files not found (data/sites.json, data/links.json).")
+    sites_path = output_path(DATA_DIR, "sites", output_format, compression)
+    links_path = output_path(DATA_DIR, "links", output_format, compression)
+    if not record_paths(sites_path) or not record_paths(links_path):
+        logger.error(f"❌ Generated files not found ({sites_path}, {links_path}).")
         return 1
 
-    s_size = os.path.getsize(SITES_JSON) / (1024 * 1024)
-    l_size = os.path.getsize(LINKS_JSON) / (1024 * 1024)
+    s_size = records_size(sites_path) / (1024 * 1024)
+    l_size = records_size(links_path) / (1024 * 1024)
     logger.info("📂 Generated files:")
-    logger.info(f"   Sites: {SITES_JSON} ({s_size:.2f} MB)")
-    logger.info(f"   Links: {LINKS_JSON} ({l_size:.2f} MB)")
+    logger.info(f"   Sites: {sites_path} ({s_size:.2f} MB)")
+    logger.info(f"   Links: {links_path} ({l_size:.2f} MB)")
 
     # 2) Load into SQLite
     logger.info("=" * 60)
     logger.info("2️⃣ LOADING INTO SQLITE")
     logger.info("=" * 60)
     load_start = time.time()
-    try:
-        run_subprocess([sys.executable, LOAD_SCRIPT])
-    except Exception as e:
-        logger.error(f"❌ Data loading failed: {e}")
-        return 1
+    reload = db_changed_tables(db_path, input_hashes(sites_path, links_path)) if not FORCE_LOAD else None
+    if reload is not None and not reload:
+        logger.info("⏭️ Generated files match the last load; skipping")
+    else:
+        if reload is not None:
+            logger.info(f"🔄 Changed inputs: {', '.join(sorted(reload))}")
+        try:
+            run_subprocess([sys.executable, LOAD_SCRIPT, "--sites", sites_path, "--links", links_path]
+                           + (["--force"] if FORCE_LOAD else []))
+        except Exception as e:
+            logger.error(f"❌ Data loading failed: {e}")
+            return 1
     load_dur = time.time() - load_start
     logger.info(f"✅ Data loading completed in {load_dur:.2f}s")
 
@@ -159,9 +230,49 @@ def main():
     return 0
 
 
+def main_fused(db_path, start_ts, scale, keep_json, output):
+    # 1+2) Generate and load in one pass
+    logger.info("=" * 60)
+    logger.info("1️⃣ GENERATING + LOADING (fused pipeline)")
+    logger.info("=" * 60)
+    try:
+        ok = run_fused(db_path, scale, keep_json, output)
+    except Exception as e:
+        logger.error(f"❌ Fused generate/load failed: {e}")
+        return 1
+    if not ok:
+        logger.error("❌ Data loading failed")
+        return 1
+    fused_dur = time.time() - start_ts
+    logger.info(f"✅ Generation + loading completed in {fused_dur:.2f}s")
+
+    # 3) Verify
+    logger.info("=" * 60)
+    logger.info("3️⃣ FINAL VERIFICATION")
+    logger.info("=" * 60)
+    verify_db(db_path)
+
+    logger.info("=" * 60)
+    logger.info("🎉 DATABASE SETUP COMPLETED SUCCESSFULLY")
+    logger.info("=" * 60)
+    logger.info(f"⏱️  Total (fused): {time.time() - start_ts:.2f}s")
+    logger.info(f"📍 DB: {db_path}")
+    return 0
+
+
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fused", action="store_true",
+                    help="load records as the generator produces them, without the JSON round trip")
+    ap.add_argument("--keep-json", action="store_true", help="with --fused, write the data files as well")
+    ap.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default=OUTPUT_FORMAT,
+                    help="generator output: JSON arrays or NDJSON lines")
+    ap.add_argument("--compress", choices=[c for c in COMPRESSIONS if c], default=OUTPUT_COMPRESSION)
+    ap.add_argument("--scale", type=int, default=1, help="generator scale mode (generate-realV3.py --scale)")
+    args = ap.parse_args()
     try:
-        sys.exit(main())
+        sys.exit(main(fused=args.fused or FUSED_PIPELINE, scale=args.scale, keep_json=args.keep_json or KEEP_JSON,
+                      output_format=args.format, compression=args.compress))
     except KeyboardInterrupt:
         logger.warning("⚠️ Interrupted by user")
         sys.exit(130)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Read-only tables published once through shared memory for the generator's
+process pool.
+
+publish() walks a nested structure of dicts, lists and tuples and packs every
+NumPy array into one named SharedMemory block. It returns a small handle that
+mirrors the structure, with each array replaced by its offset, shape and dtype
+in the block, so the handle is what gets pickled into each pool task.
+attach() maps the block by name in the worker, once per process, and rebuilds
+the structure around zero-copy array views. Without NumPy there are no arrays,
+and the structure travels in the handle as before.
+
+The generator publishes its column-wise site table (net_model.py) this way,
+together with the pair index and routing context built from it.
+"""
+import uuid
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import numpy as np
+    HAVE_NP = True
+except Exception:
+    HAVE_NP = False
+
+SHM_KEY = "__shm__"
+SHM_ALIGN = 64
+
+# worker-side cache: block name -> (structure, block kept open for its views)
+_ATTACHED: Dict[str, Tuple[Any, shared_memory.SharedMemory]] = {}
+
+
+# ---------- Publish / attach ----------
+
+def publish(obj: Any, prefix: str = "netgen") -> Tuple[Dict[str, Any], Optional[shared_memory.SharedMemory]]:
+    """
+    (handle, block) for obj. The caller keeps the block open while workers may attach
+    and then passes it to release(); block is None if obj holds no arrays.
+    """
+    arrays = []; size = 0
+
+    def walk(x):
+        nonlocal size
+        if HAVE_NP and isinstance(x, np.ndarray):
+            x = np.ascontiguousarray(x)
+            offset = -(-size // SHM_ALIGN) * SHM_ALIGN
+            arrays.append((offset, x)); size = offset + x.nbytes
+            return {SHM_KEY: offset, "shape": x.shape, "dtype": x.dtype.str}
+        if isinstance(x, dict):
+            return {k: walk(v) for k, v in x.items()}
+        if isinstance(x, (list, tuple)):
+            return type(x)(walk(v) for v in x)
+        return x
+
+    tree = walk(obj)
+    if not arrays:
+        return {"name": None, "tree": tree}, None
+    block = shared_memory.SharedMemory(name=f"{prefix}_{uuid.uuid4().hex[:12]}", create=True, size=max(size, 1))
+    for offset, x in arrays:
+        np.ndarray(x.shape, dtype=x.dtype, buffer=block.buf, offset=offset)[...] = x
+    return {"name": block.name, "tree": tree}, block
+
+
+def attach(handle: Dict[str, Any]) -> Any:
+    """The published structure with read-only array views onto the shared block (cached per process)."""
+    if handle["name"] is None:
+        return handle["tree"]
+    cached = _ATTACHED.get(handle["name"])
+    if cached is not None:
+        return cached[0]
+    block = shared_memory.SharedMemory(name=handle["name"])
+
+    def walk(x):
+        if isinstance(x, dict) and SHM_KEY in x:
+            arr = np.ndarray(x["shape"], dtype=np.dtype(x["dtype"]), buffer=block.buf, offset=x[SHM_KEY])
+            arr.flags.writeable = False
+            return arr
+        if isinstance(x, dict):
+            return {k: walk(v) for k, v in x.items()}
+        if isinstance(x, (list, tuple)):
+            return type(x)(walk(v) for v in x)
+        return x
+
+    obj = walk(handle["tree"])
+    _ATTACHED[handle["name"]] = (obj, block)
+    return obj
+
+
+def release(block: Optional[shared_memory.SharedMemory]):
+    """Close and unlink a block returned by publish()."""
+    if block is None:
+        return
+    block.close()
+    block.unlink()
+
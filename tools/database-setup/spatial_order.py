@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Spatial ordering helpers for the loaders.
+
+Rows inserted in Hilbert-curve order land on neighbouring table pages, so a
+bbox (tile) query touches far fewer pages than with generator order. The same
+orderings drive the packed (bulk-loaded) R-trees written by write_packed_rtree().
+"""
+import math
+import random
+import struct
+from bisect import bisect_left
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+HILBERT_ORDER = 16  # 2^16 x 2^16 grid over lon/lat (~600 m cells at the equator)
+
+
+def hilbert_d(x: int, y: int, order: int = HILBERT_ORDER) -> int:
+    """Distance along the Hilbert curve of cell (x, y) in a 2^order grid."""
+    n = 1 << order
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if (x & s) else 0
+        ry = 1 if (y & s) else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate quadrant
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def hilbert_key(lon: float, lat: float, order: int = HILBERT_ORDER) -> int:
+    n = (1 << order) - 1
+    x = int((min(max(lon, -180.0), 180.0) + 180.0) / 360.0 * n)
+    y = int((min(max(lat, -90.0), 90.0) + 90.0) / 180.0 * n)
+    return hilbert_d(x, y, order)
+
+
+def points_centre_key(pts: Sequence[Tuple[float, float]], order: int = HILBERT_ORDER) -> int:
+    """Hilbert key of the bbox centre of [(x, y), ...]."""
+    xs = [p[0] for p in pts]; ys = [p[1] for p in pts]
+    return hilbert_key((min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2, order)
+
+
+# ---------- Tile sampling & page-touch measurement ----------
+
+def tile_bbox(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Same maths as PbfService.tileToBbox(): (minLon, minLat, maxLon, maxLat)."""
+    n = 2 ** z
+    to_lat = lambda yy: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+    return x / n * 360 - 180, to_lat(y + 1), (x + 1) / n * 360 - 180, to_lat(y)
+
+
+def tile_for(lon: float, lat: float, z: int) -> Tuple[int, int, int]:
+    n = 2 ** z
+    lat = min(max(lat, -85.0511), 85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return z, min(x, n - 1), min(y, n - 1)
+
+
+def sample_tiles(points: Sequence[Tuple[float, float]], zooms: Iterable[int] = (4, 6, 8, 10),
+                 per_zoom: int = 25, seed: int = 42) -> List[Tuple[int, int, int]]:
+    """Tiles containing randomly chosen (lon, lat) points, deduplicated."""
+    rnd = random.Random(seed)
+    tiles = set()
+    for z in zooms:
+        for lon, lat in rnd.sample(list(points), min(per_zoom, len(points))):
+            tiles.add(tile_for(lon, lat, z))
+    return sorted(tiles)
+
+
+def _leaf_page_bounds(conn, table: str):
+    """Cumulative row counts at the end of each table leaf page (in rowid order), or None without dbstat."""
+    try:
+        rows = conn.execute(
+            "SELECT ncell FROM dbstat WHERE name = ? AND pagetype = 'leaf' ORDER BY path;", (table,)
+        ).fetchall()
+    except Exception:
+        return None
+    bounds = []; acc = 0
+    for (ncell,) in rows:
+        acc += ncell; bounds.append(acc)
+    return bounds
+
+
+def tile_page_reads(conn, table: str, rtree: str, tiles: Sequence[Tuple[int, int, int]]) -> Optional[int]:
+    """
+    Total distinct table leaf pages holding the rows an R-tree lookup returns, summed over tiles.
+    Page boundaries come from dbstat; None if SQLite was built without it.
+    """
+    rowids = [r for (r,) in conn.execute(f"SELECT rowid FROM {table} ORDER BY rowid;")]
+    if not rowids:
+        return 0
+    bounds = _leaf_page_bounds(conn, table)
+    if not bounds:
+        return None
+    page_of = lambda rank: bisect_left(bounds, rank + 1)
+
+    total = 0
+    for z, x, y in tiles:
+        minx, miny, maxx, maxy = tile_bbox(z, x, y)
+        hits = conn.execute(
+            f"SELECT pkid FROM {rtree} WHERE xmin <= ? AND xmax >= ? AND ymin <= ? AND ymax >= ?;",
+            (maxx, minx, maxy, miny),
+        ).fetchall()
+        total += len({page_of(bisect_left(rowids, pk)) for (pk,) in hits})
+    return total
+
+
+# ---------- Packed R-tree bulk load ----------
+# SQLite's rtree module keeps each node as one BLOB in <rtree>_node: a 4-byte
+# header (tree depth, only read on the root; cell count) followed by cells of an
+# int64 id and float32 xmin, xmax, ymin, ymax, all big-endian. Leaf cell ids are
+# row ids, internal cell ids are child node numbers, and the root is node 1.
+
+RTREE_CELL = struct.Struct(">q4f")
+_F32 = struct.Struct(">f")
+_U32 = struct.Struct(">I")
+
+
+def _f32_step(v: float, up: bool) -> float:
+    """Adjacent float32 of float32 value v."""
+    if v == 0.0:
+        return 1.401298464324817e-45 if up else -1.401298464324817e-45
+    bits = _U32.unpack(_F32.pack(v))[0]
+    bits += 1 if (v > 0) == up else -1
+    return _F32.unpack(_U32.pack(bits))[0]
+
+
+def f32_down(v: float) -> float:
+    """Largest float32 <= v (rtree rounds minimums down so boxes never shrink)."""
+    f = _F32.unpack(_F32.pack(v))[0]
+    return _f32_step(f, up=False) if f > v else f
+
+
+def f32_up(v: float) -> float:
+    f = _F32.unpack(_F32.pack(v))[0]
+    return _f32_step(f, up=True) if f < v else f
+
+
+def str_order(boxes: Sequence[Tuple[float, float, float, float]], capacity: int) -> List[int]:
+    """Sort-Tile-Recursive order of (minx, miny, maxx, maxy) boxes for nodes of `capacity`."""
+    n = len(boxes)
+    slabs = math.ceil(math.sqrt(math.ceil(n / capacity))) if n else 1
+    per_slab = slabs * capacity
+    by_x = sorted(range(n), key=lambda i: boxes[i][0] + boxes[i][2])
+    out = []
+    for k in range(0, n, per_slab):
+        out += sorted(by_x[k:k + per_slab], key=lambda i: boxes[i][1] + boxes[i][3])
+    return out
+
+
+def hilbert_box_order(boxes: Sequence[Tuple[float, float, float, float]], capacity: int) -> List[int]:
+    return sorted(range(len(boxes)),
+                  key=lambda i: hilbert_key((boxes[i][0] + boxes[i][2]) / 2, (boxes[i][1] + boxes[i][3]) / 2))
+
+
+PACKINGS = {"str": str_order, "hilbert": hilbert_box_order}
+
+
+def _union(boxes):
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def pack_rtree(entries: Sequence[Tuple[int, float, float, float, float]], capacity: int,
+               packing: str = "str") -> List[List[List[Tuple[int, Tuple[float, float, float, float]]]]]:
+    """
+    Group (rowid, minx, miny, maxx, maxy) entries into full nodes, level by level.
+    Returns levels leaf-first; each node is a list of (ref, box) where ref is a rowid
+    on the leaf level and an index into the level below otherwise. The last level
+    holds exactly one node (the root).
+    """
+    order = PACKINGS[packing]
+    items = [(e[0], (f32_down(e[1]), f32_down(e[2]), f32_up(e[3]), f32_up(e[4]))) for e in entries]
+    levels = []
+    while True:
+        boxes = [box for _, box in items]
+        ranked = [items[i] for i in order(boxes, capacity)]
+        nodes = [ranked[k:k + capacity] for k in range(0, len(ranked), capacity)] or [[]]
+        levels.append(nodes)
+        if len(nodes) == 1:
+            return levels
+        items = [(k, _union([box for _, box in node])) for k, node in enumerate(nodes)]
+
+
+def write_packed_rtree(conn, rtree: str, entries: Sequence[Tuple[int, float, float, float, float]],
+                       packing: str = "str") -> Tuple[int, int]:
+    """
+    Replace the contents of an (empty, freshly created) 2-D rtree table by writing packed
+    nodes straight into its shadow tables. Returns (depth, node count).
+    """
+    node_size = conn.execute(f'SELECT length(data) FROM "{rtree}_node" WHERE nodeno = 1;').fetchone()[0]
+    capacity = (node_size - 4) // RTREE_CELL.size
+    levels = pack_rtree(entries, capacity, packing)
+    depth = len(levels) - 1
+
+    # number nodes breadth-first from the root so the root is node 1
+    numbers = []; next_no = 1
+    for nodes in reversed(levels):
+        numbers.append(list(range(next_no, next_no + len(nodes))))
+        next_no += len(nodes)
+    numbers.reverse()
+
+    node_rows = []; parent_rows = []; rowid_rows = []
+    for li, nodes in enumerate(levels):
+        for k, node in enumerate(nodes):
+            nodeno = numbers[li][k]
+            cells = []
+            for ref, (minx, miny, maxx, maxy) in node:
+                child = ref if li == 0 else numbers[li - 1][ref]
+                cells.append(RTREE_CELL.pack(child, minx, maxx, miny, maxy))
+                if li == 0:
+                    rowid_rows.append((ref, nodeno))
+                else:
+                    parent_rows.append((child, nodeno))
+            data = struct.pack(">HH", depth if nodeno == 1 else 0, len(node)) + b"".join(cells)
+            node_rows.append((nodeno, data.ljust(node_size, b"\0")))
+
+    conn.execute(f'DELETE FROM "{rtree}_node";')
+    conn.execute(f'DELETE FROM "{rtree}_parent";')
+    conn.execute(f'DELETE FROM "{rtree}_rowid";')
+    conn.executemany(f'INSERT INTO "{rtree}_node" (nodeno, data) VALUES (?, ?);', node_rows)
+    conn.executemany(f'INSERT INTO "{rtree}_parent" (nodeno, parentnode) VALUES (?, ?);', parent_rows)
+    conn.executemany(f'INSERT INTO "{rtree}_rowid" (rowid, nodeno) VALUES (?, ?);', rowid_rows)
+    return depth, len(node_rows)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Round trips through record_stream's writers and readers (python -m pytest test_record_stream.py)."""
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+import record_stream as rs
+
+RECORDS = [{"site_id": f"S{i:04d}", "name": f"Site é {i}", "latitude": 1.5 * i, "tags": ["a", "b"]}
+           for i in range(25)]
+
+COMPRESSIONS = [None, "gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    not rs.HAVE_ZSTD, reason="zstandard not installed"))]
+
+
+def digest(paths):
+    h = hashlib.sha256()
+    for p in paths:
+        with open(p, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("fmt", ["json", "ndjson"])
+def test_round_trip(tmp_path, fmt, compression):
+    path = rs.output_path(str(tmp_path), "sites", fmt, compression)
+    assert rs.write_records(path, iter(RECORDS)) == len(RECORDS)
+    assert list(rs.iter_records(path)) == RECORDS
+    assert rs.read_records(path) == RECORDS
+    assert [json.loads(r) if isinstance(r, str) else r for r in rs.raw_records(path)] == RECORDS
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_split_parts(tmp_path, compression):
+    path = rs.output_path(str(tmp_path), "links", "ndjson", compression)
+    assert rs.write_records(path, RECORDS, split_records=10) == len(RECORDS)
+    parts = rs.record_paths(path)
+    assert parts == [rs.part_path(path, k) for k in range(3)]
+    assert not os.path.exists(path)
+    assert list(rs.iter_records(path)) == RECORDS
+
+
+def test_stale_outputs_removed(tmp_path):
+    path = rs.output_path(str(tmp_path), "links", "ndjson", "gzip")
+    rs.write_records(path, RECORDS, split_records=5)
+    assert len(rs.record_paths(path)) == 5
+    rs.write_records(path, RECORDS[:3], split_records=5)
+    assert rs.record_paths(path) == [rs.part_path(path, 0)]
+    rs.write_records(path, RECORDS[:7])
+    assert rs.record_paths(path) == [path]
+    assert list(rs.iter_records(path)) == RECORDS[:7]
+
+
+def test_empty_outputs(tmp_path):
+    for fmt in ("json", "ndjson"):
+        path = rs.output_path(str(tmp_path), "sites", fmt, "gzip")
+        assert rs.write_records(path, []) == 0
+        assert list(rs.iter_records(path)) == []
+
+
+def test_gzip_output_is_reproducible(tmp_path):
+    a = rs.output_path(str(tmp_path / "a"), "links", "ndjson", "gzip")
+    b = rs.output_path(str(tmp_path / "b"), "links", "ndjson", "gzip")
+    os.makedirs(os.path.dirname(a)); os.makedirs(os.path.dirname(b))
+    rs.write_records(a, RECORDS, split_records=10)
+    time.sleep(1.1)  # a header mtime would differ by now
+    rs.write_records(b, RECORDS, split_records=10)
+    assert digest(rs.record_paths(a)) == digest(rs.record_paths(b))
+
+
+def test_find_output_prefers_latest(tmp_path):
+    d = str(tmp_path)
+    assert rs.find_output(d, "sites") is None
+    old = rs.output_path(d, "sites", "json")
+    rs.write_records(old, RECORDS)
+    os.utime(old, (1, 1))
+    split = rs.output_path(d, "sites", "ndjson", "gzip")
+    rs.write_records(split, RECORDS, split_records=10)
+    assert rs.find_output(d, "sites") == split
+    os.utime(old, None)
+    for p in rs.record_paths(split):
+        os.utime(p, (1, 1))
+    assert rs.find_output(d, "sites") == old
+
+
+def test_record_files_append_per_kind(tmp_path):
+    files = rs.RecordFiles(str(tmp_path), "ndjson", "gzip", split_records=10)
+    for k in range(0, len(RECORDS), 7):
+        files("sites", RECORDS[k:k+7])
+    files("links", [])
+    assert files.close() == {"sites": len(RECORDS), "links": 0}
+    assert list(rs.iter_records(files.path("sites"))) == RECORDS
+    assert list(rs.iter_records(files.path("links"))) == []
+
+
+def test_tee_sinks_batches(monkeypatch, tmp_path):
+    monkeypatch.setattr(rs, "QUEUE_BATCH", 4)
+    seen = []
+    files = rs.RecordFiles(str(tmp_path))
+    tee = rs.tee_sinks(lambda kind, batch: seen.append(list(batch)), None, files)
+    assert tee("sites", iter(RECORDS)) == len(RECORDS)
+    files.close()
+    assert max(len(b) for b in seen) == 4
+    assert [r for b in seen for r in b] == RECORDS
+    assert rs.read_records(files.path("sites")) == RECORDS
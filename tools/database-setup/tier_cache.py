@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of the generator's per-tier link tables.
+
+generate-realV3.py keys each tier's reconciled topology (endpoints, tier code,
+routed km and route waypoints; geometry is built later for every link) by a
+SHA-256 over everything the tier depends on: its spec and budget, the site
+table, the hub selection, the shard layout, the seed and the source of the
+modules that generate it (files_key()), so editing the generator invalidates
+its cached tiers without a manual version bump. A rerun loads every
+tier whose key is unchanged and generates only the others. Healing and bridging
+depend on all tiers and always run.
+
+Entries are pickles named <tier>-<key>.pkl in one directory; storing a tier
+removes its older entries, so the cache holds one entry per tier.
+"""
+import array
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+from typing import Any, Iterable, Optional
+
+try:
+    import numpy as np
+    HAVE_NP = True
+except Exception:
+    HAVE_NP = False
+
+
+def _plain(x: Any) -> Any:
+    """JSON-able stand-in for values json.dumps() cannot encode: arrays hash to their bytes."""
+    if HAVE_NP and isinstance(x, np.ndarray):
+        return [x.dtype.str, list(x.shape), hashlib.sha256(np.ascontiguousarray(x).tobytes()).hexdigest()]
+    if isinstance(x, array.array):
+        return [x.typecode, len(x), hashlib.sha256(x.tobytes()).hexdigest()]
+    if isinstance(x, (set, frozenset)):
+        return sorted(x)
+    raise TypeError(f"cannot key {type(x).__name__}")
+
+
+def cache_key(spec: Any) -> str:
+    """SHA-256 of a nested structure of JSON values, arrays and sets (dict order does not matter)."""
+    text = json.dumps(spec, sort_keys=True, default=_plain, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def files_key(paths: Iterable[str]) -> str:
+    """SHA-256 over the contents of paths, in order."""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def cache_path(directory: str, name: str, key: str) -> str:
+    return os.path.join(directory, f"{_slug(name)}-{key[:24]}.pkl")
+
+
+def load_cached(directory: str, name: str, key: str) -> Optional[Any]:
+    """The value stored for (name, key), or None if there is none or it cannot be read."""
+    try:
+        with open(cache_path(directory, name, key), "rb") as f:
+            stored_key, value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    return value if stored_key == key else None
+
+
+def store_cached(directory: str, name: str, key: str, value: Any):
+    """Write (name, key) atomically and drop the other entries of name."""
+    os.makedirs(directory, exist_ok=True)
+    path = cache_path(directory, name, key)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    for old in glob.glob(os.path.join(directory, f"{_slug(name)}-*.pkl")):
+        if old != path:
+            os.remove(old)